@@ -0,0 +1,106 @@
+# api.py
+# Response helpers for the versioned JSON API (/api/v1/...) used by the Android
+# client.
+#
+# Every endpoint first reads a cheap change marker for its data (max product id
+# and count, the price snapshot time, the newest message in a user's inbox) and
+# derives a strong ETag from it plus the request's parameters. A client that
+# sends the ETag back in If-None-Match (or a Last-Modified date in
+# If-Modified-Since) gets an empty 304 without the page query or any
+# serialization running. Full responses are compact JSON, gzipped when the
+# client accepts it, and ?fields=a,b trims list items to the fields a screen
+# actually shows.
+
+import gzip
+import hashlib
+import json
+from datetime import timezone
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+API_VERSION = 'v1'
+GZIP_MIN_BYTES = 512      # smaller bodies are not worth the CPU or the gzip header
+GZIP_LEVEL = 6
+GZIP_ETAG_SUFFIX = '-gz'  # the compressed body is a different representation, so a different strong ETag
+
+
+class FieldError(ValueError):
+    pass
+
+
+def parse_fields(allowed):
+    """Field names from ?fields=a,b (None when absent). Raises FieldError for names not in allowed."""
+    value = request.args.get('fields', '').strip()
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise FieldError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(allowed)}")
+    return fields
+
+
+def select_fields(items, fields):
+    if fields is None:
+        return items
+    return [{f: item[f] for f in fields} for item in items]
+
+
+def make_etag(*parts):
+    """Strong ETag over the endpoint's change marker and everything else the body depends on."""
+    raw = json.dumps([API_VERSION, *parts], sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:24]
+
+
+def _wants_gzip():
+    return 'gzip' in request.accept_encodings
+
+
+def not_modified(etag, last_modified=None):
+    """
+    The ETag of the client's cached copy if it is current, else None.
+    If-None-Match wins over If-Modified-Since, as RFC 9110 requires.
+    """
+    if request.if_none_match:
+        for variant in (etag, etag + GZIP_ETAG_SUFFIX):
+            if request.if_none_match.contains(variant):
+                return variant
+        return None
+    if last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates have one-second resolution.
+        if last_modified.replace(microsecond=0) <= request.if_modified_since:
+            return etag + GZIP_ETAG_SUFFIX if _wants_gzip() else etag
+    return None
+
+
+def _headers(response, etag, last_modified, private):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # Always revalidate; a 304 costs a few hundred bytes.
+    response.headers['Cache-Control'] = f"{'private' if private else 'public'}, no-cache"
+    response.vary.add('Accept-Encoding')
+    if private:
+        response.vary.add('Cookie')
+    return response
+
+
+def conditional_json(etag, build, last_modified=None, private=False):
+    """
+    304 if the client already has this version, else build() serialized as
+    compact (and, when accepted, gzipped) JSON. last_modified is an aware or
+    UTC-naive datetime.
+    """
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return _headers(Response(status=304), cached, last_modified, private)
+    body = json.dumps(build(), ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    if _wants_gzip() and len(body) >= GZIP_MIN_BYTES:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+        etag += GZIP_ETAG_SUFFIX
+    return _headers(response, etag, last_modified, private)
@@ -1,91 +1,198 @@
-# app.py - FINAL DATABASE VERSION (with Auto-Create)
+# app.py - application factory, routes and CLI commands.
+#
+# Importing this module is cheap and side-effect free: no database connection,
+# no model SDK import, no network. Create tables with `flask --app app init-db`.
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_, inspect
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, current_app
+from flask.cli import with_appcontext
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import or_, inspect, func, tuple_, case, update
+from sqlalchemy.orm import aliased
+from markupsafe import Markup
 from dotenv import load_dotenv
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 from urllib.parse import quote_plus
 import random
+import secrets
+import shutil
+import json
+import time
 from functools import wraps
+import click
 
-# --- Local Module Imports ---
-from ml_model.predictor import predict_disease
-from scripts.price_scraper import get_market_prices
-
-# --- Initial Setup ---
+# Before the local imports, some of which read their settings from the environment.
 load_dotenv()
-app = Flask(__name__)
-app.secret_key = 'your_super_secret_key'
-
-# app.py
-
-# --- Database Configuration ---
-# This new logic checks if the live DATABASE_URL exists.
-# If not, it creates a local database file named 'instance/krishimitra.sqlite'.
-db_url = os.getenv('DATABASE_URL')
-if not db_url:
-    # Set up the path for the local SQLite database
-    project_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(project_dir, "instance", "krishimitra.sqlite")
-    # Ensure the 'instance' directory exists
-    os.makedirs(os.path.join(project_dir, "instance"), exist_ok=True)
-    db_url = f"sqlite:///{db_path}"
-
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-# -----------------------------
+
+# --- Local Module Imports ---
+from models import db, User, Product, Conversation, DetectionJob, DataVersion, PasswordReset, bump_version, parse_price
+from ml_model.jobs import BoundedJobPool, QueueFullError
+from scripts.price_scraper import get_price_snapshot, start_background_refresher
+from scripts.price_history import iter_api_pages, iter_fixture_pages, ingest_pages, price_trend, market_breakdown
+from scripts.legacy_import import DATA_DIR, IMPORT_BATCH_SIZE, LegacyImporter
+from migrations import run_migrations
+import engine_profile
+from engine_profile import read_replica
+import instrumentation
+import outbound
+import auth_hashing
+import assets
+import fragment_cache
+import uploads
+import notifications
+from api import FieldError, conditional_json, make_etag, parse_fields, select_fields
+from uploads import get_store, release, retain, upload_thumbnail, upload_url
+from auth_hashing import HashingBusyError, allow_attempt, hash_password, verify_password
+from instrumentation import query_budget
+import chat
+from chat import fetch_messages, get_notifier, message_json, CHAT_PAGE_SIZE, CHAT_STREAM_SECONDS
+from notifications import get_dispatcher
+from search import apply_search, ensure_search_index, index_product, remove_product
+import recommendations
+from recommendations import get_recommendations
+from image_utils import UploadError, MAX_UPLOAD_BYTES
+from field_scan import BatchError, BATCH_MAX_BYTES, collect_images, content_names, run_batch, summarize
 
 # --- Configuration ---
-UPLOAD_FOLDER = 'static/product_uploads'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+STORE_PAGE_SIZE = 24
+STORE_MAX_PAGE_SIZE = 60
+STORE_SORTS = ('newest', 'price_asc', 'price_desc')
+OWNER_ACTIONS = ('<form action="{url}" method="POST" onsubmit="return confirm(\'Are you sure?\');">'
+                 '<button type="submit" class="btn btn-outline-danger btn-sm">Delete</button></form>')
+OTP_TTL_SECONDS = 600
+OTP_MAX_ATTEMPTS = 5
+LANGUAGES = ('en', 'mr')  # translations/ ships Marathi
+
+
+def default_database_url():
+    """DATABASE_URL if set, otherwise the local SQLite file instance/krishimitra.sqlite (its folder is made by init_db)."""
+    return os.getenv('DATABASE_URL') or f"sqlite:///{os.path.join(PROJECT_DIR, 'instance', 'krishimitra.sqlite')}"
+
+
+# Views register themselves here with @route and are added to each app by create_app(),
+# so endpoint names (url_for('store'), ...) are the same as with @app.route.
+_routes = []
+
+def route(rule, **options):
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config=None):
+    """
+    Builds and configures the Flask app. `config` overrides the environment-derived
+    settings (e.g. {'DATABASE_URL': ..., 'TESTING': True}).
+    """
+    config = dict(config or {})
+    app = Flask(__name__)
+    # Signs the session cookie. Must be set, and the same, on every worker in production.
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+
+    # --- Database Configuration ---
+    # Backend-specific engine tuning (SQLite WAL/busy_timeout, Postgres pool sizing);
+    # DATABASE_REPLICA_URL optionally serves the read-only pages from a replica.
+    engine_profile.configure(app, config.pop('DATABASE_URL', None) or default_database_url(),
+                             replica_url=config.pop('DATABASE_REPLICA_URL', os.getenv('DATABASE_REPLICA_URL')))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# --- DATABASE MODELS ---
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    mobile = db.Column(db.String(20), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False)
-    role = db.Column(db.String(20), nullable=False)
-    products = db.relationship('Product', backref='seller_user', lazy=True)
-
-class Product(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(50), nullable=False)
-    description = db.Column(db.Text, nullable=False)
-    price = db.Column(db.String(50), nullable=False)
-    image = db.Column(db.String(100), nullable=False)
-    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-
-class Conversation(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
-    product = db.relationship('Product', backref='conversations')
-    buyer = db.relationship('User', foreign_keys=[buyer_id])
-    seller = db.relationship('User', foreign_keys=[seller_id])
-
-class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
-    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    text = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    sender = db.relationship('User', foreign_keys=[sender_id])
+    # Werkzeug stops reading the request body past this; image_utils enforces the per-file limit.
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
+    # PREDICTOR_BACKEND=stub swaps in an offline predictor (no Gemini key needed).
+    app.config['PREDICTOR_BACKEND'] = os.getenv('PREDICTOR_BACKEND', 'gemini')
+    # Disease detection runs in a background pool so uploads never hold a request worker.
+    app.config['DETECTION_WORKERS'] = int(os.getenv('DETECTION_WORKERS', 4))
+    app.config['DETECTION_QUEUE_DEPTH'] = int(os.getenv('DETECTION_QUEUE_DEPTH', 16))
+    app.config['DETECTION_JOB_TIMEOUT'] = int(os.getenv('DETECTION_JOB_TIMEOUT', 120))
+    # Per-request query counts/timings; QUERY_STATS_HEADERS=1 exposes them as response headers.
+    app.config['QUERY_STATS_HEADERS'] = os.getenv('QUERY_STATS_HEADERS') == '1'
+    # Number of reverse proxies (nginx, a load balancer) in front of gunicorn. Their
+    # X-Forwarded-For/-Proto are trusted for that many hops, so request.remote_addr is
+    # the client's address for the per-IP login buckets and the local-only stats pages.
+    app.config['PROXY_FIX_HOPS'] = int(os.getenv('PROXY_FIX_HOPS', 0))
+    app.config.update(config)
+    if app.config['PROXY_FIX_HOPS']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
+    if not app.secret_key:
+        app.logger.warning("SECRET_KEY is not set; using a random key, so sessions end when this process exits.")
+        app.secret_key = secrets.token_hex(32)
+
+    db.init_app(app)
+    # Wakes open chats; one watcher thread per app, started by the first waiting stream.
+    chat.init_app(app)
+    # OTP email/SMS go through a queue table and background workers, never inline in a request.
+    notifications.init_app(app)
+    instrumentation.init_app(app)
+    # Latency/error/breaker state of Gemini, data.gov.in, Fast2SMS and SMTP at /_stats/outbound.
+    outbound.init_app(app)
+    # Password hashes run in a bounded process pool; logins are throttled per IP and per account.
+    auth_hashing.init_app(app)
+    # Fingerprinted, resized and precompressed site assets from `flask build-assets`, served from /assets.
+    assets.init_app(app)
+    # Rendered store grids, invalidated by a version stamp bumped on product writes
+    # and by the catalog DataVersion, which every worker sees.
+    fragment_cache.init_app(app, version_source=data_version)
+    # Uploads are stored by content hash with reference counts; `flask gc-uploads` reclaims the unused ones.
+    uploads.init_app(app)
+    # Remedy keyword -> store products for the detection page, per worker.
+    recommendations.init_app(app)
+    # The pool creates its threads on first use, so forking servers (gunicorn --preload) stay safe.
+    app.extensions['detection_pool'] = BoundedJobPool(max_workers=app.config['DETECTION_WORKERS'], max_queue=app.config['DETECTION_QUEUE_DEPTH'])
+
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.register_error_handler(413, upload_too_large)
+    app.register_error_handler(HashingBusyError, hashing_busy)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(ingest_prices_command)
+    app.cli.add_command(import_legacy_command)
+    app.cli.add_command(send_notifications_command)
+    app.cli.add_command(build_assets_command)
+    return app
+
+
+# --- Disease predictor (resolved on first use) ---
+def get_predictor():
+    """
+    predict_disease for the configured backend, behind the local classifier tier
+    (ml_model/local_classifier.py). Imported on first use so the model SDK and
+    NumPy stay out of worker start-up.
+    """
+    predictor = current_app.extensions.get('predictor')
+    if predictor is None:
+        from ml_model.local_classifier import local_first
+        if current_app.config['PREDICTOR_BACKEND'] == 'stub':
+            from ml_model.stub_predictor import predict_disease as remote
+        else:
+            from ml_model.predictor import predict_disease as remote
+        # Confident answers from the CPU-only local classifier skip the remote model.
+        predictor = current_app.extensions['predictor'] = local_first(remote)
+    return predictor
+
+def predict_disease(image_path):
+    return get_predictor()(image_path)
+
+def get_detection_pool():
+    return current_app.extensions['detection_pool']
+
+def get_fragment_cache():
+    return current_app.extensions['fragment_cache']
+
+def data_version(name):
+    """The DataVersion counter for a data set (0 if it has none): the fragment cache's cross-worker change marker."""
+    return db.session.query(DataVersion.version).filter_by(name=name).scalar() or 0
 
 # --- Helper Functions ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def clear_password_reset():
+    session.pop('reset_user_id', None)
+
 def seller_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -95,6 +202,186 @@ def seller_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def upload_too_large(e):
+    message = f"Image is too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)."
+    if request.path.startswith(('/detect/jobs', '/detect/batch')):
+        return jsonify({'error': message}), 413
+    flash(message, 'error')
+    return redirect(request.url)
+
+def hashing_busy(e):
+    """Login/register/OTP forms while every password-hashing slot is taken: ask the user to retry."""
+    flash(str(e), 'error')
+    return redirect(request.url)
+
+def get_product_suggestions(prediction_data):
+    """Store products and external search links for a diagnosis' product_keyword."""
+    keyword = prediction_data.get('product_keyword')
+    suggested_products, amazon_link, flipkart_link = [], None, None
+    if keyword:
+        suggested_products = get_recommendations().suggest(keyword)
+        url_safe_keyword = quote_plus(keyword)
+        amazon_link = f"https://www.amazon.in/s?k={url_safe_keyword}"
+        flipkart_link = f"https://www.flipkart.com/search?q={url_safe_keyword}"
+    return suggested_products, amazon_link, flipkart_link
+
+def run_detection_job(app, job_id):
+    """Runs in a detection pool thread: predicts and stores the result on the job row."""
+    with app.app_context():
+        try:
+            job = db.session.get(DetectionJob, job_id)
+            if job is None:
+                return
+            job.status = 'running'
+            db.session.commit()
+            # The downscaled inference variant is an order of magnitude fewer bytes to send to the model.
+            image_path = get_store('leaf').variant(job.image, 'inference')
+            prediction_data = predict_disease(image_path)
+            job.result = json.dumps(prediction_data)
+            job.status = 'failed' if prediction_data.get('disease_name') == 'Prediction Error' else 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            print(f"Detection job {job_id} failed: {e}")
+            db.session.rollback()
+            job = db.session.get(DetectionJob, job_id)
+            if job is not None:
+                job.status, job.error, job.finished_at = 'failed', str(e)[:200], datetime.utcnow()
+                db.session.commit()
+        finally:
+            db.session.remove()
+
+def submit_detection_job(file):
+    """
+    Saves and normalizes a leaf upload, records a DetectionJob and queues it.
+    Raises UploadError for bad images and QueueFullError when the pool is saturated.
+    """
+    job = DetectionJob(image=get_store('leaf').save(file))
+    db.session.add(job)
+    db.session.commit()
+    try:
+        get_detection_pool().submit(run_detection_job, current_app._get_current_object(), job.id)
+    except QueueFullError as e:
+        job.status, job.error, job.finished_at = 'failed', str(e), datetime.utcnow()
+        db.session.commit()
+        raise
+    return job
+
+def get_detection_job(job_id):
+    """Loads a job, failing it if it has been pending longer than DETECTION_JOB_TIMEOUT (e.g. its worker died)."""
+    job = db.session.get(DetectionJob, job_id)
+    if job and job.status in ('queued', 'running'):
+        age = (datetime.utcnow() - job.created_at).total_seconds()
+        if age > current_app.config['DETECTION_JOB_TIMEOUT']:
+            job.status, job.error, job.finished_at = 'failed', 'Detection timed out.', datetime.utcnow()
+            db.session.commit()
+    return job
+
+def parse_store_cursor(value):
+    """Store cursors are '<id>' when browsing newest first, '<rank>:<id>' for ranked search results and '<price>:<id>' when sorting by price."""
+    if not value:
+        return None
+    try:
+        if ':' in value:
+            key, product_id = value.rsplit(':', 1)
+            return float(key), int(product_id)
+        return None, int(value)
+    except ValueError:
+        return None
+
+def get_store_args():
+    """Store filters from the query string, in the form url_for() takes them back."""
+    sort = request.args.get('sort')
+    return {
+        'category': request.args.get('category') or None,
+        'search': ' '.join(request.args.get('search', '').lower().split()) or None,
+        'sort': sort if sort in STORE_SORTS and sort != 'newest' else None,
+        'min_price': request.args.get('min_price', type=float),
+        'max_price': request.args.get('max_price', type=float),
+    }
+
+def build_store_query(category=None, search=None, sort=None, min_price=None, max_price=None, after=None):
+    """
+    The store card query, filtered and ordered entirely in SQL. Every ordering
+    is served by an index: (category, id) for newest first, (category,
+    price_amount) / (price_amount) for price sorts; searches order by rank
+    unless a price sort is requested.
+    """
+    query = db.session.query(
+        Product.id, Product.name, Product.category, Product.price, Product.price_amount, Product.price_unit,
+        Product.image, Product.seller_id,
+        # Cards show at most 80 characters; don't pull whole descriptions off disk.
+        func.substr(Product.description, 1, 100).label('description'),
+        User.email.label('seller'),
+    ).join(User, Product.seller_id == User.id)
+    if category:
+        query = query.filter(Product.category == category)
+    if min_price is not None:
+        query = query.filter(Product.price_amount >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price_amount <= max_price)
+
+    if sort in ('price_asc', 'price_desc'):
+        # Products without a readable price are only listed in the default order.
+        query = query.filter(Product.price_amount.isnot(None))
+        if search:
+            query = apply_search(query, search, ordered=False)
+        key = tuple_(Product.price_amount, Product.id)
+        if sort == 'price_asc':
+            if after and after[0] is not None:
+                query = query.filter(key > tuple_(after[0], after[1]))
+            return query.order_by(Product.price_amount.asc(), Product.id.asc())
+        if after and after[0] is not None:
+            query = query.filter(key < tuple_(after[0], after[1]))
+        return query.order_by(Product.price_amount.desc(), Product.id.desc())
+
+    if search:
+        return apply_search(query, search, with_rank=True, after=after)
+    if after:
+        query = query.filter(Product.id < after[1])
+    return query.order_by(Product.id.desc())
+
+def get_store_page(category=None, search=None, sort=None, min_price=None, max_price=None, after=None, per_page=STORE_PAGE_SIZE):
+    """
+    One page of store cards using keyset pagination, loading only the columns
+    the card grid renders. Returns (rows, next_cursor).
+    """
+    per_page = max(1, min(per_page, STORE_MAX_PAGE_SIZE))
+    query = build_store_query(category, search, sort, min_price, max_price, after)
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        if sort in ('price_asc', 'price_desc'):
+            next_cursor = f"{last.price_amount!r}:{last.id}"
+        elif search:
+            next_cursor = f"{last.search_rank!r}:{last.id}"
+        else:
+            next_cursor = str(last.id)
+    return rows, next_cursor
+
+def store_card_json(row):
+    """JSON shape of a store card, for infinite scroll."""
+    thumb = upload_thumbnail('product', row.image)
+    card = {
+        'id': row.id,
+        'name': row.name,
+        'category': row.category,
+        'description': row.description[:80],
+        'price': row.price,
+        'price_amount': row.price_amount,
+        'price_unit': row.price_unit,
+        'seller': row.seller,
+        'image': thumb['jpg'],
+        'image_webp': thumb['webp'],
+        'contact_url': url_for('conversation_start', product_id=row.id),
+        'delete_url': None,
+    }
+    if session.get('role') == 'seller' and session.get('user_id') == row.seller_id:
+        card['delete_url'] = url_for('delete_product', product_id=row.id)
+    return card
+
 def get_market_status():
     IST = pytz.timezone('Asia/Kolkata')
     now = datetime.now(IST)
@@ -103,30 +390,42 @@ def get_market_status():
     else: return f"Market is currently closed (10 AM - 6 PM IST). (Current time: {now.strftime('%I:%M %p')})", False
 
 # --- ROUTES ---
-@app.route('/')
+@route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email, mobile, password = request.form['email'], request.form['mobile'], request.form['password']
+        if not allow_attempt():
+            flash('Too many attempts. Please wait a minute and try again.', 'error')
+            return render_template('register.html'), 429
         if User.query.filter(or_(User.email == email, User.mobile == mobile)).first():
             flash('An account with this email or mobile number already exists.', 'error')
             return redirect(url_for('register'))
-        new_user = User(email=email, mobile=mobile, password=generate_password_hash(password), role=request.form['role'])
+        new_user = User(email=email, mobile=mobile, password=hash_password(password), role=request.form['role'])
         db.session.add(new_user)
         db.session.commit()
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         identifier, password = request.form['email'], request.form['password']
+        # Checked before any hashing, so brute-force traffic costs no CPU.
+        if not allow_attempt(identifier):
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('login.html'), 429
         user = User.query.filter(or_(User.email == identifier, User.mobile == identifier)).first()
-        if user and check_password_hash(user.password, password):
+        matches, new_hash = verify_password(user.password, password) if user else (False, None)
+        if matches:
+            if new_hash:
+                # Hash parameters changed since this password was set; upgrade it transparently.
+                user.password = new_hash
+                db.session.commit()
             session['user_id'], session['user_email'], session['role'] = user.id, user.email, user.role
             flash('Logged in successfully!', 'success')
             return redirect(url_for('store'))
@@ -135,54 +434,110 @@ def login():
             return redirect(url_for('login'))
     return render_template('login.html')
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.', 'success')
     return redirect(url_for('home'))
 
-@app.route('/store')
+@route('/store')
+@query_budget(2)
+@read_replica
 def store():
-    query = Product.query
-    search_term, category = request.args.get('search', '').lower(), request.args.get('category')
-    if category: query = query.filter(Product.category == category)
-    if search_term: query = query.filter(or_(Product.name.ilike(f'%{search_term}%'), Product.description.ilike(f'%{search_term}%')))
-    products = query.order_by(Product.id.desc()).all()
+    args = get_store_args()
+    # Parsed before keying, so junk cursors share the first page's fragment.
+    after = parse_store_cursor(request.args.get('after'))
+    per_page = max(1, min(request.args.get('per_page', STORE_PAGE_SIZE, type=int), STORE_MAX_PAGE_SIZE))
+    # The card grid only changes when a product is written, so it is rendered once
+    # per filter/page/role/language and served from the fragment cache until then.
+    # The rest of the page (flashes, navbar, the seller's own buttons) is per request.
+    role = session.get('role')
+    language = request.accept_languages.best_match(LANGUAGES) or LANGUAGES[0]
+    grid = get_fragment_cache().get_or_render(
+        'catalog', [args, after, per_page, role, language], lambda: render_store_grid(args, after, per_page))
+    seller_email = session.get('user_email') if role == 'seller' else None
+    return render_template('store.html', grid=Markup(with_owner_actions(grid, seller_email)),
+                           active_category=args['category'], search_query=args['search'] or '', store_args=args)
+
+def render_store_grid(args, after, per_page):
+    """The cacheable part of /store: {'html': card grid, 'owners': {product id: seller email}}."""
+    products, next_cursor = get_store_page(**args, after=after, per_page=per_page)
+    search_term = args['search'] or ''
     amazon_link, flipkart_link = None, None
     if not products and search_term:
         url_safe_keyword = quote_plus(search_term)
         amazon_link = f"https://www.amazon.in/s?k={url_safe_keyword}"
         flipkart_link = f"https://www.flipkart.com/search?q={url_safe_keyword}"
-    return render_template('store.html', products=products, active_category=category, search_query=search_term, amazon_link=amazon_link, flipkart_link=flipkart_link)
+    next_url = url_for('store', **args, after=next_cursor) if next_cursor else None
+    next_json_url = url_for('store_json', **args, after=next_cursor) if next_cursor else None
+    html = render_template('store_grid.html', products=products, search_query=search_term, amazon_link=amazon_link, flipkart_link=flipkart_link, next_url=next_url, next_json_url=next_json_url)
+    return {'html': html, 'owners': {str(p.id): p.seller for p in products}}
+
+def with_owner_actions(grid, seller_email):
+    """Fills the grid's owner-actions markers: a Delete button on the seller's own products, nothing elsewhere."""
+    html = grid['html']
+    for product_id, owner in grid['owners'].items():
+        marker = f'<!--owner-actions:{product_id}-->'
+        actions = ''
+        if seller_email is not None and owner == seller_email:
+            actions = OWNER_ACTIONS.format(url=url_for('delete_product', product_id=int(product_id)))
+        html = html.replace(marker, actions, 1)
+    return html
 
-@app.route('/add_product', methods=['GET', 'POST'])
+@route('/store.json')
+@query_budget(2)
+def store_json():
+    args = get_store_args()
+    after = parse_store_cursor(request.args.get('after'))
+    products, next_cursor = get_store_page(**args, after=after, per_page=request.args.get('per_page', STORE_PAGE_SIZE, type=int))
+    return jsonify({
+        'products': [store_card_json(row) for row in products],
+        'next_cursor': next_cursor,
+        'next_url': url_for('store_json', **args, after=next_cursor) if next_cursor else None,
+    })
+
+@route('/add_product', methods=['GET', 'POST'])
 @seller_required
 def add_product():
     if request.method == 'POST':
         file = request.files['image']
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            new_product = Product(name=request.form['name'], category=request.form['category'], description=request.form['description'], price=request.form['price'], image=filename, seller_id=session['user_id'])
+            try:
+                filename = get_store('product').save(file)
+            except UploadError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('add_product'))
+            price_amount, price_unit = parse_price(request.form['price'])
+            new_product = Product(name=request.form['name'], category=request.form['category'], description=request.form['description'], price=request.form['price'], price_amount=price_amount, price_unit=price_unit, image=filename, seller_id=session['user_id'])
             db.session.add(new_product)
+            db.session.flush()
+            index_product(new_product)
+            bump_version('catalog')
             db.session.commit()
+            get_fragment_cache().bump('catalog')
+            get_recommendations().product_added(new_product)
             flash('Your product has been listed!', 'success')
             return redirect(url_for('store'))
     return render_template('add_product.html')
 
-@app.route('/delete_product/<int:product_id>', methods=['POST'])
+@route('/delete_product/<int:product_id>', methods=['POST'])
 @seller_required
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     if product.seller_id != session.get('user_id'):
         flash('You are not authorized to delete this product.', 'error')
         return redirect(url_for('store'))
+    remove_product(product.id)
+    release('product', product.image)
     db.session.delete(product)
+    bump_version('catalog')
     db.session.commit()
+    get_fragment_cache().bump('catalog')
+    get_recommendations().product_removed(product_id)
     flash('Product has been deleted successfully.', 'success')
     return redirect(url_for('store'))
 
-@app.route('/detect', methods=['GET', 'POST'])
+@route('/detect', methods=['GET', 'POST'])
 def disease_detection():
     if request.method == 'POST':
         if 'leaf_image' not in request.files or request.files['leaf_image'].filename == '':
@@ -191,42 +546,179 @@ def disease_detection():
         
         file = request.files['leaf_image']
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            leaf_upload_path = os.path.join('static/leaf_uploads', filename)
-            file.save(leaf_upload_path)
-            
-            prediction_data = predict_disease(leaf_upload_path)
-            keyword = prediction_data.get('product_keyword')
-            
-            suggested_products = []
-            amazon_link = None
-            flipkart_link = None
-            
-            if keyword:
-                suggested_products = Product.query.filter(or_(Product.name.ilike(f'%{keyword}%'), Product.description.ilike(f'%{keyword}%'))).all()
-                url_safe_keyword = quote_plus(keyword)
-                amazon_link = f"https://www.amazon.in/s?k={url_safe_keyword}"
-                flipkart_link = f"https://www.flipkart.com/search?q={url_safe_keyword}"
+            try:
+                job = submit_detection_job(file)
+            except (UploadError, QueueFullError) as e:
+                flash(str(e), 'error')
+                return redirect(url_for('disease_detection'))
+            return redirect(url_for('disease_detection', job=job.id))
 
+    # Without JavaScript the page polls itself via meta refresh until the job finishes.
+    job_id = request.args.get('job')
+    if job_id:
+        job = get_detection_job(job_id)
+        if job is None:
+            flash('That diagnosis could not be found.', 'error')
+            return redirect(url_for('disease_detection'))
+        if job.result:
+            prediction_data = json.loads(job.result)
+            suggested_products, amazon_link, flipkart_link = get_product_suggestions(prediction_data)
             return render_template(
                 'disease_detection.html', 
                 prediction_data=prediction_data,
-                uploaded_image=filename, 
+                uploaded_image=job.image, 
                 products=suggested_products,
                 amazon_link=amazon_link,
                 flipkart_link=flipkart_link
             )
+        if job.status == 'failed':
+            flash(job.error or 'Detection failed, please try again.', 'error')
+            return redirect(url_for('disease_detection'))
+        return render_template('disease_detection.html', prediction_data=None, pending_job=job)
     return render_template('disease_detection.html', prediction_data=None)
 
-@app.route('/prices')
+@route('/detect/jobs', methods=['POST'])
+def detection_job_submit():
+    file = request.files.get('leaf_image')
+    if not file or file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Unsupported file type'}), 400
+    try:
+        job = submit_detection_job(file)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('detection_job_status', job_id=job.id),
+        'result_url': url_for('disease_detection', job=job.id)
+    }), 202
+
+@route('/detect/jobs/<job_id>')
+@query_budget(3)  # load, plus the update and reload when a stuck job is timed out
+def detection_job_status(job_id):
+    job = get_detection_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    payload = {
+        'job_id': job.id,
+        'status': job.status,
+        'error': job.error,
+        'result_url': url_for('disease_detection', job=job.id)
+    }
+    if job.result:
+        payload['prediction'] = json.loads(job.result)
+    return jsonify(payload)
+
+@route('/detect/batch', methods=['POST'])
+def detection_batch():
+    """
+    Field scan: diagnoses many leaf photos (`leaf_images`, and/or a zip as
+    `archive`) in one request. Streams newline-delimited JSON: an `accepted`
+    line, one `result` line per distinct image as it finishes, then a `report`.
+    """
+    request.max_content_length = BATCH_MAX_BYTES
+    store = get_store('leaf')
+    # Images are spooled to disk one at a time, never all held in memory, and
+    # published from the spool once normalized, on the pool. The stream removes
+    # the spool when it ends; gc-uploads sweeps any a dropped request leaves.
+    spool = store.staging_dir()
+    streaming = False
+    try:
+        unique, rejected = collect_images(request.files.getlist('leaf_images'), request.files.get('archive'), spool)
+        saved = content_names(unique)
+        for name in saved.values():
+            retain('leaf', name)
+        db.session.commit()
+        streaming = True
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        if not streaming:
+            shutil.rmtree(spool, ignore_errors=True)
+
+    def line(payload):
+        return json.dumps(payload) + '\n'
+
+    def events():
+        yield line({
+            'type': 'accepted',
+            'images': sum(len(entry['files']) for entry in unique.values()),
+            'unique_images': len(unique),
+            'duplicates': [entry['files'] for entry in unique.values() if len(entry['files']) > 1],
+            'rejected': rejected,
+        })
+        results = []
+        try:
+            for result in run_batch(unique, saved, store, get_predictor(), get_detection_pool()):
+                results.append(result)
+                yield line({
+                    'type': 'result',
+                    'files': result['files'],
+                    'status': result['status'],
+                    'prediction': result['prediction'],
+                    'error': result['error'],
+                    # Only images that reached the model were published.
+                    'image_url': upload_url('leaf', result['filename']) if result['prediction'] is not None else None,
+                })
+        finally:
+            shutil.rmtree(spool, ignore_errors=True)
+        report = summarize(results)
+        products, seen = [], set()
+        for keyword in report['product_keywords']:
+            for product in get_recommendations().suggest(keyword):
+                if product.id not in seen:
+                    seen.add(product.id)
+                    products.append({
+                        'id': product.id,
+                        'name': product.name,
+                        'category': product.category,
+                        'price': product.price,
+                        'image': upload_thumbnail('product', product.image)['jpg'],
+                        'contact_url': url_for('conversation_start', product_id=product.id),
+                        'keyword': keyword,
+                    })
+        yield line({'type': 'report', **report, 'rejected': len(rejected), 'products': products})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson', headers=headers)
+
+@route('/prices')
+@read_replica
 def market_prices():
     market_status_message, market_is_open = get_market_status()
-    price_data = []
-    if market_is_open:
-        price_data = get_market_prices()
-    return render_template('market_prices.html', prices=price_data, market_status_message=market_status_message, market_is_open=market_is_open)
+    # Keeps the feed warm during market hours; a no-op after the first request.
+    start_background_refresher(should_refresh=lambda: get_market_status()[1])
+    # Outside market hours the last good snapshot is shown without calling the API.
+    price_data, fetched_at = get_price_snapshot(allow_fetch=market_is_open)
+    prices_as_of = None
+    if fetched_at:
+        prices_as_of = datetime.fromtimestamp(fetched_at, pytz.timezone('Asia/Kolkata')).strftime('%d %b %Y, %I:%M %p')
+    return render_template('market_prices.html', prices=price_data, prices_as_of=prices_as_of, market_status_message=market_status_message, market_is_open=market_is_open)
+
+@route('/prices/trends')
+@query_budget(3)
+def price_trends():
+    """JSON price history for a commodity, served from the local price store."""
+    commodity = request.args.get('commodity', '').strip()
+    if not commodity:
+        return jsonify({'error': 'commodity is required'}), 400
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD'}), 400
+    trend = price_trend(commodity, market=request.args.get('market') or None, start=start, end=end)
+    if not trend['market']:
+        # Same window as the trend, so the latest date isn't looked up a second time.
+        trend['markets'] = market_breakdown(commodity, start=datetime.strptime(trend['start'], '%Y-%m-%d').date(),
+                                            end=datetime.strptime(trend['end'], '%Y-%m-%d').date()) if trend['start'] else []
+    return jsonify(trend)
 
-@app.route('/conversation/start/<int:product_id>')
+@route('/conversation/start/<int:product_id>')
 def conversation_start(product_id):
     if 'user_id' not in session:
         flash('You must be logged in to start a conversation.', 'error')
@@ -257,7 +749,8 @@ def conversation_start(product_id):
         
     return redirect(url_for('conversation_chat', convo_id=convo.id))
 
-@app.route('/conversation/chat/<int:convo_id>', methods=['GET', 'POST'])
+@route('/conversation/chat/<int:convo_id>', methods=['GET', 'POST'])
+@query_budget(6)
 def conversation_chat(convo_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -272,51 +765,375 @@ def conversation_chat(convo_id):
     if request.method == 'POST':
         text = request.form.get('message_text')
         if text:
-            msg = Message(
-                conversation_id=convo.id,
-                sender_id=session['user_id'],
-                text=text,
-                timestamp=datetime.utcnow() # Ensure timestamp is set
-            )
-            db.session.add(msg)
+            msg = convo.add_message(session['user_id'], text)
             db.session.commit()
+            get_notifier().publish(convo.id, msg.id)
         return redirect(url_for('conversation_chat', convo_id=convo.id))
     
-    return render_template('conversation.html', conversation=convo)
+    if convo.mark_read(session['user_id']):
+        db.session.commit()
+    # Only the newest page is rendered; older history loads on demand.
+    messages = fetch_messages(convo.id, before=request.args.get('before', type=int))
+    has_older = len(messages) == CHAT_PAGE_SIZE
+    return render_template('conversation.html', conversation=convo, messages=messages, has_older=has_older)
+
+def get_chat_conversation(convo_id):
+    """The conversation if the logged-in user takes part in it, else None."""
+    if 'user_id' not in session:
+        return None
+    convo = db.session.get(Conversation, convo_id)
+    if convo is None or session['user_id'] not in (convo.buyer_id, convo.seller_id):
+        return None
+    return convo
+
+@route('/conversation/<int:convo_id>/messages', methods=['GET', 'POST'])
+@query_budget(5)
+def conversation_messages(convo_id):
+    """
+    GET ?after=<id>: messages newer than id (add &wait=<seconds> to long-poll).
+    GET ?before=<id>: the page of history before id.
+    POST: send a message, returns it as JSON.
+    """
+    convo = get_chat_conversation(convo_id)
+    if convo is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    user_id = session['user_id']
+
+    if request.method == 'POST':
+        text = (request.get_json(silent=True) or request.form).get('message_text', '').strip()
+        if not text:
+            return jsonify({'error': 'message_text is required'}), 400
+        msg = convo.add_message(user_id, text)
+        db.session.flush()
+        # Read before commit expires them, or each would cost another SELECT.
+        message_id = msg.id
+        db.session.commit()
+        get_notifier().publish(convo_id, message_id)
+        return jsonify({'message': message_json(fetch_messages(convo_id, after=message_id - 1, limit=1)[0])}), 201
+
+    limit = max(1, min(request.args.get('limit', CHAT_PAGE_SIZE, type=int), CHAT_PAGE_SIZE))
+    after = request.args.get('after', type=int)
+    if after is None:
+        rows = fetch_messages(convo.id, before=request.args.get('before', type=int), limit=limit)
+        return jsonify({'messages': [message_json(r) for r in rows], 'has_older': len(rows) == limit})
+
+    # Re-sends the last few ids below `after` in case one committed late; clients skip ids they have.
+    notifier, rescan = get_notifier(), current_app.config['CHAT_RESCAN_IDS']
+    version = notifier.version(convo_id)
+    rows = fetch_messages(convo.id, after=after, limit=limit, rescan=rescan)
+    wait = min(request.args.get('wait', 0, type=float), CHAT_STREAM_SECONDS)
+    if wait > 0 and not any(r.id > after for r in rows):
+        db.session.remove()  # don't hold a pooled connection while waiting
+        if notifier.wait(convo_id, version, wait):
+            rows = fetch_messages(convo_id, after=after, limit=limit, rescan=rescan)
+    return jsonify({'messages': [message_json(r) for r in rows]})
+
+@route('/conversation/<int:convo_id>/stream')
+def conversation_stream(convo_id):
+    """Server-sent events: pushes new messages until CHAT_STREAM_SECONDS, then the browser reconnects."""
+    convo = get_chat_conversation(convo_id)
+    if convo is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    user_id = session['user_id']
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+
+    notifier, rescan = get_notifier(), current_app.config['CHAT_RESCAN_IDS']
 
-@app.route('/inbox')
+    def events(after):
+        yield 'retry: 2000\n\n'
+        deadline = time.monotonic() + CHAT_STREAM_SECONDS
+        sent = set()  # ids pushed on this connection that are still inside the re-scan window
+        while time.monotonic() < deadline:
+            version = notifier.version(convo_id)
+            rows = [r for r in fetch_messages(convo_id, after=after, rescan=rescan) if r.id not in sent]
+            if any(r.sender_id != user_id for r in rows):
+                convo = db.session.get(Conversation, convo_id)
+                if convo.mark_read(user_id):
+                    db.session.commit()
+            db.session.remove()
+            for row in rows:
+                sent.add(row.id)
+                after = max(after, row.id)
+                # The event id is the resume cursor, so a late, lower id never moves it back.
+                yield f"id: {after}\nevent: message\ndata: {json.dumps(message_json(row))}\n\n"
+            sent = {message_id for message_id in sent if message_id > after - rescan}
+            if not rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not notifier.wait(convo_id, version, remaining):
+                    yield ': keep-alive\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events(after)), mimetype='text/event-stream', headers=headers)
+
+@route('/inbox')
+@query_budget(2)
+@read_replica
 def inbox():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-        
-    # Find all conversations where the user is either the buyer or the seller
-    conversations = Conversation.query.filter(
-        or_(Conversation.buyer_id == session['user_id'], Conversation.seller_id == session['user_id'])
-    ).all()
-    
-    # We will sort them in the template, or you can sort them here if needed
-    return render_template('inbox.html', conversations=conversations)
+    return render_template('inbox.html', conversations=get_inbox_conversations(session['user_id']))
+
+def get_inbox_conversations(user_id):
+    """
+    One query for the whole inbox: the summary columns on Conversation replace
+    per-row loads of product, both participants and every message.
+    """
+    Buyer, Seller = aliased(User), aliased(User)
+    return db.session.query(
+        Conversation.id,
+        Conversation.buyer_id,
+        Conversation.seller_id,
+        Conversation.last_message_text,
+        Conversation.last_message_at,
+        Conversation.buyer_unread,
+        Conversation.seller_unread,
+        Product.name.label('product_name'),
+        Buyer.email.label('buyer_email'),
+        Seller.email.label('seller_email'),
+    ).join(Product, Conversation.product_id == Product.id
+    ).join(Buyer, Conversation.buyer_id == Buyer.id
+    ).join(Seller, Conversation.seller_id == Seller.id
+    ).filter(
+        or_(Conversation.buyer_id == user_id, Conversation.seller_id == user_id)
+    ).order_by(Conversation.last_message_at.desc().nulls_last(), Conversation.id.desc()).all()
+
+# --- JSON API (v1) for the Android client; see api.py ---
+STORE_API_FIELDS = ('id', 'name', 'category', 'description', 'price', 'price_amount', 'price_unit', 'seller',
+                    'image', 'image_webp', 'contact_url', 'delete_url')
+PRICE_API_FIELDS = ('commodity', 'market', 'price')
+INBOX_API_FIELDS = ('id', 'product_name', 'other_party', 'last_message_text', 'last_message_at', 'unread', 'url')
 
-@app.route('/forgot_password', methods=['GET', 'POST'])
+def catalog_marker():
+    """
+    (catalog version, max product id, product count). The version changes on every
+    listing and delete; id and count also catch rows written without bumping it.
+    """
+    version = db.session.query(DataVersion.version).filter_by(name='catalog').scalar_subquery()
+    return tuple(db.session.query(version, func.max(Product.id), func.count(Product.id)).one())
+
+def inbox_marker(user_id):
+    """(conversations, newest message time, unread total) for one user: changes on every message and read."""
+    unread = case((Conversation.buyer_id == user_id, Conversation.buyer_unread), else_=Conversation.seller_unread)
+    return tuple(db.session.query(
+        func.count(Conversation.id), func.max(Conversation.last_message_at), func.coalesce(func.sum(unread), 0)
+    ).filter(or_(Conversation.buyer_id == user_id, Conversation.seller_id == user_id)).one())
+
+@route('/api/v1/store')
+@query_budget(3)
+@read_replica
+def api_store():
+    try:
+        fields = parse_fields(STORE_API_FIELDS)
+    except FieldError as e:
+        return jsonify({'error': str(e)}), 400
+    args = get_store_args()
+    after = request.args.get('after')
+    per_page = max(1, min(request.args.get('per_page', STORE_PAGE_SIZE, type=int), STORE_MAX_PAGE_SIZE))
+    # delete_url is only set for the seller's own products, so sellers get their own ETags.
+    viewer = session.get('user_id') if session.get('role') == 'seller' else None
+    etag = make_etag('store', catalog_marker(), args, after, per_page, fields, viewer)
+
+    def build():
+        products, next_cursor = get_store_page(**args, after=parse_store_cursor(after), per_page=per_page)
+        return {'products': select_fields([store_card_json(row) for row in products], fields),
+                'next_cursor': next_cursor}
+    # Products carry no timestamps, so the store revalidates by ETag only.
+    return conditional_json(etag, build, private=viewer is not None)
+
+@route('/api/v1/prices')
+def api_prices():
+    try:
+        fields = parse_fields(PRICE_API_FIELDS)
+    except FieldError as e:
+        return jsonify({'error': str(e)}), 400
+    market_is_open = get_market_status()[1]
+    start_background_refresher(should_refresh=lambda: get_market_status()[1])
+    records, fetched_at = get_price_snapshot(allow_fetch=market_is_open)
+    last_modified = datetime.fromtimestamp(fetched_at, pytz.utc) if fetched_at else None
+    etag = make_etag('prices', fetched_at, market_is_open, fields)
+    return conditional_json(etag, lambda: {
+        'prices': select_fields(records, fields),
+        'fetched_at': last_modified.isoformat() if last_modified else None,
+        'market_open': market_is_open,
+    }, last_modified=last_modified)
+
+@route('/api/v1/inbox')
+@query_budget(2)
+@read_replica
+def api_inbox():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    try:
+        fields = parse_fields(INBOX_API_FIELDS)
+    except FieldError as e:
+        return jsonify({'error': str(e)}), 400
+    user_id = session['user_id']
+    etag = make_etag('inbox', user_id, inbox_marker(user_id), fields)
+
+    def build():
+        conversations = [{
+            'id': c.id,
+            'product_name': c.product_name,
+            'other_party': c.buyer_email if c.seller_id == user_id else c.seller_email,
+            'last_message_text': c.last_message_text,
+            'last_message_at': c.last_message_at.isoformat() if c.last_message_at else None,
+            'unread': c.seller_unread if c.seller_id == user_id else c.buyer_unread,
+            'url': url_for('conversation_chat', convo_id=c.id),
+        } for c in get_inbox_conversations(user_id)]
+        return {'conversations': select_fields(conversations, fields)}
+    # No Last-Modified: reading a conversation changes unread counts without a newer message.
+    return conditional_json(etag, build, private=True)
+
+@route('/forgot_password', methods=['GET', 'POST'])
 def forgot_password():
-    # This route would need to be implemented with an email service
+    if request.method == 'POST':
+        email = request.form['email'].strip()
+        # Before the lookup, so throttling says nothing about whether the account exists.
+        if not allow_attempt(email, bucket='reset'):
+            flash('Too many reset requests. Please wait a few minutes and try again.', 'error')
+            return render_template('forgot_password.html'), 429
+        user = User.query.filter_by(email=email).first()
+        if user:
+            otp = f"{random.SystemRandom().randint(0, 999999):06d}"
+            # The OTP hash, expiry and attempt count stay in the database; the cookie only names the account.
+            db.session.merge(PasswordReset(user_id=user.id, otp_hash=hash_password(otp), attempts=0,
+                                           expires_at=datetime.utcnow() + timedelta(seconds=OTP_TTL_SECONDS)))
+            db.session.commit()
+            session['reset_user_id'] = user.id
+            # Queued; the notification workers deliver it by email and SMS.
+            get_dispatcher().send_otp(user, otp)
+        else:
+            clear_password_reset()
+        # Same answer either way, so the form can't be used to probe for accounts.
+        flash('If an account exists for that email, an OTP is on its way.', 'info')
+        return redirect(url_for('verify_otp'))
     return render_template('forgot_password.html')
 
-@app.route('/verify_otp', methods=['GET', 'POST'])
+@route('/verify_otp', methods=['GET', 'POST'])
 def verify_otp():
-    # This route would handle the OTP logic
+    if request.method == 'POST':
+        if not allow_attempt():
+            flash('Too many attempts. Please wait a minute and try again.', 'error')
+            return render_template('verify_otp.html'), 429
+        if request.form['new_password'] != request.form['confirm_password']:
+            flash('Passwords do not match.', 'error')
+            return redirect(url_for('verify_otp'))
+        user_id = session.get('reset_user_id')
+        # Claims one attempt in the same statement that checks expiry and the limit, so
+        # parallel or replayed requests can't get more than OTP_MAX_ATTEMPTS guesses.
+        claimed = user_id is not None and db.session.execute(
+            update(PasswordReset)
+            .where(PasswordReset.user_id == user_id, PasswordReset.expires_at > datetime.utcnow(),
+                   PasswordReset.attempts < OTP_MAX_ATTEMPTS)
+            .values(attempts=PasswordReset.attempts + 1)
+        ).rowcount == 1
+        db.session.commit()
+        if not claimed:
+            clear_password_reset()
+            flash('This OTP has expired. Please request a new one.', 'error')
+            return redirect(url_for('forgot_password'))
+        reset = db.session.get(PasswordReset, user_id)
+        if not verify_password(reset.otp_hash, request.form['otp'].strip())[0]:
+            flash('Incorrect OTP. Please try again.', 'error')
+            return redirect(url_for('verify_otp'))
+        user = db.session.get(User, user_id)
+        if user:
+            user.password = hash_password(request.form['new_password'])
+        db.session.delete(reset)
+        db.session.commit()
+        clear_password_reset()
+        flash('Password reset successfully. Please log in.', 'success')
+        return redirect(url_for('login'))
     return render_template('verify_otp.html')
 
-# --- This block runs ONCE when the app starts up ---
-with app.app_context():
-    inspector = inspect(db.engine)
-    # Check if the 'user' table exists. If not, create all tables.
-    if not inspector.has_table("user"):
+# --- Database setup ---
+def init_db():
+    """Creates missing tables, applies migrations and builds the search index. Safe to re-run."""
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+    if not inspect(db.engine).has_table("user"):
         print("Database tables not found, creating them...")
-        db.create_all()
+        # Primary only: a replica copies its schema, and another app's replica bind isn't configured here.
+        db.create_all(bind_key=None)
         print("Database tables created.")
     else:
-        print("Database tables already exist.")
+        db.create_all(bind_key=None)  # Adds any tables introduced since the database was first created.
+        run_migrations()
+    if db.session.get(DataVersion, 'catalog') is None:
+        # Created up front so concurrent first writes only ever UPDATE it.
+        db.session.add(DataVersion(name='catalog'))
+        db.session.commit()
+    ensure_search_index()
+
+# --- CLI Commands ---
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Creates/upgrades the database schema. Run once per deploy, before starting workers."""
+    init_db()
+    click.echo("Database is ready.")
+
+@click.command('ingest-prices')
+@click.option('--state', default=None, help='Only ingest one state (default: the whole resource).')
+@click.option('--page-size', default=1000, show_default=True)
+@click.option('--max-pages', default=None, type=int)
+@click.option('--fixture', default=None, help='Replay recorded API pages from this JSON file instead of calling data.gov.in.')
+@click.option('--repeat', default=1, show_default=True, help='With --fixture: replay the pages this many times.')
+@with_appcontext
+def ingest_prices_command(state, page_size, max_pages, fixture, repeat):
+    """Pages through the data.gov.in price resource into the local price table."""
+    if fixture:
+        pages = iter_fixture_pages(fixture, repeat=repeat)
+    else:
+        pages = iter_api_pages(page_size=page_size, state=state, max_pages=max_pages)
+    stats = ingest_pages(pages)
+    click.echo(f"Ingested {stats['upserted']} rows from {stats['pages']} pages "
+               f"({stats['skipped']} skipped) in {stats['seconds']}s - {stats['rows_per_sec']} rows/sec")
+
+@click.command('import-legacy')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory holding users.json, products.json and messages.json.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per insert transaction.')
+@with_appcontext
+def import_legacy_command(data_dir, batch_size):
+    """Streams the pre-database JSON files into the database. Already-imported records are skipped."""
+    results = LegacyImporter(batch_size=batch_size).import_files(data_dir)
+    if not results:
+        raise click.ClickException(f"No legacy JSON files found in {data_dir}.")
+    for kind, stats in results.items():
+        extra = f" with {stats['messages']} messages ({stats['skipped_messages']} skipped)" if 'messages' in stats else ''
+        click.echo(f"Imported {stats['inserted']} {kind}{extra} from {stats['records']} records ({stats['merged']} merged, "
+                   f"{stats['existing']} already imported, {stats['skipped']} skipped) "
+                   f"in {stats['seconds']}s - {stats['rows_per_sec']} rows/sec")
+    if results.get('products', {}).get('inserted'):
+        get_recommendations().invalidate()
+        get_fragment_cache().bump('catalog')
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Writes resized/WebP images, fingerprinted CSS and its gzip/brotli copies to ASSETS_DIR. Run once per deploy."""
+    started = time.perf_counter()
+    manifest = assets.build(out_dir=current_app.config['ASSETS_DIR'])
+    assets.reload(current_app)
+    click.echo(f"Built {len(manifest['images'])} images and {len(manifest['files']) - len(manifest['images'])} "
+               f"stylesheets in {time.perf_counter() - started:.1f}s.")
+
+@click.command('send-notifications')
+@with_appcontext
+def send_notifications_command():
+    """Delivers every queued OTP email/SMS that is due, e.g. from cron when NOTIFY_*_WORKERS=0."""
+    dispatcher = get_dispatcher()
+    handled = dispatcher.drain()
+    click.echo(f"Handled {handled} notifications.")
+    for channel, stats in dispatcher.stats().items():
+        click.echo(f"{channel}: {stats}")
+
+# For gunicorn app:app and `flask --app app ...`.
+app = create_app()
 
 if __name__ == '__main__':
+    # Development server: make sure the schema exists first.
+    with app.app_context():
+        init_db()
     app.run(debug=True)
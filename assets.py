@@ -0,0 +1,280 @@
+# assets.py
+# Build step and serving for the site's own static assets (background and
+# feature images, style.css).
+#
+# `flask --app app build-assets` (run at deploy, next to init-db) writes
+# static/dist/:
+#   - every image in static/images as JPEG and WebP at each ASSET_WIDTHS width
+#     up to the original's,
+#   - style.css, minified, with its url(...) images pointing at those variants
+#     (WebP through image-set(), the JPEG as fallback for older browsers, and
+#     smaller backgrounds for phones),
+#   - gzip copies of the CSS, and brotli copies when the brotli package is installed,
+# every file named by a hash of its content, plus manifest.json mapping the
+# original names to them. /assets/<file> serves that directory with a one-year
+# immutable Cache-Control and a content-hash ETag, choosing a precompressed
+# copy when the client accepts one, so repeat visits fetch nothing.
+#
+# Templates reference assets through asset_url('css/style.css') and
+# responsive_image('images/store.jpg', ...). Before the first build both fall
+# back to the plain /static URLs.
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+from flask import current_app, request, send_from_directory, url_for, abort
+from markupsafe import Markup, escape
+from PIL import Image, ImageOps
+from werkzeug.security import safe_join
+
+from image_utils import flatten
+
+try:
+    import brotli
+except ImportError:  # optional: gzip copies are always built
+    brotli = None
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(PROJECT_DIR, 'static')
+DEFAULT_ASSETS_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+ASSET_WIDTHS = (480, 960, 1600)
+CSS_IMAGE_WIDTH = 1600          # backgrounds are full-bleed; the largest variant
+SMALL_SCREEN_WIDTH = 960        # phones get the 960px backgrounds instead
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+ASSET_MAX_AGE = 365 * 24 * 3600
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+CSS_FILES = ('css/style.css',)
+
+URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+BACKGROUND_RE = re.compile(r'(background(?:-image)?\s*:[^;{}]*?url\(\s*([\'"]?)([^\'")]+)\2\s*\)[^;{}]*;)')
+RULE_RE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+
+
+# --- Build ---
+def _content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _write_hashed(out_dir, name, data):
+    """Writes data as <stem>.<hash><ext> under out_dir. Returns the path relative to out_dir."""
+    stem, ext = os.path.splitext(name)
+    relative = f"{stem}.{_content_hash(data)}{ext}"
+    path = os.path.join(out_dir, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        with open(path, 'wb') as out:
+            out.write(data)
+    return relative
+
+
+def _encode(img, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        img.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        img.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return buffer.getvalue()
+
+
+def build_image(static_dir, out_dir, name):
+    """Resized JPEG and WebP variants of static/<name>: {'width', 'height', 'jpeg': [[w, path]], 'webp': [...]}."""
+    with Image.open(os.path.join(static_dir, name)) as src:
+        img = flatten(ImageOps.exif_transpose(src))
+    widths = sorted({w for w in ASSET_WIDTHS if w < img.width} | {min(img.width, ASSET_WIDTHS[-1])})
+    entry = {'width': img.width, 'height': img.height, 'jpeg': [], 'webp': []}
+    stem = os.path.splitext(name)[0]
+    for width in widths:
+        resized = img if width == img.width else img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        for fmt, ext in (('jpeg', '.jpg'), ('webp', '.webp')):
+            entry[fmt].append([width, _write_hashed(out_dir, f"{stem}-{width}{ext}", _encode(resized, fmt))])
+    return entry
+
+
+def _largest(entry, fmt, max_width):
+    fitting = [path for width, path in entry[fmt] if width <= max_width]
+    return fitting[-1] if fitting else entry[fmt][0][1]
+
+
+def build_css(static_dir, out_dir, name, images):
+    """Minified copy of static/<name> with image urls rewritten to built variants. Returns (path, css bytes)."""
+    with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+        css = COMMENT_RE.sub('', f.read())
+    base = os.path.dirname(name)
+
+    def image_for(ref):
+        logical = os.path.normpath(os.path.join(base, ref)).replace(os.sep, '/')
+        return images.get(logical)
+
+    def relative(path):
+        return os.path.relpath(path, base).replace(os.sep, '/')
+
+    def image_set(entry, max_width):
+        webp, jpeg = _largest(entry, 'webp', max_width), _largest(entry, 'jpeg', max_width)
+        return f'image-set(url("{relative(webp)}") type("image/webp"),url("{relative(jpeg)}") type("image/jpeg"))'
+
+    small_screen = []
+
+    def add_image_sets(rule):
+        selector, body = rule.group(1), rule.group(2)
+
+        def add_image_set(match):
+            entry = image_for(match.group(3))
+            if entry is None:
+                return match.group(1)
+            if entry['width'] > SMALL_SCREEN_WIDTH:
+                small_screen.append(f"{selector.strip()}{{background-image:{image_set(entry, SMALL_SCREEN_WIDTH)}}}")
+            # Browsers without image-set() drop this declaration and keep the JPEG url() above it.
+            return f"{match.group(1)}background-image:{image_set(entry, CSS_IMAGE_WIDTH)};"
+
+        return f"{selector}{{{BACKGROUND_RE.sub(add_image_set, body)}}}"
+
+    def rewrite_url(match):
+        entry = image_for(match.group(2))
+        if entry is None or match.group(2).startswith(('data:', 'http:', 'https:', '/')):
+            return match.group(0)
+        return f'url("{relative(_largest(entry, "jpeg", CSS_IMAGE_WIDTH))}")'
+
+    css = RULE_RE.sub(add_image_sets, css)
+    if small_screen:
+        css += f"@media (max-width:{SMALL_SCREEN_WIDTH}px){{{''.join(small_screen)}}}"
+    css = URL_RE.sub(rewrite_url, css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,])\s*', r'\1', css).strip()
+    data = css.encode('utf-8')
+    return _write_hashed(out_dir, name, data), data
+
+
+def _precompress(out_dir, path, data):
+    with open(os.path.join(out_dir, path + '.gz'), 'wb') as out:
+        out.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(os.path.join(out_dir, path + '.br'), 'wb') as out:
+            out.write(brotli.compress(data, quality=11))
+
+
+def _manifest_files(manifest):
+    files = set(manifest.get('files', {}).values())
+    for entry in manifest.get('images', {}).values():
+        files.update(path for fmt in ('jpeg', 'webp') for _, path in entry[fmt])
+    return files
+
+
+def build(static_dir=STATIC_DIR, out_dir=DEFAULT_ASSETS_DIR):
+    """Builds every asset into out_dir and writes its manifest. Returns the manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    images = {}
+    image_dir = os.path.join(static_dir, 'images')
+    for filename in sorted(os.listdir(image_dir)) if os.path.isdir(image_dir) else []:
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            images[f'images/{filename}'] = build_image(static_dir, out_dir, f'images/{filename}')
+
+    files = {}
+    for name in CSS_FILES:
+        if os.path.exists(os.path.join(static_dir, name)):
+            path, data = build_css(static_dir, out_dir, name, images)
+            _precompress(out_dir, path, data)
+            files[name] = path
+    for name, entry in images.items():
+        files[name] = _largest(entry, 'jpeg', ASSET_WIDTHS[-1])
+    manifest = {'files': files, 'images': images}
+
+    # Keep the previous build's files too, so pages rendered by workers that
+    # haven't restarted yet still resolve; anything older is removed.
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    keep = _manifest_files(manifest) | _manifest_files(read_manifest(out_dir))
+    for root, _, filenames in os.walk(out_dir):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), out_dir).replace(os.sep, '/')
+            if path != MANIFEST_NAME and path.rsplit('.', 1)[0] not in keep and path not in keep:
+                os.remove(os.path.join(root, filename))
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# --- Serving ---
+def serve_asset(filename):
+    directory = current_app.config['ASSETS_DIR']
+    if safe_join(directory, filename) is None:
+        abort(404)
+    # style.1a2b3c4d5e6f.css -> 1a2b3c4d5e6f: the content hash doubles as a strong ETag.
+    parts = filename.rsplit('.', 2)
+    etag = parts[-2] if len(parts) == 3 else None
+    encoding, suffix = None, ''
+    for candidate, candidate_suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in request.accept_encodings and os.path.exists(safe_join(directory, filename + candidate_suffix)):
+            encoding, suffix = candidate, candidate_suffix
+            break
+    if etag and encoding:
+        etag = f"{etag}-{encoding}"
+    response = send_from_directory(directory, filename + suffix, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=ASSET_MAX_AGE, etag=etag or True)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _manifest():
+    return current_app.extensions['assets']
+
+
+def asset_url(name):
+    """Fingerprinted URL of a built asset ('css/style.css', 'images/hero-bg.jpg'), else its /static URL."""
+    built = _manifest().get('files', {}).get(name)
+    if built is None:
+        return url_for('static', filename=name)
+    return url_for('asset', filename=built)
+
+
+def responsive_image(name, alt, css_class='', sizes='100vw', loading='lazy'):
+    """A <picture> with WebP and JPEG srcsets of a built image; a plain <img> before the first build."""
+    entry = _manifest().get('images', {}).get(name)
+    if entry is None:
+        return Markup(f'<img src="{escape(url_for("static", filename=name))}" class="{escape(css_class)}" '
+                      f'alt="{escape(alt)}" loading="{escape(loading)}">')
+
+    def srcset(fmt):
+        return ', '.join(f'{url_for("asset", filename=path)} {width}w' for width, path in entry[fmt])
+
+    fallback = url_for('asset', filename=_largest(entry, 'jpeg', ASSET_WIDTHS[1]))
+    return Markup(
+        f'<picture><source type="image/webp" srcset="{srcset("webp")}" sizes="{escape(sizes)}">'
+        f'<img src="{fallback}" srcset="{srcset("jpeg")}" sizes="{escape(sizes)}" class="{escape(css_class)}" '
+        f'alt="{escape(alt)}" width="{entry["width"]}" height="{entry["height"]}" loading="{escape(loading)}"></picture>'
+    )
+
+
+def reload(app):
+    app.extensions['assets'] = read_manifest(app.config['ASSETS_DIR'])
+
+
+def init_app(app):
+    """
+    Config:
+      ASSETS_DIR  where build-assets writes and /assets serves from (default static/dist)
+    """
+    app.config.setdefault('ASSETS_DIR', os.getenv('ASSETS_DIR', DEFAULT_ASSETS_DIR))
+    reload(app)
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
+    app.add_template_global(responsive_image)
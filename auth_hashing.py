@@ -0,0 +1,205 @@
+# auth_hashing.py
+# Password hashing off the request threads, with a cap on how much of the
+# machine it may use.
+#
+# Werkzeug's scrypt hashes cost ~100 ms of CPU and 32 MB each. Run directly in
+# the views, a burst of logins at market opening pins every core and stalls
+# unrelated pages. Here every hash runs in a small process pool: at most
+# AUTH_HASH_WORKERS hash at once, at most AUTH_HASH_MAX_PENDING wait for one,
+# and a request that can't get a slot within AUTH_HASH_QUEUE_TIMEOUT gets a
+# "try again" instead of joining an unbounded queue.
+#
+# Logins are throttled per identifier and per client IP with token buckets that
+# are checked before any hashing, so brute-force traffic is turned away for the
+# price of a dict lookup. Password-reset requests have their own per-email
+# bucket, so they can't be used to flood an inbox or phone with OTPs. Buckets are per process; with several gunicorn
+# workers the effective limit is multiplied by the worker count. Behind a reverse
+# proxy, set PROXY_FIX_HOPS (app.py) or every client shares the proxy's bucket.
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from flask import current_app, request
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+
+class HashingBusyError(Exception):
+    """Every hashing slot stayed busy for the whole queue timeout."""
+
+
+# --- Hashing pool ---
+class PasswordHasher:
+    """
+    Bounded process pool for password hashes. workers=0 hashes on the calling
+    thread, still limited to max_pending at once.
+    """
+
+    def __init__(self, workers=1, max_pending=4, queue_timeout=2.0, timeout=10.0, method=PASSWORD_HASH_METHOD):
+        self.workers = workers
+        self.max_pending = max(max_pending, workers, 1)
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.method = method
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._method_prefix = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so a forking server (gunicorn --preload) never
+        # inherits a half-initialised pool. By then this process has threads
+        # (request handlers, notification workers), so children are never
+        # forked from it: a copied lock held by another thread would deadlock
+        # them. They come from a forkserver (spawn where there is none) that
+        # only preloads werkzeug, never the main script.
+        with self._lock:
+            if self._executor is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(['werkzeug.security'])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusyError("Too many sign-ins in progress, please try again shortly.")
+        try:
+            if not self.workers:
+                return fn(*args)
+            try:
+                return self._get_executor().submit(fn, *args).result(timeout=self.timeout)
+            except FutureTimeoutError as e:
+                raise HashingBusyError("Password check timed out, please try again.") from e
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, stored_hash):
+        """True if stored_hash was made with other parameters than the current method."""
+        if self._method_prefix is None:
+            # 'scrypt' and 'scrypt:32768:8:1' are the same method; compare what werkzeug actually writes.
+            self._method_prefix = self.hash('probe').split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != self._method_prefix
+
+    def verify(self, stored_hash, password):
+        """
+        Returns (matches, new_hash). new_hash is set when the password matched
+        but its hash uses outdated parameters; store it in place of the old one.
+        """
+        if not self._run(check_password_hash, stored_hash, password):
+            return False, None
+        if self.needs_rehash(stored_hash):
+            return True, self.hash(password)
+        return True, None
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+# --- Throttling ---
+class TokenBucket:
+    """
+    Per-key token buckets: each key may spend `burst` tokens at once, refilled
+    at `rate` per second. Only the `max_keys` most recently seen keys are kept.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        """Spends `cost` tokens from key's bucket. Returns False (spending nothing) if it has too few."""
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# --- Flask wiring ---
+def init_app(app):
+    """
+    Config:
+      AUTH_HASH_WORKERS        processes hashing at once (0: hash on the request thread)
+      AUTH_HASH_MAX_PENDING    hashes running or waiting; more wait up to AUTH_HASH_QUEUE_TIMEOUT
+      AUTH_HASH_QUEUE_TIMEOUT  seconds to wait for a slot before answering "try again"
+      AUTH_HASH_TIMEOUT        seconds to wait for one hash
+      LOGIN_RATE_PER_IP        sustained password attempts per second per client IP (burst LOGIN_BURST_PER_IP)
+      LOGIN_RATE_PER_ACCOUNT   sustained attempts per second per email/mobile (burst LOGIN_BURST_PER_ACCOUNT)
+      RESET_RATE_PER_ACCOUNT   sustained password-reset OTPs per second per email (burst RESET_BURST_PER_ACCOUNT)
+    """
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    app.config.setdefault('AUTH_HASH_WORKERS', int(os.getenv('AUTH_HASH_WORKERS', workers)))
+    app.config.setdefault('AUTH_HASH_MAX_PENDING', int(os.getenv('AUTH_HASH_MAX_PENDING', 4 * max(1, app.config['AUTH_HASH_WORKERS']))))
+    app.config.setdefault('AUTH_HASH_QUEUE_TIMEOUT', float(os.getenv('AUTH_HASH_QUEUE_TIMEOUT', 2)))
+    app.config.setdefault('AUTH_HASH_TIMEOUT', float(os.getenv('AUTH_HASH_TIMEOUT', 10)))
+    app.config.setdefault('LOGIN_RATE_PER_IP', float(os.getenv('LOGIN_RATE_PER_IP', 0.5)))
+    app.config.setdefault('LOGIN_BURST_PER_IP', int(os.getenv('LOGIN_BURST_PER_IP', 20)))
+    app.config.setdefault('LOGIN_RATE_PER_ACCOUNT', float(os.getenv('LOGIN_RATE_PER_ACCOUNT', 1 / 30)))
+    app.config.setdefault('LOGIN_BURST_PER_ACCOUNT', int(os.getenv('LOGIN_BURST_PER_ACCOUNT', 5)))
+    app.config.setdefault('RESET_RATE_PER_ACCOUNT', float(os.getenv('RESET_RATE_PER_ACCOUNT', 1 / 300)))
+    app.config.setdefault('RESET_BURST_PER_ACCOUNT', int(os.getenv('RESET_BURST_PER_ACCOUNT', 3)))
+
+    app.extensions['password_hasher'] = PasswordHasher(
+        workers=app.config['AUTH_HASH_WORKERS'], max_pending=app.config['AUTH_HASH_MAX_PENDING'],
+        queue_timeout=app.config['AUTH_HASH_QUEUE_TIMEOUT'], timeout=app.config['AUTH_HASH_TIMEOUT'])
+    app.extensions['login_throttle'] = {
+        'ip': TokenBucket(app.config['LOGIN_RATE_PER_IP'], app.config['LOGIN_BURST_PER_IP']),
+        'account': TokenBucket(app.config['LOGIN_RATE_PER_ACCOUNT'], app.config['LOGIN_BURST_PER_ACCOUNT']),
+        'reset': TokenBucket(app.config['RESET_RATE_PER_ACCOUNT'], app.config['RESET_BURST_PER_ACCOUNT']),
+    }
+
+
+def get_password_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    return get_password_hasher().hash(password)
+
+
+def verify_password(stored_hash, password):
+    """(matches, new_hash); see PasswordHasher.verify."""
+    return get_password_hasher().verify(stored_hash, password)
+
+
+def allow_attempt(identifier=None, bucket='account'):
+    """
+    Spends one token from the client IP's bucket and, if given, the
+    identifier's in `bucket` ('account' for logins, 'reset' for password
+    resets). Call before hashing; False means the request should be refused
+    without touching the password.
+    """
+    buckets = current_app.extensions['login_throttle']
+    if not buckets['ip'].allow(request.remote_addr or 'unknown'):
+        return False
+    if identifier is not None:
+        return buckets[bucket].allow(identifier.strip().lower())
+    return True
@@ -0,0 +1,166 @@
+# chat.py
+# Incremental chat: paginated message history and a per-app notifier that
+# wakes open chat streams when new messages arrive.
+#
+# Fan-out works across gunicorn workers with the database as the bus: each
+# worker runs ONE watcher thread that polls the (indexed) message id column and
+# wakes every stream in that worker, so N open chats cost one small query per
+# tick instead of N. Messages sent through this worker wake streams
+# immediately via publish().
+#
+# Ids are handed out when a message is inserted but become visible when it
+# commits, so on Postgres a slow sender's lower id can appear after a higher
+# one was already delivered. Incremental reads therefore re-scan the last
+# CHAT_RESCAN_IDS ids below the cursor; clients drop ids they already have.
+#
+# Streams wait on a condition variable rather than busy-polling, but each one
+# still occupies a thread for up to CHAT_STREAM_SECONDS. gunicorn.conf.py
+# runs gthread workers (GUNICORN_THREADS each) so open chats don't consume
+# whole sync workers; keep it, or use another threaded/async worker class.
+
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Message, User
+
+CHAT_PAGE_SIZE = int(os.getenv('CHAT_PAGE_SIZE', 50))
+CHAT_POLL_INTERVAL = float(os.getenv('CHAT_POLL_INTERVAL', 1.0))
+CHAT_STREAM_SECONDS = int(os.getenv('CHAT_STREAM_SECONDS', 25))
+CHAT_RESCAN_IDS = int(os.getenv('CHAT_RESCAN_IDS', 100))
+
+
+# --- History ---
+def fetch_messages(conversation_id, after=None, before=None, limit=CHAT_PAGE_SIZE, rescan=0):
+    """
+    Messages of one conversation in chronological order, with the sender's email
+    joined in. after=id returns up to `limit` newer messages, plus any of the
+    `rescan` ids at or below it (late commits; callers skip the ones they have).
+    Otherwise the newest `limit` messages (older than `before`, if given).
+    """
+    query = db.session.query(
+        Message.id, Message.sender_id, Message.text, Message.timestamp, User.email.label('sender_email')
+    ).join(User, Message.sender_id == User.id).filter(Message.conversation_id == conversation_id)
+    if after is not None:
+        # At most `rescan` rows fall in the window, so `limit` new ones always fit.
+        return query.filter(Message.id > after - rescan).order_by(Message.id).limit(limit + rescan).all()
+    if before is not None:
+        query = query.filter(Message.id < before)
+    return list(reversed(query.order_by(Message.id.desc()).limit(limit).all()))
+
+
+def message_json(row):
+    return {
+        'id': row.id,
+        'sender_id': row.sender_id,
+        'sender': row.sender_email.split('@')[0],
+        'text': row.text,
+        'timestamp': row.timestamp.isoformat(),
+        'display_time': row.timestamp.strftime('%b %d, %H:%M'),
+    }
+
+
+# --- Fan-out ---
+class MessageNotifier:
+    """
+    Counts the new messages seen per conversation and wakes waiters when a count
+    moves. Waiters take version() before reading, then wait() for it to change.
+    """
+
+    def __init__(self, app, poll_interval=CHAT_POLL_INTERVAL, rescan_ids=CHAT_RESCAN_IDS):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.rescan_ids = rescan_ids
+        self._cond = threading.Condition()
+        self._versions = {}      # conversation_id -> new messages seen so far
+        self._recent = set()     # ids seen within rescan_ids of the high-water mark
+        self._high_water = None  # newest message id seen overall
+        self._watcher = None
+
+    def version(self, conversation_id):
+        self._ensure_watcher()
+        with self._cond:
+            return self._versions.get(conversation_id, 0)
+
+    def _seen(self, conversation_id, message_id):
+        # Call with _cond held. Returns True if message_id is news.
+        if message_id in self._recent or (self._high_water is not None and message_id <= self._high_water - self.rescan_ids):
+            return False
+        self._recent.add(message_id)
+        self._versions[conversation_id] = self._versions.get(conversation_id, 0) + 1
+        return True
+
+    def publish(self, conversation_id, message_id):
+        """Called after a commit in this worker; wakes local streams without waiting for the next poll."""
+        with self._cond:
+            if self._seen(conversation_id, message_id):
+                self._cond.notify_all()
+
+    def _ensure_watcher(self):
+        with self._cond:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name='chat-watcher', daemon=True)
+                self._watcher.start()
+
+    def _poll(self):
+        with self.app.app_context():
+            if self._high_water is None:
+                newest = db.session.query(func.coalesce(func.max(Message.id), 0)).scalar()
+                rows = db.session.query(Message.id).filter(Message.id > newest - self.rescan_ids).all()
+                with self._cond:
+                    # Everything already committed is old news.
+                    self._recent.update(message_id for message_id, in rows)
+                    self._high_water = newest
+                db.session.remove()
+                return
+            rows = db.session.query(Message.id, Message.conversation_id).filter(
+                Message.id > self._high_water - self.rescan_ids
+            ).all()
+            db.session.remove()
+        with self._cond:
+            news = False
+            for message_id, conversation_id in rows:
+                news = self._seen(conversation_id, message_id) or news
+                self._high_water = max(self._high_water, message_id)
+            floor = self._high_water - self.rescan_ids
+            self._recent = {message_id for message_id in self._recent if message_id > floor}
+            if news:
+                self._cond.notify_all()
+
+    def _watch(self):
+        while True:
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Chat watcher error: {e}")
+            time.sleep(self.poll_interval)
+
+    def wait(self, conversation_id, version, timeout):
+        """Blocks until the conversation's version() moves past `version`, or timeout. Returns True if it did."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._versions.get(conversation_id, 0) == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+
+def init_app(app):
+    """
+    Config:
+      CHAT_POLL_INTERVAL  seconds between the watcher's checks for messages sent through other workers
+      CHAT_RESCAN_IDS     ids below the newest re-checked for late commits
+    """
+    app.config.setdefault('CHAT_POLL_INTERVAL', CHAT_POLL_INTERVAL)
+    app.config.setdefault('CHAT_RESCAN_IDS', CHAT_RESCAN_IDS)
+    app.extensions['chat_notifier'] = MessageNotifier(app, poll_interval=app.config['CHAT_POLL_INTERVAL'],
+                                                      rescan_ids=app.config['CHAT_RESCAN_IDS'])
+
+
+def get_notifier():
+    return current_app.extensions['chat_notifier']
@@ -1,25 +1,35 @@
 # email_utils.py
 import smtplib
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
 
+from outbound import dependency
+
 # Load environment variables from .env file
 load_dotenv()
 
-def send_otp_email(recipient_email, otp):
-    """Sends an email with the OTP code."""
-    # This now reads the variables loaded by load_dotenv() above
-    sender_email = os.getenv("GMAIL_ADDRESS")
-    sender_password = os.getenv("GMAIL_APP_PASSWORD")
+# Gmail by default; SMTP_SECURITY is 'ssl' (port 465), 'starttls' (port 587) or 'none' (local relays/tests).
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 465))
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 10))
+# Servers drop idle sessions; a connection unused for longer than this is checked with NOOP before reuse.
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", 60))
+smtp = dependency("smtp", timeout=SMTP_TIMEOUT)
+# Refusals of a particular message: the server is up, so they don't count towards opening the breaker.
+SMTP_CLIENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
 
-    if not sender_email or not sender_password:
-        # This is the error you are seeing
-        print("ERROR: Gmail credentials not found in .env file. Please check your .env file.")
-        return False
 
-    # Set up the message
+def smtp_credentials():
+    """(sender_email, sender_password) from the environment; either may be None."""
+    return os.getenv("GMAIL_ADDRESS"), os.getenv("GMAIL_APP_PASSWORD")
+
+
+def build_otp_email(sender_email, recipient_email, otp):
+    """The password-reset OTP message (subject, HTML body) as a MIME message."""
     message = MIMEMultipart("alternative")
     message["Subject"] = "Your Krishimitra Password Reset OTP"
     message["From"] = f"Krishimitra <{sender_email}>"
@@ -36,17 +46,96 @@ def send_otp_email(recipient_email, otp):
       </body>
     </html>
     """
-    
+
     # Add the HTML part to the message
     message.attach(MIMEText(html, "html"))
+    return message
+
+
+class SMTPConnection:
+    """
+    One logged-in SMTP session reused across messages. Not thread-safe: each
+    sending thread keeps its own. Reconnects transparently when the server has
+    dropped the session.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, security=SMTP_SECURITY, username=None, password=None,
+                 timeout=SMTP_TIMEOUT, idle_seconds=SMTP_IDLE_SECONDS):
+        self.host, self.port, self.security = host, port, security
+        self.username, self.password = username, password
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.connects = 0
+        self._server = None
+        self._last_used = 0.0
 
+    def _connect(self, timeout):
+        if self.security == "ssl":
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=timeout)
+            if self.security == "starttls":
+                server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        self.connects += 1
+        return server
+
+    def _alive(self):
+        if time.monotonic() - self._last_used < self.idle_seconds:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, sender_email, recipients, message_string):
+        """
+        Sends one message, opening (or re-opening) the session if needed.
+        Raises outbound.CircuitOpenError while the SMTP server is failing.
+        """
+        with smtp.guard(client_errors=SMTP_CLIENT_ERRORS) as call:
+            for attempt in range(2):
+                if self._server is None or not self._alive():
+                    self.close()
+                    self._server = self._connect(min(self.timeout, call.timeout))
+                try:
+                    self._server.sendmail(sender_email, recipients, message_string)
+                    self._last_used = time.monotonic()
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self._server = None
+                    if attempt:
+                        raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+def send_otp_email(recipient_email, otp):
+    """Sends an email with the OTP code."""
+    # This now reads the variables loaded by load_dotenv() above
+    sender_email, sender_password = smtp_credentials()
+
+    if not sender_email or not sender_password:
+        # This is the error you are seeing
+        print("ERROR: Gmail credentials not found in .env file. Please check your .env file.")
+        return False
+
+    message = build_otp_email(sender_email, recipient_email, otp)
+    connection = SMTPConnection(username=sender_email, password=sender_password)
     try:
-        # Create a secure connection with the server and send email
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, recipient_email, message.as_string())
+        # For a single message; the notification dispatcher keeps its sessions open across messages.
+        connection.send(sender_email, recipient_email, message.as_string())
         print(f"OTP email sent successfully to {recipient_email}")
         return True
     except Exception as e:
         print(f"Failed to send email: {e}")
-        return False
\ No newline at end of file
+        return False
+    finally:
+        connection.close()
@@ -0,0 +1,115 @@
+# engine_profile.py
+# Engine settings per database backend, plus optional read-replica routing.
+#
+# SQLite (local instance/krishimitra.sqlite): WAL journal so readers never block
+# the writer, a busy timeout so concurrent writers from several gunicorn
+# workers wait instead of failing with "database is locked", and
+# synchronous=NORMAL (safe with WAL, far fewer fsyncs).
+# Postgres (DATABASE_URL): a sized connection pool with pre-ping and recycle so
+# connections dropped by the server or a proxy are replaced transparently.
+
+import os
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+# Set SQLITE_TUNING=0 on network filesystems, where WAL is not supported.
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', '1') != '0'
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', 16384))
+
+REPLICA_BIND = 'replica'
+
+
+def normalize_url(url):
+    """Hosted Postgres often hands out postgres:// URLs, which SQLAlchemy no longer accepts."""
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database URL."""
+    if url.startswith('sqlite'):
+        # Pragmas are applied per connection by _tune_sqlite below.
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False}}
+    if url.startswith('postgresql'):
+        return {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+        }
+    return {}
+
+
+@event.listens_for(Engine, 'connect')
+def _tune_sqlite(dbapi_connection, connection_record):
+    if not SQLITE_TUNING or type(dbapi_connection).__module__ != 'sqlite3':
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def configure(app, url, replica_url=None):
+    """Sets the database URI, engine options and (optionally) the read-replica bind on app.config."""
+    url = normalize_url(url)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    replica_url = normalize_url(replica_url)
+    if replica_url:
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: {'url': replica_url, **engine_options(replica_url)}}
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to the replica while a @read_replica view is running.
+    Writes, flushes and everything outside those views use the primary, and so
+    does every read after a write until the transaction ends: the replica
+    cannot see rows this transaction has not committed yet.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        if (bind is None and not self._flushing and not self.info.get('wrote') and isinstance(clause, Select)
+                and has_app_context() and g.get('use_read_replica')):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _pin_to_primary(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _unpin(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
+
+
+def read_replica(view):
+    """Marks a read-only view whose queries may be served by the replica (may lag the primary slightly)."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.use_read_replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.use_read_replica = False
+    return wrapped
@@ -0,0 +1,223 @@
+# field_scan.py
+# Batch diagnosis for a whole field survey: many leaf photos (or one zip of
+# them) in a single request.
+#
+# Identical photos are diagnosed once. Unique photos are normalized and sent to
+# the model concurrently on a bounded pool, at most BATCH_CONCURRENCY at a
+# time per batch, and each result is handed back as soon as it completes so
+# the client can show progress instead of waiting for the slowest image.
+# Anything still unfinished when the batch deadline passes is reported as
+# timed out.
+
+import hashlib
+import os
+import time
+import zipfile
+import zlib
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from image_utils import MAX_UPLOAD_BYTES, UploadError, UploadTooLargeError, save_stream
+from ml_model.jobs import QueueFullError
+from uploads import content_path
+
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 50))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_MB', 200)) * 1024 * 1024
+# Total size of a batch's images once read, zip members inflated; checked as each image is spooled.
+BATCH_MAX_INFLATED_BYTES = int(os.getenv('BATCH_MAX_INFLATED_MB', 400)) * 1024 * 1024
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_DEADLINE = int(os.getenv('BATCH_DEADLINE', 90))
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+
+class BatchError(ValueError):
+    """The batch as a whole was rejected; the message is safe to show to the user."""
+
+
+def _extension(name):
+    return name.rsplit('.', 1)[1].lower() if '.' in name else ''
+
+
+def _too_large(name):
+    return UploadTooLargeError(f"{name} is too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB).")
+
+
+class _Spool:
+    """Collects one batch's images as files in spool_dir, enforcing the batch limits before each read."""
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        self.unique, self.rejected = OrderedDict(), []
+        self.accepted = 0
+        self.total_bytes = 0
+        self._files = 0
+
+    def reject(self, name, error):
+        self.rejected.append({'file': name, 'error': str(error)})
+
+    def add(self, name, stream, declared_size=None):
+        """Streams one image to disk, hashing it on the way. declared_size is a zip member's header size."""
+        if self.accepted >= BATCH_MAX_IMAGES:
+            raise BatchError(f"A field scan can include at most {BATCH_MAX_IMAGES} images.")
+        remaining = BATCH_MAX_INFLATED_BYTES - self.total_bytes
+        too_much = BatchError(f"A field scan can include at most {BATCH_MAX_INFLATED_BYTES // (1024 * 1024)} MB of images.")
+        if declared_size is not None and declared_size > remaining:
+            raise too_much
+        self._files += 1
+        path = os.path.join(self.spool_dir, f'{self._files:04d}')
+        hasher = hashlib.sha256()
+        limit = min(MAX_UPLOAD_BYTES, remaining)
+        try:
+            # Headers can lie about sizes, so the limits also apply to the bytes actually read.
+            size = save_stream(stream, path, limit, hasher)
+        except UploadTooLargeError:
+            if limit < MAX_UPLOAD_BYTES:
+                raise too_much
+            self.reject(name, _too_large(name))
+            return
+        self.accepted += 1
+        self.total_bytes += size
+        entry = self.unique.get(hasher.hexdigest())
+        if entry is None:
+            self.unique[hasher.hexdigest()] = {'path': path, 'ext': _extension(name), 'files': [name]}
+        else:
+            os.remove(path)
+            entry['files'].append(name)
+
+
+def _add_archive(spool, archive):
+    """Adds every image in a zip, refusing members whose header says they inflate past the per-image limit."""
+    try:
+        bundle = zipfile.ZipFile(archive.stream)
+    except zipfile.BadZipFile as e:
+        raise BatchError("The uploaded archive is not a valid zip file.") from e
+    with bundle:
+        for info in bundle.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or name.startswith('.') or '__MACOSX' in info.filename:
+                continue
+            if _extension(name) not in IMAGE_EXTENSIONS:
+                continue
+            if info.file_size > MAX_UPLOAD_BYTES:
+                spool.reject(name, _too_large(name))
+                continue
+            try:
+                with bundle.open(info) as member:
+                    spool.add(name, member, declared_size=info.file_size)
+            except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                raise BatchError(f"The uploaded archive is damaged ({name}).") from e
+
+
+def collect_images(files, archive, spool_dir):
+    """
+    Streams the uploaded images (and the images inside `archive`, a zip) into
+    files under spool_dir, one at a time. Returns (unique, rejected): unique
+    maps the sha256 of each distinct image to {'path', 'ext', 'files'};
+    rejected lists {'file', 'error'}. The image count and total size limits
+    are checked before each image is read, so an archive that inflates to
+    far more than it weighs is refused without being unpacked.
+    """
+    spool = _Spool(spool_dir)
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if _extension(file.filename) not in IMAGE_EXTENSIONS:
+            spool.reject(file.filename, UploadError(f"{file.filename} is not a supported image type."))
+            continue
+        spool.add(file.filename, file.stream)
+    if archive is not None and archive.filename:
+        _add_archive(spool, archive)
+    if not spool.unique and not spool.rejected:
+        raise BatchError("No images were uploaded.")
+    return spool.unique, spool.rejected
+
+
+def content_names(unique):
+    """{digest: content path} each distinct spooled image is published at (see _diagnose)."""
+    return {digest: content_path(digest, entry['ext']) for digest, entry in unique.items()}
+
+
+def _diagnose(predict, store, digest, entry):
+    """
+    Pool task: normalize one spooled photo in the spool, move it into the
+    uploads.UploadStore (so its content path only ever holds the normalized
+    bytes), and run the model on its inference variant.
+    """
+    name = store.save_file(digest, entry['ext'], entry['path'])
+    return predict(store.variant(name, 'inference'))
+
+
+def run_batch(unique, saved, store, predict, pool, deadline=BATCH_DEADLINE, concurrency=BATCH_CONCURRENCY):
+    """
+    Diagnoses every distinct image and yields one result dict per image as it
+    finishes: {'digest', 'filename', 'files', 'status', 'prediction', 'error'}
+    with status done / failed / timed_out. Never queues more than `concurrency`
+    of this batch's images on the pool at once. `unique` comes from
+    collect_images, whose spool must outlive the batch; `saved` from content_names.
+    """
+    ends_at = time.monotonic() + deadline
+    pending = deque(unique)
+    inflight = {}
+
+    def result(digest, status, prediction=None, error=None):
+        return {'digest': digest, 'filename': saved[digest], 'files': unique[digest]['files'],
+                'status': status, 'prediction': prediction, 'error': error}
+
+    try:
+        while pending or inflight:
+            remaining = ends_at - time.monotonic()
+            if remaining <= 0:
+                break
+            while pending and len(inflight) < concurrency:
+                try:
+                    future = pool.submit(_diagnose, predict, store, pending[0], unique[pending[0]])
+                except QueueFullError:
+                    break
+                inflight[future] = pending.popleft()
+            if not inflight:
+                # The pool is busy with other requests; try again shortly.
+                time.sleep(min(0.25, remaining))
+                continue
+            done, _ = wait(inflight, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                digest = inflight.pop(future)
+                try:
+                    prediction = future.result()
+                except UploadError as e:
+                    yield result(digest, 'failed', error=str(e))
+                    continue
+                except Exception as e:
+                    print(f"Field scan diagnosis failed for {saved[digest]}: {e}")
+                    yield result(digest, 'failed', error='Detection failed.')
+                    continue
+                failed = prediction.get('disease_name') == 'Prediction Error'
+                yield result(digest, 'failed' if failed else 'done', prediction=prediction,
+                             error=prediction.get('remedy_description') if failed else None)
+
+        for future, digest in inflight.items():
+            yield result(digest, 'timed_out', error='Diagnosis did not finish before the batch deadline.')
+        for digest in pending:
+            yield result(digest, 'timed_out', error='Diagnosis did not start before the batch deadline.')
+    finally:
+        # Also reached when the client disconnects mid-stream.
+        for future in inflight:
+            future.cancel()
+
+
+def summarize(results):
+    """Aggregate counts for a finished batch; duplicates of one photo count once."""
+    statuses = Counter(r['status'] for r in results)
+    diseases = Counter(r['prediction']['disease_name'] for r in results if r['status'] == 'done')
+    plants = Counter(r['prediction'].get('plant_name') for r in results if r['status'] == 'done')
+    keywords = Counter(r['prediction']['product_keyword'] for r in results
+                       if r['status'] == 'done' and r['prediction'].get('product_keyword'))
+    return {
+        'images': sum(len(r['files']) for r in results),
+        'unique_images': len(results),
+        'statuses': dict(statuses),
+        'disease_counts': dict(diseases.most_common()),
+        'plant_counts': dict(plants.most_common()),
+        'product_keywords': [k for k, _ in keywords.most_common()],
+    }
+
@@ -0,0 +1,355 @@
+# fragment_cache.py
+# Cache for rendered page fragments, so the store's hot browse path skips the
+# product query and the card loop.
+#
+# Fragments are keyed by what they depend on (filters, page, role, language)
+# plus a version stamp per namespace. A write that changes what a namespace
+# renders calls bump(namespace) after its commit; every entry made under the
+# old stamp stops matching at once and ages out, so nothing has to be found
+# and deleted.
+#
+# Tiers:
+#   - a bounded in-process LRU, always on;
+#   - optionally a shared tier (FRAGMENT_CACHE_BACKEND=file or sqlite) that
+#     workers on the same machine read each other's renders from, holding at
+#     most FRAGMENT_CACHE_SHARED_MAX fragments per namespace. With a shared
+#     tier the version stamps live there too.
+#
+# A bump only reaches the process that made it (and the shared tier). So the
+# app also gives the cache a version_source: a change marker read from the
+# database (models.DataVersion), mixed into the stamp and re-read at most every
+# FRAGMENT_CACHE_VERSION_CHECK seconds. A product deleted through one worker
+# therefore disappears from every worker's cached grids within that window,
+# whatever the backend.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKENDS = ('memory', 'file', 'sqlite')
+
+
+def _new_stamp():
+    # Random rather than a counter, so two workers bumping at once never
+    # both write the same "next" value.
+    return uuid.uuid4().hex[:12]
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# --- Tiers ---
+class LRUTier:
+    """The most recently used max_entries values, in this process."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+PRUNE_EVERY = 64  # shared-tier writes between size checks
+
+
+class FileTier:
+    """
+    One file per fragment under directory/<namespace>/, plus a stamp file per
+    namespace. Writes go through a temp file and os.replace, so readers never
+    see a partial fragment. Past max_entries fragments in a namespace, the
+    oldest are deleted.
+    """
+
+    def __init__(self, directory, max_entries=5000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, namespace, name):
+        return os.path.join(self.directory, namespace, name)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, namespace, key):
+        try:
+            with open(self._path(namespace, _digest(key)), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, namespace, key, data):
+        self._write(self._path(namespace, _digest(key)), data)
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self.prune(namespace)
+
+    def prune(self, namespace):
+        """Deletes the oldest fragments beyond max_entries."""
+        folder = os.path.join(self.directory, namespace)
+        entries = []
+        for entry in os.scandir(folder):
+            if entry.name != 'STAMP' and not entry.name.endswith('.tmp'):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_stamp(self, namespace):
+        try:
+            with open(self._path(namespace, 'STAMP'), encoding='ascii') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def set_stamp(self, namespace, stamp):
+        self._write(self._path(namespace, 'STAMP'), stamp.encode('ascii'))
+        # Fragments from older stamps can never be read again.
+        folder = os.path.join(self.directory, namespace)
+        for name in os.listdir(folder):
+            if name != 'STAMP' and not name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+
+class SQLiteTier:
+    """
+    Fragments and stamps in one SQLite file (WAL), one connection per thread.
+    Past max_entries fragments in a namespace, the least recently written are deleted.
+    """
+
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS fragment ("
+                     "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (namespace, key))")
+        conn.execute("CREATE TABLE IF NOT EXISTS fragment_stamp (namespace TEXT PRIMARY KEY, stamp TEXT NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT value FROM fragment WHERE namespace = ? AND key = ?", (namespace, _digest(key))).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace, key, data):
+        # REPLACE gives the row a new rowid, so rowid order is write order.
+        self._connection().execute("INSERT OR REPLACE INTO fragment (namespace, key, value) VALUES (?, ?, ?)",
+                                   (namespace, _digest(key), data))
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self.prune(namespace)
+
+    def prune(self, namespace):
+        """Deletes the oldest fragments beyond max_entries."""
+        self._connection().execute(
+            "DELETE FROM fragment WHERE namespace = ? AND rowid IN ("
+            "SELECT rowid FROM fragment WHERE namespace = ? ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (namespace, namespace, self.max_entries))
+
+    def get_stamp(self, namespace):
+        row = self._connection().execute(
+            "SELECT stamp FROM fragment_stamp WHERE namespace = ?", (namespace,)).fetchone()
+        return row[0] if row else None
+
+    def set_stamp(self, namespace, stamp):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO fragment_stamp (namespace, stamp) VALUES (?, ?)", (namespace, stamp))
+        conn.execute("DELETE FROM fragment WHERE namespace = ?", (namespace,))
+
+
+# --- Cache ---
+class FragmentCache:
+    """
+    get/set JSON-serializable fragments by (namespace, key parts). `shared` is
+    an optional FileTier or SQLiteTier; stamps read from it are reused for
+    version_check seconds. `version_source(namespace)`, if given, returns a
+    change marker kept elsewhere (the database) that is part of the stamp
+    and likewise re-read every version_check seconds.
+    """
+
+    def __init__(self, max_entries=256, shared=None, version_check=1.0, version_source=None, clock=time.monotonic):
+        self.memory = LRUTier(max_entries)
+        self.shared = shared
+        self.version_check = version_check
+        self.version_source = version_source
+        self.clock = clock
+        self._stamps = {}  # namespace -> (stamp, checked_at)
+        self._markers = {}  # namespace -> (version_source marker, checked_at)
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+
+    def version(self, namespace):
+        """The namespace's current version stamp."""
+        stamp = self._stamp(namespace)
+        if self.version_source is None:
+            return stamp
+        now = self.clock()
+        with self._lock:
+            marker, checked_at = self._markers.get(namespace, (None, None))
+            if checked_at is not None and now - checked_at < self.version_check:
+                return f"{stamp}.{marker}"
+        marker = self.version_source(namespace)
+        with self._lock:
+            self._markers[namespace] = (marker, now)
+        return f"{stamp}.{marker}"
+
+    def _stamp(self, namespace):
+        now = self.clock()
+        with self._lock:
+            stamp, checked_at = self._stamps.get(namespace, (None, None))
+            if stamp is not None and (self.shared is None or now - checked_at < self.version_check):
+                return stamp
+        shared_stamp = self.shared.get_stamp(namespace) if self.shared is not None else None
+        with self._lock:
+            if shared_stamp is None:
+                shared_stamp = self._stamps.get(namespace, (None, None))[0]
+            if shared_stamp is None:
+                # First use: start a namespace of our own (and share it).
+                shared_stamp = _new_stamp()
+                if self.shared is not None:
+                    self.shared.set_stamp(namespace, shared_stamp)
+            self._stamps[namespace] = (shared_stamp, now)
+            return shared_stamp
+
+    def bump(self, namespace):
+        """Invalidates every fragment in namespace. Call after the write has committed."""
+        stamp = _new_stamp()
+        if self.shared is not None:
+            self.shared.set_stamp(namespace, stamp)
+        with self._lock:
+            self._stamps[namespace] = (stamp, self.clock())
+            self._markers.pop(namespace, None)  # our own write is visible on the next read
+        return stamp
+
+    def _key(self, namespace, parts):
+        return f"{namespace}:{self.version(namespace)}:{json.dumps(parts, sort_keys=True, default=str)}"
+
+    def get(self, namespace, parts):
+        key = self._key(namespace, parts)
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.shared is not None:
+            data = self.shared.get(namespace, key)
+            if data is not None:
+                value = json.loads(data)
+                self.memory.set(key, value)
+                self.shared_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, namespace, parts, value):
+        key = self._key(namespace, parts)
+        self.memory.set(key, value)
+        if self.shared is not None:
+            self.shared.set(namespace, key, json.dumps(value).encode('utf-8'))
+
+    @property
+    def enabled(self):
+        return self.memory.max_entries > 0
+
+    def get_or_render(self, namespace, parts, render):
+        """The cached value for parts, else render() (stored for next time)."""
+        if not self.enabled:
+            return render()
+        value = self.get(namespace, parts)
+        if value is None:
+            value = render()
+            self.set(namespace, parts, value)
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            self._stamps.clear()
+            self._markers.clear()
+
+    def stats(self):
+        return {'entries': len(self.memory), 'hits': self.hits, 'shared_hits': self.shared_hits,
+                'misses': self.misses}
+
+
+# --- Flask wiring ---
+def init_app(app, version_source=None):
+    """
+    `version_source` is passed to FragmentCache: the change markers every worker sees.
+
+    Config:
+      FRAGMENT_CACHE_SIZE           fragments kept in memory per worker (0 turns the cache off)
+      FRAGMENT_CACHE_BACKEND        memory, file or sqlite (shared between the workers on one machine)
+      FRAGMENT_CACHE_PATH           directory (file) or database file (sqlite) of the shared tier
+      FRAGMENT_CACHE_SHARED_MAX     fragments per namespace kept in the shared tier
+      FRAGMENT_CACHE_VERSION_CHECK  seconds a version stamp or change marker is trusted before re-reading it
+    """
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', int(os.getenv('FRAGMENT_CACHE_SIZE', 256)))
+    app.config.setdefault('FRAGMENT_CACHE_BACKEND', os.getenv('FRAGMENT_CACHE_BACKEND', 'memory'))
+    app.config.setdefault('FRAGMENT_CACHE_PATH', os.getenv('FRAGMENT_CACHE_PATH'))
+    app.config.setdefault('FRAGMENT_CACHE_SHARED_MAX', int(os.getenv('FRAGMENT_CACHE_SHARED_MAX', 5000)))
+    app.config.setdefault('FRAGMENT_CACHE_VERSION_CHECK', float(os.getenv('FRAGMENT_CACHE_VERSION_CHECK', 1)))
+
+    backend = app.config['FRAGMENT_CACHE_BACKEND']
+    if backend not in BACKENDS:
+        raise ValueError(f"FRAGMENT_CACHE_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}")
+    path, shared_max = app.config['FRAGMENT_CACHE_PATH'], app.config['FRAGMENT_CACHE_SHARED_MAX']
+    shared = None
+    if backend == 'file':
+        shared = FileTier(path or os.path.join(PROJECT_DIR, 'instance', 'fragment_cache'), max_entries=shared_max)
+    elif backend == 'sqlite':
+        shared = SQLiteTier(path or os.path.join(PROJECT_DIR, 'instance', 'fragment_cache.sqlite'), max_entries=shared_max)
+    app.extensions['fragment_cache'] = FragmentCache(
+        max_entries=app.config['FRAGMENT_CACHE_SIZE'], shared=shared,
+        version_check=app.config['FRAGMENT_CACHE_VERSION_CHECK'], version_source=version_source)
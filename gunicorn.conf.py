@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+# Read by `gunicorn app:app` when run from the project directory.
+#
+# An open chat (the /conversation/<id>/stream event stream, or a long-poll
+# with ?wait=) holds a thread for up to CHAT_STREAM_SECONDS. Under sync
+# workers every viewer would pin a whole worker process, so workers are
+# threaded: each serves GUNICORN_THREADS requests at once, open chats included.
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# Only kills a worker whose main loop stops; long requests (field scans, streams) run on its threads.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = 5
@@ -0,0 +1,141 @@
+# image_utils.py
+import os
+
+from PIL import Image, ImageOps
+
+# --- Configuration ---
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "10")) * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Anything larger than this is almost certainly a decompression bomb, not a phone photo.
+Image.MAX_IMAGE_PIXELS = 60_000_000
+
+INFERENCE_MAX_SIDE = 1024       # the model gains nothing from more pixels than this
+THUMBNAIL_SIZE = (480, 360)     # store cards render at ~400x200 CSS px
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+# The original is re-encoded in the format its extension names; everything else is stored as JPEG.
+ORIGINAL_FORMATS = {'png': 'PNG', 'gif': 'GIF'}
+
+
+class UploadError(ValueError):
+    """Base class for rejected uploads; the message is safe to show to the user."""
+
+
+class UploadTooLargeError(UploadError):
+    pass
+
+
+class InvalidImageError(UploadError):
+    pass
+
+
+def variant_filename(filename, kind):
+    """rotavator.jpg -> rotavator.thumb.webp / rotavator.thumb.jpg / rotavator.infer.jpg"""
+    stem = filename.rsplit('.', 1)[0]
+    return {
+        'thumb_webp': f"{stem}.thumb.webp",
+        'thumb_jpg': f"{stem}.thumb.jpg",
+        'inference': f"{stem}.infer.jpg",
+    }[kind]
+
+
+def save_stream(stream, path, max_bytes=MAX_UPLOAD_BYTES, hasher=None):
+    """
+    Copies an upload stream to disk in chunks, aborting as soon as it exceeds
+    max_bytes. Each chunk is also fed to `hasher` (a hashlib object) if given.
+    """
+    written = 0
+    try:
+        with open(path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLargeError(f"Image is too large (limit {max_bytes // (1024 * 1024)} MB).")
+                out.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return written
+
+
+def flatten(img):
+    """RGB copy of img for JPEG/WebP output, which has no alpha channel or palette; transparency is painted white."""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert('RGB')
+
+
+def normalize_image(path, thumbnails=True, inference=False):
+    """
+    Rewrites the image at `path` upright and without EXIF/GPS metadata, then writes
+    the requested variants next to it. Returns a dict of variant filenames.
+    """
+    folder, filename = os.path.split(path)
+    try:
+        with Image.open(path) as src:
+            src.verify()
+        with Image.open(path) as src:
+            src.seek(0)  # first frame of animated GIFs
+            img = ImageOps.exif_transpose(src)
+            img.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImageError("The uploaded file is not a valid image.") from e
+
+    # Re-encode the original so orientation is baked in and metadata is dropped,
+    # whatever it really is: MPO (phone JPEGs with a depth frame), WebP, TIFF or
+    # a GIF uploaded as .jpg all carry EXIF/XMP that a copy would keep.
+    target = ORIGINAL_FORMATS.get(filename.rsplit('.', 1)[-1].lower(), 'JPEG')
+    if target == 'JPEG':
+        flatten(img).save(path, 'JPEG', quality=90, optimize=True)
+    elif target == 'PNG':
+        (img if img.mode in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA') else img.convert('RGBA')).save(path, 'PNG', optimize=True)
+    else:
+        img.save(path, 'GIF')
+
+    variants = {'original': filename}
+    if thumbnails:
+        thumb = flatten(ImageOps.fit(img, THUMBNAIL_SIZE, Image.LANCZOS))
+        variants['thumb_webp'] = variant_filename(filename, 'thumb_webp')
+        thumb.save(os.path.join(folder, variants['thumb_webp']), 'WEBP', quality=WEBP_QUALITY, method=4)
+        variants['thumb_jpg'] = variant_filename(filename, 'thumb_jpg')
+        thumb.save(os.path.join(folder, variants['thumb_jpg']), 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    if inference:
+        small = flatten(img)
+        small.thumbnail((INFERENCE_MAX_SIDE, INFERENCE_MAX_SIDE), Image.LANCZOS)
+        variants['inference'] = variant_filename(filename, 'inference')
+        small.save(os.path.join(folder, variants['inference']), 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return variants
+
+
+def existing_variant(folder, filename, kind):
+    """Variant filename if it has been generated, otherwise the original (pre-pipeline uploads)."""
+    name = variant_filename(filename, kind)
+    return name if os.path.exists(os.path.join(folder, name)) else filename
+
+
+if __name__ == "__main__":
+    # Backfill variants for uploads saved before the pipeline existed:
+    #   python image_utils.py static/product_uploads
+    #   python image_utils.py static/leaf_uploads --inference
+    import sys
+
+    target = sys.argv[1] if len(sys.argv) > 1 else 'static/product_uploads'
+    want_inference = '--inference' in sys.argv
+    for name in sorted(os.listdir(target)):
+        # Content-addressed uploads (uploads.py) live in shard directories and always have their variants.
+        if '.thumb.' in name or '.infer.' in name or name.startswith('.') or os.path.isdir(os.path.join(target, name)):
+            continue
+        try:
+            made = normalize_image(os.path.join(target, name), thumbnails=not want_inference, inference=want_inference)
+            print(f"{name}: {', '.join(v for k, v in made.items() if k != 'original')}")
+        except UploadError as e:
+            print(f"{name}: skipped ({e})")
@@ -0,0 +1,215 @@
+# instrumentation.py
+# Per-request SQL and render timing.
+#
+# Every request records its query count, total SQL time, slowest statement and
+# template render time. The numbers are kept in a rolling per-endpoint window
+# (served as JSON by /_stats/queries), optionally added to response headers,
+# and checked against budgets declared with @query_budget so N+1 regressions
+# fail tests instead of reaching production.
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, jsonify, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+STATS_WINDOW = 200          # samples kept per endpoint
+SLOW_STATEMENT_CHARS = 300
+LOCAL_ADDRS = {'127.0.0.1', '::1'}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_seconds', 'slowest', 'slowest_seconds', 'render_seconds', 'statements')
+
+    def __init__(self, keep_statements=False):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest = None
+        self.slowest_seconds = 0.0
+        self.render_seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        if seconds >= self.slowest_seconds:
+            self.slowest, self.slowest_seconds = statement[:SLOW_STATEMENT_CHARS], seconds
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+# Collectors outside a request (assert_max_queries) are tracked per thread.
+_local = threading.local()
+
+
+def _active_collectors():
+    collectors = list(getattr(_local, 'collectors', ()))
+    if has_request_context():
+        stats = g.get('_query_stats')
+        if stats is not None:
+            collectors.append(stats)
+    return collectors
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['_query_started'].pop()
+    elapsed = time.perf_counter() - started
+    for stats in _active_collectors():
+        stats.record(statement, elapsed)
+
+
+@before_render_template.connect
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g._render_started = time.perf_counter()
+
+
+@template_rendered.connect
+def _after_render(sender, template, context, **extra):
+    if has_request_context() and g.get('_render_started') is not None and g.get('_query_stats') is not None:
+        g._query_stats.render_seconds += time.perf_counter() - g._render_started
+        g._render_started = None
+
+
+class EndpointStats:
+    """Rolling window of per-request samples for every endpoint."""
+
+    def __init__(self, window=STATS_WINDOW):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._slowest = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, stats, total_seconds):
+        with self._lock:
+            self._samples[endpoint].append((stats.queries, stats.sql_seconds, stats.render_seconds, total_seconds))
+            if stats.slowest and stats.slowest_seconds >= self._slowest.get(endpoint, (0.0, None))[0]:
+                self._slowest[endpoint] = (stats.slowest_seconds, stats.slowest)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for endpoint, samples in self._samples.items():
+                queries = sorted(s[0] for s in samples)
+                n = len(samples)
+                slowest = self._slowest.get(endpoint)
+                result[endpoint] = {
+                    'requests': n,
+                    'avg_queries': round(sum(queries) / n, 2),
+                    'max_queries': queries[-1],
+                    'p95_queries': queries[min(n - 1, int(n * 0.95))],
+                    'avg_sql_ms': round(sum(s[1] for s in samples) / n * 1000, 2),
+                    'avg_render_ms': round(sum(s[2] for s in samples) / n * 1000, 2),
+                    'avg_total_ms': round(sum(s[3] for s in samples) / n * 1000, 2),
+                    'slowest_statement_ms': round(slowest[0] * 1000, 2) if slowest else None,
+                    'slowest_statement': slowest[1] if slowest else None,
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._slowest.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+def query_budget(max_queries):
+    """Declares the most queries a view may run per request."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapped.query_budget = max_queries
+        return wrapped
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """
+    Test helper: fails if the block runs more than max_queries statements.
+
+        with assert_max_queries(3):
+            client.get('/inbox')
+    """
+    stats = RequestStats(keep_statements=True)
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        collectors.remove(stats)
+    if stats.queries > max_queries:
+        listing = '\n'.join(f"  {i + 1}. {s}" for i, s in enumerate(stats.statements))
+        raise QueryBudgetExceeded(f"{stats.queries} queries executed, budget is {max_queries}:\n{listing}")
+
+
+def init_app(app):
+    """
+    Config:
+      QUERY_STATS_HEADERS  add X-Query-Count / X-Query-Time-Ms / Server-Timing headers
+      QUERY_BUDGET_STRICT  raise QueryBudgetExceeded when a view exceeds its budget
+                           (defaults to app.testing; otherwise a warning is logged)
+      QUERY_STATS_PUBLIC   serve /_stats/queries to non-local clients
+    """
+    app.config.setdefault('QUERY_STATS_HEADERS', False)
+    app.config.setdefault('QUERY_BUDGET_STRICT', None)
+    app.config.setdefault('QUERY_STATS_PUBLIC', False)
+
+    @app.before_request
+    def _start_query_stats():
+        g._query_stats = RequestStats(keep_statements=app.testing)
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_query_stats(response):
+        stats = g.pop('_query_stats', None)
+        if stats is None or request.endpoint is None:
+            return response
+        total = time.perf_counter() - g._request_started
+        endpoint_stats.add(request.endpoint, stats, total)
+
+        if app.config['QUERY_STATS_HEADERS']:
+            response.headers['X-Query-Count'] = str(stats.queries)
+            response.headers['X-Query-Time-Ms'] = f"{stats.sql_seconds * 1000:.2f}"
+            response.headers['X-Render-Time-Ms'] = f"{stats.render_seconds * 1000:.2f}"
+            response.headers['Server-Timing'] = (
+                f"db;dur={stats.sql_seconds * 1000:.2f}, render;dur={stats.render_seconds * 1000:.2f}, "
+                f"total;dur={total * 1000:.2f}"
+            )
+
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and stats.queries > budget:
+            message = f"{request.endpoint} ran {stats.queries} queries (budget {budget})"
+            strict = app.config['QUERY_BUDGET_STRICT']
+            if strict or (strict is None and app.testing):
+                listing = '\n'.join(f"  {i + 1}. {s}" for i, s in enumerate(stats.statements or []))
+                raise QueryBudgetExceeded(f"{message}:\n{listing}")
+            app.logger.warning(message)
+        return response
+
+    @app.route('/_stats/queries')
+    def query_stats():
+        if not app.config['QUERY_STATS_PUBLIC'] and request.remote_addr not in LOCAL_ADDRS:
+            return jsonify({'error': 'Not found'}), 404
+        if request.args.get('reset'):
+            endpoint_stats.reset()
+        return jsonify(endpoint_stats.snapshot())
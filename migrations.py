@@ -0,0 +1,71 @@
+# migrations.py
+# Small, idempotent schema upgrades for databases created before a model change.
+# db.create_all() only creates missing tables; anything that alters an existing
+# table goes here and runs once at startup.
+
+from sqlalchemy import inspect, text
+
+from models import db, parse_price
+
+
+def _columns(table_name):
+    return {col['name'] for col in inspect(db.engine).get_columns(table_name)}
+
+
+def _add_column(table_name, ddl):
+    db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+
+
+def upgrade_conversation_summary():
+    """Adds the inbox summary columns/indexes and backfills them from existing messages."""
+    existing = _columns('conversation')
+    if 'last_message_at' not in existing:
+        print("Migrating: adding conversation summary columns...")
+        _add_column('conversation', 'last_message_text VARCHAR(200)')
+        _add_column('conversation', 'last_message_at TIMESTAMP')
+        _add_column('conversation', 'last_sender_id INTEGER')
+        _add_column('conversation', 'buyer_unread INTEGER NOT NULL DEFAULT 0')
+        _add_column('conversation', 'seller_unread INTEGER NOT NULL DEFAULT 0')
+        db.session.execute(text("""
+            UPDATE conversation SET
+                last_message_text = (SELECT substr(m.text, 1, 200) FROM message m WHERE m.conversation_id = conversation.id ORDER BY m.id DESC LIMIT 1),
+                last_message_at = (SELECT m.timestamp FROM message m WHERE m.conversation_id = conversation.id ORDER BY m.id DESC LIMIT 1),
+                last_sender_id = (SELECT m.sender_id FROM message m WHERE m.conversation_id = conversation.id ORDER BY m.id DESC LIMIT 1)
+        """))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_buyer_id ON conversation (buyer_id)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_seller_id ON conversation (seller_id)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_message_conversation_timestamp ON message (conversation_id, timestamp)"))
+
+
+def upgrade_product_price():
+    """Adds the numeric price/unit columns, parses existing price strings into them, and indexes them."""
+    existing = _columns('product')
+    if 'price_amount' not in existing:
+        print("Migrating: adding numeric product prices...")
+        _add_column('product', 'price_amount NUMERIC(12, 2)')
+        _add_column('product', 'price_unit VARCHAR(20)')
+        rows = db.session.execute(text("SELECT id, price FROM product")).all()
+        updates = []
+        for product_id, price in rows:
+            amount, unit = parse_price(price)
+            if amount is not None or unit is not None:
+                updates.append({'id': product_id, 'amount': amount, 'unit': unit})
+        if updates:
+            db.session.execute(text("UPDATE product SET price_amount = :amount, price_unit = :unit WHERE id = :id"), updates)
+        print(f"Parsed {len(updates)} of {len(rows)} product prices.")
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_product_category_id ON product (category, id)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_product_category_price ON product (category, price_amount, id)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_product_price_amount ON product (price_amount, id)"))
+
+
+UPGRADES = [
+    upgrade_conversation_summary,
+    upgrade_product_price,
+]
+
+
+def run_migrations():
+    """Applies every upgrade in order. Call inside an app context, after db.create_all()."""
+    for upgrade in UPGRADES:
+        upgrade()
+    db.session.commit()
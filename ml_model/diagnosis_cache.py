@@ -0,0 +1,257 @@
+# ml_model/diagnosis_cache.py
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+# --- Configuration ---
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB_PATH = os.path.join(PROJECT_DIR, "instance", "diagnosis_cache.sqlite")
+
+CACHE_ENABLED = os.getenv("DIAGNOSIS_CACHE_ENABLED", "1") != "0"
+LRU_SIZE = int(os.getenv("DIAGNOSIS_CACHE_LRU_SIZE", "256"))
+TTL_SECONDS = int(os.getenv("DIAGNOSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Max Hamming distance between two 64-bit dHashes to count as "the same leaf".
+# Must stay below PHASH_BANDS so the band index is guaranteed to find every match.
+PHASH_MAX_DISTANCE = int(os.getenv("DIAGNOSIS_CACHE_PHASH_DISTANCE", "4"))
+PHASH_BANDS = 8
+PURGE_EVERY = 100
+
+
+def content_hash(image_bytes):
+    """Exact SHA-256 of the uploaded file."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(img):
+    """64-bit difference hash (dHash) of a PIL image, returned as an int."""
+    img = ImageOps.exif_transpose(img).convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = img.tobytes()  # one byte per pixel in mode L
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(phash):
+    """Split a 64-bit hash into PHASH_BANDS 8-bit bands for the near-match index."""
+    return [(phash >> (8 * i)) & 0xFF for i in range(PHASH_BANDS)]
+
+
+def _to_signed(phash):
+    """SQLite integers are signed 64-bit; store the hash in two's complement."""
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def image_keys(image_bytes):
+    """Returns (content_hash, perceptual_hash, PIL image) for raw upload bytes."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    return content_hash(image_bytes), perceptual_hash(img), img
+
+
+class DiagnosisCache:
+    """
+    Two-tier cache of diagnosis results keyed by image content.
+    Tier 1 is an in-process LRU, tier 2 a SQLite table shared by all workers.
+    Entries are stamped with a model version so a prompt/model change never
+    serves stale diagnoses. The lock only guards the LRU and counters; each
+    thread queries SQLite on its own connection without holding it.
+    """
+
+    def __init__(self, version, db_path=DEFAULT_DB_PATH, lru_size=LRU_SIZE, ttl_seconds=TTL_SECONDS,
+                 max_distance=PHASH_MAX_DISTANCE, enabled=CACHE_ENABLED):
+        self.version = version
+        self.enabled = enabled
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = min(max_distance, PHASH_BANDS - 1)
+        self._lru = OrderedDict()  # content_hash -> (phash, expires_at, result)
+        self._lock = threading.Lock()
+        self._local = threading.local()  # per-thread SQLite connection
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._writes = 0
+        self.counters = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "perceptual_hits": 0,
+            "misses": 0,
+            "stores": 0,
+        }
+
+    # --- Persistent tier ---
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._create_schema(conn)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self, conn):
+        band_cols = ", ".join(f"band{i} INTEGER NOT NULL" for i in range(PHASH_BANDS))
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS diagnosis_cache (
+                content_hash TEXT NOT NULL,
+                version TEXT NOT NULL,
+                phash INTEGER NOT NULL,
+                {band_cols},
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, version)
+            )"""
+        )
+        for i in range(PHASH_BANDS):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_diagnosis_cache_band{i} ON diagnosis_cache (version, band{i})")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_diagnosis_cache_expires ON diagnosis_cache (expires_at)")
+        # Drop anything written by a previous prompt/model version.
+        conn.execute("DELETE FROM diagnosis_cache WHERE version != ? OR expires_at < ?", (self.version, time.time()))
+        conn.commit()
+
+    def _db_lookup(self, c_hash, phash, now):
+        conn = self._db()
+        row = conn.execute(
+            "SELECT phash, expires_at, result FROM diagnosis_cache WHERE content_hash = ? AND version = ? AND expires_at >= ?",
+            (c_hash, self.version, now),
+        ).fetchone()
+        if row:
+            return row, False
+
+        # Pigeonhole: two hashes within PHASH_BANDS-1 bits share at least one band.
+        where = " OR ".join(f"band{i} = ?" for i in range(PHASH_BANDS))
+        candidates = conn.execute(
+            f"SELECT phash, expires_at, result FROM diagnosis_cache WHERE version = ? AND expires_at >= ? AND ({where})",
+            (self.version, now, *_bands(phash)),
+        ).fetchall()
+        best = None
+        for cand in candidates:
+            distance = hamming(_to_unsigned(cand[0]), phash)
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, cand)
+        return (best[1], True) if best else (None, False)
+
+    # --- Public API ---
+    def get(self, c_hash, phash):
+        """Returns a cached diagnosis dict or None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(c_hash)
+            if entry and entry[1] >= now:
+                self._lru.move_to_end(c_hash)
+                self.counters["memory_hits"] += 1
+                return dict(entry[2])
+
+            for key, (cand_phash, expires_at, result) in reversed(self._lru.items()):
+                if expires_at >= now and hamming(cand_phash, phash) <= self.max_distance:
+                    self._lru.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    self.counters["perceptual_hits"] += 1
+                    return dict(result)
+
+        # Outside the lock: other requests keep hitting the LRU while this one reads SQLite.
+        try:
+            row, near = self._db_lookup(c_hash, phash, now)
+        except sqlite3.Error as e:
+            print(f"Diagnosis cache lookup failed: {e}")
+            row, near = None, False
+        with self._lock:
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            result = json.loads(row[2])
+            self._remember(c_hash, phash, row[1], result)
+            self.counters["persistent_hits"] += 1
+            if near:
+                self.counters["perceptual_hits"] += 1
+            return dict(result)
+
+    def put(self, c_hash, phash, result):
+        if not self.enabled:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(c_hash, phash, expires_at, dict(result))
+            self.counters["stores"] += 1
+            self._writes += 1
+            purge = self._writes % PURGE_EVERY == 0
+        try:
+            conn = self._db()
+            conn.execute(
+                f"INSERT OR REPLACE INTO diagnosis_cache VALUES (?, ?, ?, {', '.join('?' * PHASH_BANDS)}, ?, ?, ?)",
+                (c_hash, self.version, _to_signed(phash), *_bands(phash), json.dumps(result), now, expires_at),
+            )
+            if purge:
+                conn.execute("DELETE FROM diagnosis_cache WHERE expires_at < ?", (now,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Diagnosis cache write failed: {e}")
+
+    def _remember(self, c_hash, phash, expires_at, result):
+        self._lru[c_hash] = (phash, expires_at, result)
+        self._lru.move_to_end(c_hash)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def invalidate(self, all_versions=False):
+        """
+        Drops cached diagnoses. By default only entries from other model/prompt
+        versions are removed; pass all_versions=True to wipe everything.
+        """
+        with self._lock:
+            self._lru.clear()
+        conn = self._db()
+        if all_versions:
+            conn.execute("DELETE FROM diagnosis_cache")
+        else:
+            conn.execute("DELETE FROM diagnosis_cache WHERE version != ?", (self.version,))
+        conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+            stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+            stats["lru_entries"] = len(self._lru)
+            stats["version"] = self.version
+            return stats
+
+
+if __name__ == "__main__":
+    # Usage: python -m ml_model.diagnosis_cache [--clear]
+    import sys
+    from ml_model.predictor import diagnosis_cache
+
+    if "--clear" in sys.argv:
+        diagnosis_cache.invalidate(all_versions=True)
+        print("Diagnosis cache cleared.")
+    else:
+        diagnosis_cache.invalidate()
+        print(f"Removed entries not matching model version {diagnosis_cache.version}.")
@@ -0,0 +1,48 @@
+# ml_model/jobs.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when the detection pool already has max_workers + max_queue jobs in flight."""
+
+
+class BoundedJobPool:
+    """
+    A thread pool that refuses new work instead of queueing without limit.
+    Predictions spend almost all of their time waiting on the model API, so
+    threads are enough; the cap keeps a burst of uploads from piling up
+    unbounded memory and minutes-long waits.
+    """
+
+    def __init__(self, max_workers=4, max_queue=16):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so a forking server (gunicorn --preload) never
+        # inherits a half-initialised pool from the master process.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="detect")
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Too many detection jobs in progress, please try again shortly.")
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,250 @@
+# ml_model/local_classifier.py
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from ml_model.remedies import load_remedies
+
+# CPU-only first tier in front of the remote model. Each leaf photo is reduced
+# to a small colour/texture feature vector and classified by distance-weighted
+# k-nearest-neighbours over labelled examples of the data/remedies.json
+# classes. Confident answers are returned directly; anything else (including
+# photos unlike anything in the training set) goes to the remote model.
+# No trained model ships with the code: until one is trained at
+# LOCAL_MODEL_PATH (see train() below) the tier is skipped entirely.
+
+# --- Configuration ---
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_PATH = os.path.join(PROJECT_DIR, "ml_model", "local_classifier.npz")
+
+MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", DEFAULT_MODEL_PATH)
+LOCAL_TIER_ENABLED = os.getenv("LOCAL_TIER_ENABLED", "1") != "0"
+CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", "0.85"))
+K_NEIGHBOURS = int(os.getenv("LOCAL_K_NEIGHBOURS", "7"))
+
+FEATURE_SIZE = 96        # photos are downscaled to this square before feature extraction
+RELATIVE_HUE_BINS = 8   # histogram of hue offsets from the leaf's median hue
+# Nearest-neighbour distances beyond this multiple of the training set's own
+# (95th percentile) spacing are treated as out-of-distribution.
+OOD_FACTOR = 1.5
+
+REMEDIES = load_remedies()
+
+
+# --- Features ---
+def _box_blur(a):
+    """3x3 mean filter with edge padding."""
+    p = np.pad(a, 1, mode="edge")
+    h, w = a.shape
+    return sum(p[dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)) / 9.0
+
+
+def _otsu(channel):
+    """Threshold that best separates a channel's values into two groups (Otsu's method)."""
+    counts, _ = np.histogram(channel, bins=256, range=(0, 256))
+    p = counts / counts.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    between = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega) + 1e-12)
+    return int(np.argmax(between))
+
+
+def _erode(mask, steps=2):
+    """Shrinks a boolean mask so blurred leaf edges don't read as discoloured tissue."""
+    for _ in range(steps):
+        p = np.pad(mask, 1, mode="constant")
+        h, w = mask.shape
+        mask = np.logical_and.reduce([p[dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)])
+    return mask
+
+
+def _fill_holes(mask):
+    """Adds enclosed regions to a mask: background is only what connects to the frame border."""
+    outside = np.zeros_like(mask)
+    outside[0, :], outside[-1, :], outside[:, 0], outside[:, -1] = ~mask[0, :], ~mask[-1, :], ~mask[:, 0], ~mask[:, -1]
+    while True:
+        p = np.pad(outside, 1, mode="constant")
+        h, w = mask.shape
+        grown = (p[1:h + 1, 1:w + 1] | p[:h, 1:w + 1] | p[2:, 1:w + 1] | p[1:h + 1, :w] | p[1:h + 1, 2:]) & ~mask
+        if (grown == outside).all():
+            return ~outside
+        outside = grown
+
+
+def extract_features(img):
+    """
+    Symptom features of the leaf area of a PIL image, measured relative to the
+    leaf's own dominant colour so lighting and leaf shade matter less than
+    off-colour patches, spots and blotches.
+    """
+    img = ImageOps.exif_transpose(img).convert("RGB").resize((FEATURE_SIZE, FEATURE_SIZE), Image.BILINEAR)
+    hsv = np.asarray(img.convert("HSV"), dtype=np.float32)
+    hue, sat, val = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    gray = np.asarray(img.convert("L"), dtype=np.float32)
+
+    # Leaf pixels are the saturated ones (backgrounds are soil, paper or sky). Fall back to the whole frame.
+    # Lesions can be far less saturated than healthy tissue, so holes in the leaf are filled back in.
+    mask = _erode(_fill_holes(sat > max(30, _otsu(sat))))
+    if mask.sum() < 0.05 * mask.size:
+        mask = np.ones_like(mask)
+    n = float(mask.sum())
+
+    leaf_hue, leaf_val = np.median(hue[mask]), np.median(val[mask])
+    # Hue is circular (0-255 in PIL).
+    d_hue = (hue - leaf_hue + 128) % 256 - 128
+    off = (np.abs(d_hue) > 12) & mask
+    dark = (val < 0.6 * leaf_val) & mask
+    yellowish = off & (d_hue < 0) & (hue >= 28)
+    brownish = off & (hue < 28)
+
+    fine = np.abs(gray - _box_blur(gray))
+    coarse_blur = gray
+    for _ in range(4):
+        coarse_blur = _box_blur(coarse_blur)
+    coarse = np.abs(gray - coarse_blur)
+    gy, gx = np.gradient(gray)
+    grad = np.hypot(gx, gy)
+
+    rel_hist, _ = np.histogram(d_hue[mask], bins=RELATIVE_HUE_BINS, range=(-48, 48))
+    return np.concatenate([
+        [off.sum() / n, dark.sum() / n, yellowish.sum() / n, brownish.sum() / n],
+        [(fine > 15)[mask].mean(), fine[mask].mean() / 16.0, (coarse > 25)[mask].mean(), coarse[mask].mean() / 16.0],
+        [grad[mask].mean() / 32.0, grad[mask].std() / 32.0, val[mask].std() / leaf_val, sat[mask].std() / 64.0],
+        rel_hist / n,
+    ]).astype(np.float32)
+
+
+def image_features(image_path):
+    with Image.open(image_path) as img:
+        return extract_features(img)
+
+
+# --- Classifier ---
+class LocalClassifier:
+    """Distance-weighted k-NN over standardized feature vectors."""
+
+    def __init__(self, features, labels, mean, std, max_distance, k=K_NEIGHBOURS):
+        self.features = features
+        self.labels = np.asarray(labels)
+        self.mean = mean
+        self.std = std
+        self.max_distance = float(max_distance)
+        self.k = min(k, len(labels))
+        self.classes = sorted(set(self.labels.tolist()))
+
+    @classmethod
+    def fit(cls, features, labels, k=K_NEIGHBOURS):
+        features = np.asarray(features, dtype=np.float32)
+        mean = features.mean(axis=0)
+        std = features.std(axis=0) + 1e-6
+        scaled = (features - mean) / std
+        # Typical spacing of the training set: distance from each example to its nearest other example.
+        sq = (scaled ** 2).sum(axis=1)
+        d = np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2 * scaled @ scaled.T, 0))
+        np.fill_diagonal(d, np.inf)
+        spacing = np.percentile(d.min(axis=1), 95)
+        return cls(scaled, labels, mean, std, spacing * OOD_FACTOR, k=k)
+
+    def classify(self, feature_vector):
+        """Returns (label, confidence); confidence is 0 for out-of-distribution photos."""
+        x = (feature_vector - self.mean) / self.std
+        distances = np.sqrt(((self.features - x) ** 2).sum(axis=1))
+        nearest = np.argsort(distances)[:self.k]
+        if distances[nearest[0]] > self.max_distance:
+            return self.labels[nearest[0]], 0.0
+        weights = 1.0 / (distances[nearest] + 1e-6)
+        votes = {}
+        for label, weight in zip(self.labels[nearest], weights):
+            votes[label] = votes.get(label, 0.0) + weight
+        label = max(votes, key=votes.get)
+        return str(label), float(votes[label] / weights.sum())
+
+    def save(self, path):
+        np.savez_compressed(path, features=self.features, labels=self.labels, mean=self.mean, std=self.std,
+                            max_distance=self.max_distance, k=self.k)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["features"], data["labels"], data["mean"], data["std"], data["max_distance"], k=int(data["k"]))
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    """The trained classifier at LOCAL_MODEL_PATH, or None if there is none (the local tier is then skipped)."""
+    global _classifier
+    if _classifier is None and LOCAL_TIER_ENABLED and os.path.exists(MODEL_PATH):
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = LocalClassifier.load(MODEL_PATH)
+    return _classifier
+
+
+def diagnosis_for(label, confidence):
+    """A predict_disease()-shaped result for a local answer."""
+    remedy = REMEDIES[label]
+    return {
+        "plant_name": label.split()[0] if label != "Healthy" else "Unknown",
+        "disease_name": label,
+        "remedy_description": remedy["description"],
+        "product_keyword": remedy["product_keyword"],
+        "source": "local",
+        "confidence": round(confidence, 3),
+    }
+
+
+def local_first(remote_predict, threshold=None):
+    """
+    Wraps a predict_disease(image_path) function so confident local answers
+    skip it. threshold defaults to LOCAL_CONFIDENCE_THRESHOLD.
+    """
+    def predict_disease(image_path):
+        classifier = get_classifier()
+        if classifier is not None:
+            try:
+                label, confidence = classifier.classify(image_features(image_path))
+                if confidence >= (CONFIDENCE_THRESHOLD if threshold is None else threshold) and label in REMEDIES:
+                    return diagnosis_for(label, confidence)
+            except Exception as e:
+                print(f"Local classifier failed, using the remote model: {e}")
+        return remote_predict(image_path)
+    return predict_disease
+
+
+def train(image_dir, labels_path, model_path=MODEL_PATH):
+    """
+    Fits the classifier on labelled photos. labels_path is a JSON object of
+    {filename: disease_name} (e.g. diagnoses recorded from the remote model).
+    """
+    with open(labels_path, encoding="utf-8") as f:
+        labels = json.load(f)
+    features, targets = [], []
+    for filename, label in sorted(labels.items()):
+        if label not in REMEDIES:
+            print(f"Skipping {filename}: '{label}' is not a class in remedies.json")
+            continue
+        features.append(image_features(os.path.join(image_dir, filename)))
+        targets.append(label)
+    started = time.perf_counter()
+    classifier = LocalClassifier.fit(features, targets)
+    classifier.save(model_path)
+    print(f"Trained on {len(targets)} photos ({', '.join(classifier.classes)}) in "
+          f"{time.perf_counter() - started:.2f}s -> {model_path}")
+    return classifier
+
+
+if __name__ == "__main__":
+    # Usage: python -m ml_model.local_classifier <image_dir> <labels.json> [model_path]
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python -m ml_model.local_classifier <image_dir> <labels.json> [model_path]")
+        sys.exit(1)
+    train(sys.argv[1], sys.argv[2], *sys.argv[3:4])
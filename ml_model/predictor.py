@@ -1,44 +1,84 @@
 # ml_model/predictor.py
-import google.generativeai as genai
 import os
+import hashlib
+import threading
 from dotenv import load_dotenv
-from PIL import Image
 import json
 
+from ml_model.diagnosis_cache import DiagnosisCache, image_keys
+from outbound import dependency
+
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in .env file.")
-genai.configure(api_key=api_key)
+MODEL_NAME = 'gemini-1.5-flash-latest'
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))  # seconds per diagnosis call
+gemini = dependency('gemini', timeout=GEMINI_TIMEOUT)
+
+# The Gemini SDK is slow to import and needs the API key, so the client is
+# only created when the first diagnosis actually reaches the remote model.
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY not found in .env file.")
+            import google.generativeai as genai
+            options = {}
+            endpoint = os.getenv("GEMINI_API_ENDPOINT")
+            if endpoint:
+                # A stand-in server (tests, offline runs) speaking the REST API.
+                options = {"transport": "rest", "client_options": {"api_endpoint": endpoint}}
+            genai.configure(api_key=api_key, **options)
+            _model = genai.GenerativeModel(MODEL_NAME)
+        return _model
+
+PROMPT = [
+    "You are an expert agricultural botanist. Analyze this image of a plant leaf.",
+    "Respond ONLY with a single JSON object in the following format:",
+    """
+    {
+      "plant_name": "Name of the plant (e.g., 'Tomato', 'Potato', 'Rose')",
+      "disease_name": "Name of the disease or 'Healthy'",
+      "remedy_description": "A brief, one or two-sentence suggestion for treatment. If healthy, suggest a general care tip.",
+      "product_keyword": "A single, generic search term for a product to treat the disease (e.g., 'fungicide', 'neem oil', 'bactericide'). If healthy, this should be null."
+    }
+    """,
+]
+
+# Cached diagnoses are only valid for the prompt + model that produced them.
+# Changing either (or setting DIAGNOSIS_MODEL_VERSION) invalidates the cache.
+MODEL_VERSION = os.getenv("DIAGNOSIS_MODEL_VERSION") or hashlib.sha1(
+    json.dumps([MODEL_NAME, PROMPT]).encode("utf-8")
+).hexdigest()[:12]
 
-model = genai.GenerativeModel('gemini-1.5-flash-latest')
+diagnosis_cache = DiagnosisCache(version=MODEL_VERSION)
 
 def predict_disease(image_path):
     """
     Takes an image path and returns a detailed JSON object with plant, disease, remedy, and keyword.
+    Repeat uploads of the same (or a near-identical) photo are answered from the diagnosis cache.
     """
     try:
-        img = Image.open(image_path)
-        
-        # New, more detailed prompt
-        prompt = [
-            "You are an expert agricultural botanist. Analyze this image of a plant leaf.",
-            "Respond ONLY with a single JSON object in the following format:",
-            """
-            {
-              "plant_name": "Name of the plant (e.g., 'Tomato', 'Potato', 'Rose')",
-              "disease_name": "Name of the disease or 'Healthy'",
-              "remedy_description": "A brief, one or two-sentence suggestion for treatment. If healthy, suggest a general care tip.",
-              "product_keyword": "A single, generic search term for a product to treat the disease (e.g., 'fungicide', 'neem oil', 'bactericide'). If healthy, this should be null."
-            }
-            """,
-            img
-        ]
-        
-        response = model.generate_content(prompt)
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+        c_hash, p_hash, img = image_keys(image_bytes)
+
+        cached = diagnosis_cache.get(c_hash, p_hash)
+        if cached is not None:
+            return cached
+
+        model = get_model()
+        # While Gemini is failing the breaker answers at once with the error result below.
+        with gemini.guard() as call:
+            response = model.generate_content(PROMPT + [img], request_options={"timeout": call.timeout})
         response_text = response.text.strip().replace('```json', '').replace('```', '')
-        return json.loads(response_text)
+        result = json.loads(response_text)
+        diagnosis_cache.put(c_hash, p_hash, result)
+        return result
         
     except Exception as e:
         print(f"An error occurred during prediction: {e}")
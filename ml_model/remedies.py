@@ -0,0 +1,28 @@
+# ml_model/remedies.py
+# The disease classes and their remedies from data/remedies.json, shared by
+# the stub predictor, the local classifier and the recommendation index.
+# Descriptions are shown to farmers as-is, so the file is checked on load.
+import json
+import os
+import re
+
+REMEDIES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "remedies.json")
+
+# Latin script (with punctuation and the rupee sign) and Devanagari. Anything
+# else, e.g. spam pasted into an entry, fails the load instead of reaching users.
+REMEDY_TEXT_RE = re.compile(r"[\s\x20-\x7E -ɏऀ-ॿ–—‘’“”•₹]*")
+
+
+def load_remedies(path=REMEDIES_PATH):
+    """
+    {disease_name: {"description", "product_keyword"}} from remedies.json.
+    Raises ValueError if a description contains characters outside Latin and Devanagari.
+    """
+    with open(path, encoding="utf-8") as f:
+        remedies = json.load(f)
+    for name, remedy in remedies.items():
+        description = remedy.get("description") or ""
+        if not REMEDY_TEXT_RE.fullmatch(description):
+            junk = "".join(sorted({c for c in description if not REMEDY_TEXT_RE.fullmatch(c)}))
+            raise ValueError(f"{path}: the description of '{name}' contains unexpected text: {junk!r}")
+    return remedies
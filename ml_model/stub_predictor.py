@@ -0,0 +1,43 @@
+# ml_model/stub_predictor.py
+import hashlib
+import os
+import time
+
+from ml_model.remedies import load_remedies
+
+# Offline stand-in for ml_model.predictor, enabled with PREDICTOR_BACKEND=stub.
+# It answers from data/remedies.json so the detection flow can be exercised
+# without a GEMINI_API_KEY or network access.
+STUB_DELAY_SECONDS = float(os.getenv("STUB_PREDICTOR_DELAY", "0"))
+
+REMEDIES = load_remedies()
+
+def predict_disease(image_path):
+    """
+    Returns a deterministic diagnosis for an image: the same file always maps
+    to the same entry in remedies.json.
+    """
+    if STUB_DELAY_SECONDS:
+        time.sleep(STUB_DELAY_SECONDS)
+    try:
+        with open(image_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).digest()
+    except OSError as e:
+        print(f"An error occurred during prediction: {e}")
+        return {
+            "plant_name": "Unknown",
+            "disease_name": "Prediction Error",
+            "remedy_description": "Could not get a valid response from the AI model.",
+            "product_keyword": None
+        }
+
+    names = sorted(REMEDIES)
+    disease_name = names[digest[0] % len(names)]
+    remedy = REMEDIES[disease_name]
+    plant_name = disease_name.split()[0] if disease_name != "Healthy" else "Unknown"
+    return {
+        "plant_name": plant_name,
+        "disease_name": disease_name,
+        "remedy_description": remedy["description"],
+        "product_keyword": remedy["product_keyword"]
+    }
@@ -0,0 +1,217 @@
+# models.py
+# The SQLAlchemy instance and all database models, shared by app.py and the
+# scripts that work on the same tables outside a request.
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.sql import ClauseElement
+from datetime import datetime
+import re
+import uuid
+
+from engine_profile import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# --- DATABASE MODELS ---
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    mobile = db.Column(db.String(20), unique=True, nullable=False)
+    password = db.Column(db.String(200), nullable=False)
+    role = db.Column(db.String(20), nullable=False)
+    products = db.relationship('Product', backref='seller_user', lazy=True)
+
+PRICE_RE = re.compile(r'(\d[\d,]*(?:\.\d+)?)')
+PRICE_UNIT_RE = re.compile(r'(?:/|\bper\b)\s*(.+)$', re.IGNORECASE)
+
+
+def parse_price(value):
+    """
+    Splits a seller-entered price like "₹1,200", "Rs. 450/kg" or "250 per 500 ml"
+    into (amount, unit). Either part is None when it can't be read.
+    """
+    value = (value or '').strip()
+    match = PRICE_RE.search(value)
+    amount = float(match.group(1).replace(',', '')) if match else None
+    unit_match = PRICE_UNIT_RE.search(value)
+    unit = (unit_match.group(1).strip()[:20] or None) if unit_match else None
+    return amount, unit
+
+
+class DataVersion(db.Model):
+    """
+    A counter per data set ('catalog': the products) bumped in the same
+    transaction as every write to it, so readers can tell "changed since"
+    with one indexed lookup. Ids alone can't: SQLite reuses the highest id
+    after a delete.
+    """
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+def bump_version(name):
+    """Increments a DataVersion counter in the current transaction. Commit with the write it tracks."""
+    updated = db.session.query(DataVersion).filter_by(name=name).update(
+        {'version': DataVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.session.add(DataVersion(name=name, version=1))
+
+
+class Product(db.Model):
+    __table_args__ = (
+        # Store browsing filters by category and pages/sorts by id or (price, id).
+        db.Index('ix_product_category_id', 'category', 'id'),
+        db.Index('ix_product_category_price', 'category', 'price_amount', 'id'),
+        db.Index('ix_product_price_amount', 'price_amount', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    price = db.Column(db.String(50), nullable=False)  # as entered by the seller, shown on cards
+    price_amount = db.Column(db.Numeric(12, 2, asdecimal=False), nullable=True)  # parsed from price
+    price_unit = db.Column(db.String(20), nullable=True)
+    image = db.Column(db.String(100), nullable=False)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+class Conversation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Denormalized summary of the newest message, kept current by add_message(),
+    # so the inbox never has to load message rows.
+    last_message_text = db.Column(db.String(200), nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_sender_id = db.Column(db.Integer, nullable=True)
+    buyer_unread = db.Column(db.Integer, nullable=False, default=0)
+    seller_unread = db.Column(db.Integer, nullable=False, default=0)
+    messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan", order_by='Message.id')
+    product = db.relationship('Product', backref='conversations')
+    buyer = db.relationship('User', foreign_keys=[buyer_id])
+    seller = db.relationship('User', foreign_keys=[seller_id])
+
+    def add_message(self, sender_id, text):
+        """Creates a Message and updates the summary columns in the same transaction."""
+        msg = Message(conversation_id=self.id, sender_id=sender_id, text=text, timestamp=datetime.utcnow())
+        db.session.add(msg)
+        self.last_message_text = text[:200]
+        self.last_message_at = msg.timestamp
+        self.last_sender_id = sender_id
+        # SQL-side increments so concurrent senders don't lose counts.
+        self._count_unread(Conversation.seller_unread if sender_id == self.buyer_id else Conversation.buyer_unread)
+        return msg
+
+    def _count_unread(self, column):
+        # A second message before the flush must add to the pending increment, not replace it.
+        pending = self.__dict__.get(column.key)
+        base = pending if isinstance(pending, ClauseElement) else column
+        setattr(self, column.key, base + 1)
+
+    def mark_read(self, user_id):
+        """Clears the unread count for one participant. Returns True if anything changed."""
+        for participant, column in ((self.buyer_id, 'buyer_unread'), (self.seller_id, 'seller_unread')):
+            if user_id == participant:
+                count = getattr(self, column)
+                if isinstance(count, ClauseElement) or count:  # a pending increment is unread too
+                    setattr(self, column, 0)
+                    return True
+        return False
+
+class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sender = db.relationship('User', foreign_keys=[sender_id])
+
+class PasswordReset(db.Model):
+    """The pending forgot-password OTP for a user. Kept server-side so the session cookie only says who is resetting."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    otp_hash = db.Column(db.String(200), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # wrong guesses so far, incremented in SQL
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class DetectionJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    image = db.Column(db.String(100), nullable=False)
+    result = db.Column(db.Text, nullable=True)  # JSON-encoded prediction_data
+    error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class StoredUpload(db.Model):
+    """
+    One content-addressed upload file (see uploads.py) and how many rows point
+    at it: Product.image for kind 'product', DetectionJob.image for 'leaf'.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'path', name='uq_stored_upload_kind_path'),
+        db.Index('ix_stored_upload_kind_refcount_used', 'kind', 'refcount', 'last_used_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # product, leaf
+    path = db.Column(db.String(100), nullable=False)  # ab/cd/<sha256>.<ext>, relative to the kind's folder
+    size = db.Column(db.Integer, nullable=False, default=0)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # last retain or release
+
+class LegacyRecord(db.Model):
+    """
+    Which row a record from the pre-database JSON files became (see
+    scripts/legacy_import.py), so re-running the import skips it. Users need no
+    entry: they are matched on email.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'legacy_id', name='uq_legacy_record_kind_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # product, conversation
+    legacy_id = db.Column(db.String(64), nullable=False)  # id in the JSON file, or a digest of records without one
+    record_id = db.Column(db.Integer, nullable=False)
+    imported_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class PriceRecord(db.Model):
+    """One day's mandi price for a commodity/variety at a market, as published on data.gov.in."""
+    __table_args__ = (
+        db.UniqueConstraint('arrival_date', 'market', 'commodity', 'variety', name='uq_price_record_day_market_item'),
+        db.Index('ix_price_record_commodity_market_date', 'commodity', 'market', 'arrival_date'),
+        db.Index('ix_price_record_commodity_date', 'commodity', 'arrival_date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    arrival_date = db.Column(db.Date, nullable=False)
+    state = db.Column(db.String(60), nullable=False)
+    district = db.Column(db.String(60), nullable=False, default='')
+    market = db.Column(db.String(100), nullable=False)
+    commodity = db.Column(db.String(100), nullable=False)
+    variety = db.Column(db.String(100), nullable=False, default='')
+    grade = db.Column(db.String(50), nullable=False, default='')
+    min_price = db.Column(db.Float, nullable=True)    # Rs / quintal
+    max_price = db.Column(db.Float, nullable=True)
+    modal_price = db.Column(db.Float, nullable=True)
+    ingested_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Notification(db.Model):
+    """An outbound SMS or email, queued by a request and delivered by the workers in notifications.py."""
+    __table_args__ = (
+        db.Index('ix_notification_channel_status_due', 'channel', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False)  # sms, email
+    recipient = db.Column(db.String(120), nullable=False)  # cleaned 10-digit number or email address
+    route = db.Column(db.String(10), nullable=True)  # Fast2SMS route for sms
+    body = db.Column(db.Text, nullable=False)  # SMS text, or the complete MIME message; blanked once delivered
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # also the claim expiry while sending
+    claim_token = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,386 @@
+# notifications.py
+# Outbound SMS and email (password-reset OTPs), delivered in the background
+# from a durable queue.
+#
+# A request only inserts a Notification row and returns. Worker threads claim
+# due rows in batches and deliver them over long-lived connections: each email
+# worker keeps one logged-in SMTP session open, and SMS go through one pooled
+# keep-alive HTTP session. SMS rows with the same text on a bulk-capable
+# Fast2SMS route are coalesced into a single bulkV2 call. Failed sends are
+# retried with exponential backoff. A claim expires after NOTIFY_CLAIM_SECONDS,
+# so rows held by a worker that died are picked up again, and several gunicorn
+# workers can safely share one queue.
+
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+from flask import current_app, jsonify, request
+
+from email_utils import SMTP_HOST, SMTP_PORT, SMTP_SECURITY, SMTPConnection, build_otp_email, smtp_credentials
+from instrumentation import LOCAL_ADDRS
+from models import db, Notification
+from sms_utils import BULK_ROUTES, SMS_BATCH_SIZE, Fast2SMSClient, clean_number, otp_message
+
+CHANNELS = ('email', 'sms')
+THROUGHPUT_WINDOW = 60  # seconds of deliveries behind the messages/sec figure
+
+
+# --- Metrics ---
+class ChannelMetrics:
+    """Per-channel delivery counters and a rolling messages/sec figure."""
+
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.sent = self.failed = self.retried = 0
+        self.calls = 0             # SMTP sends / bulkV2 requests
+        self.call_seconds = 0.0
+        self._recent = deque()     # (monotonic time, messages delivered)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def record_call(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.call_seconds += seconds
+
+    def record_results(self, sent, failed, retried):
+        now = time.monotonic()
+        with self._lock:
+            self.sent += sent
+            self.failed += failed
+            self.retried += retried
+            if sent:
+                self._recent.append((now, sent))
+            while self._recent and now - self._recent[0][0] > self.window:
+                self._recent.popleft()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(n for t, n in self._recent if now - t <= self.window)
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'calls': self.calls,
+                'avg_call_ms': round(self.call_seconds / self.calls * 1000, 2) if self.calls else None,
+                'messages_per_call': round(self.sent / self.calls, 2) if self.calls else None,
+                'sent_per_sec': round(recent / self.window, 3),
+            }
+
+
+# --- Senders (one per worker thread) ---
+def _is_permanent(error):
+    """Errors that retrying the same message cannot fix."""
+    if getattr(error, 'permanent', False):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class EmailSender:
+    """Delivers email rows over one persistent SMTP session."""
+
+    def __init__(self, config, metrics):
+        username, password = config['SMTP_USERNAME'], config['SMTP_PASSWORD']
+        self.sender_email = config['NOTIFY_MAIL_SENDER']
+        self.connection = SMTPConnection(host=config['SMTP_HOST'], port=config['SMTP_PORT'],
+                                         security=config['SMTP_SECURITY'], username=username, password=password)
+        self.metrics = metrics
+
+    def deliver(self, rows):
+        """Yields (row, error) with error None on success."""
+        for row in rows:
+            started = time.perf_counter()
+            try:
+                self.connection.send(self.sender_email, [row.recipient], row.body)
+                yield row, None
+            except Exception as e:
+                yield row, e
+            finally:
+                self.metrics.record_call(time.perf_counter() - started)
+
+    def close(self):
+        self.connection.close()
+
+
+class SMSSender:
+    """Delivers SMS rows through Fast2SMS, one bulkV2 call per (route, text) group where the route allows it."""
+
+    def __init__(self, client, metrics):
+        self.client = client
+        self.metrics = metrics
+
+    def deliver(self, rows):
+        groups = defaultdict(list)
+        for row in rows:
+            key = (row.route, row.body) if row.route in BULK_ROUTES else (row.route, row.body, row.id)
+            groups[key].append(row)
+        for group in groups.values():
+            for start in range(0, len(group), SMS_BATCH_SIZE):
+                chunk = group[start:start + SMS_BATCH_SIZE]
+                started = time.perf_counter()
+                try:
+                    self.client.send(chunk[0].body, [row.recipient for row in chunk], route=chunk[0].route)
+                    error = None
+                except Exception as e:
+                    error = e
+                self.metrics.record_call(time.perf_counter() - started)
+                for row in chunk:
+                    yield row, error
+
+    def close(self):
+        pass
+
+
+# --- Dispatcher ---
+class NotificationDispatcher:
+    """
+    Queues notifications and runs the background workers that deliver them,
+    for one app: its config, metrics and worker threads. init_app() keeps it
+    in app.extensions['notifications'].
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.metrics = {channel: ChannelMetrics() for channel in CHANNELS}
+        self._sms_client = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = {channel: threading.Event() for channel in CHANNELS}
+        self._stopping = threading.Event()
+        self._workers = []
+
+    # --- Queueing ---
+    def enqueue_sms(self, phone_number, message, route='q'):
+        """Queues one SMS. Returns the Notification, or None if the number isn't a valid mobile number."""
+        number = clean_number(phone_number)
+        if number is None:
+            print(f"Not queueing SMS: invalid phone number {phone_number!r}")
+            return None
+        return self._enqueue('sms', number, message, route=route)
+
+    def enqueue_email(self, recipient, message):
+        """Queues one email; `message` is an email.message.Message with its headers set."""
+        return self._enqueue('email', recipient, message.as_string())
+
+    def send_otp(self, user, otp):
+        """Queues the password-reset OTP to the user's email and, if it has one, mobile number."""
+        sent = [self.enqueue_email(user.email, build_otp_email(self.app.config['NOTIFY_MAIL_SENDER'], user.email, otp))]
+        if user.mobile:
+            sent.append(self.enqueue_sms(user.mobile, otp_message(otp)))
+        return [n for n in sent if n is not None]
+
+    def _enqueue(self, channel, recipient, body, route=None):
+        """Inserts the row and commits the session, then wakes this process's workers."""
+        row = Notification(channel=channel, recipient=recipient, body=body, route=route)
+        db.session.add(row)
+        db.session.commit()
+        self.start()
+        self._wake[channel].set()
+        return row
+
+    # --- Delivery ---
+    def _sender(self, channel):
+        """This thread's sender for a channel; an SMTP session is never shared between threads."""
+        senders = getattr(self._local, 'senders', None)
+        if senders is None:
+            senders = self._local.senders = {}
+        if channel not in senders:
+            config = self.app.config
+            if channel == 'email':
+                senders[channel] = EmailSender(config, self.metrics[channel])
+            else:
+                with self._lock:
+                    if self._sms_client is None:
+                        self._sms_client = Fast2SMSClient(api_key=config['FAST2SMS_API_KEY'], url=config['FAST2SMS_URL'])
+                senders[channel] = SMSSender(self._sms_client, self.metrics[channel])
+        return senders[channel]
+
+    def close_senders(self):
+        """Closes this thread's connections."""
+        for sender in getattr(self._local, 'senders', {}).values():
+            sender.close()
+        self._local.senders = {}
+
+    def _claim(self, channel):
+        """Marks up to NOTIFY_BATCH_SIZE due rows as ours. Safe against other threads and processes."""
+        config = self.app.config
+        now = datetime.utcnow()
+        due = (Notification.channel == channel, Notification.status.in_(('queued', 'sending')),
+               Notification.next_attempt_at <= now)
+        ids = [row.id for row in db.session.query(Notification.id).filter(*due).order_by(
+            Notification.next_attempt_at, Notification.id).limit(config['NOTIFY_BATCH_SIZE'])]
+        if not ids:
+            db.session.rollback()
+            return []
+        token = uuid.uuid4().hex
+        db.session.query(Notification).filter(Notification.id.in_(ids), *due).update({
+            'status': 'sending',
+            'claim_token': token,
+            'next_attempt_at': now + timedelta(seconds=config['NOTIFY_CLAIM_SECONDS']),
+        }, synchronize_session=False)
+        db.session.commit()
+        return Notification.query.filter_by(claim_token=token).order_by(Notification.id).all()
+
+    def _backoff(self, attempts):
+        config = self.app.config
+        delay = min(config['NOTIFY_BACKOFF_MAX'], config['NOTIFY_BACKOFF_SECONDS'] * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)  # jitter, so a burst of failures doesn't retry in lockstep
+
+    def run_once(self, channel):
+        """
+        Claims and delivers one batch of due notifications on the calling thread.
+        Returns how many rows were handled. Call inside an app context.
+        """
+        rows = self._claim(channel)
+        if not rows:
+            return 0
+        max_attempts = self.app.config['NOTIFY_MAX_ATTEMPTS']
+        sent = failed = retried = 0
+        for row, error in self._sender(channel).deliver(rows):
+            now = datetime.utcnow()
+            row.attempts += 1
+            row.claim_token = None
+            if error is None:
+                row.status, row.sent_at, row.last_error = 'sent', now, None
+                row.body = ''  # OTPs shouldn't outlive their delivery
+                sent += 1
+            elif _is_permanent(error) or row.attempts >= max_attempts:
+                row.status, row.last_error, row.body = 'failed', str(error)[:200], ''
+                print(f"Notification {row.id} ({channel} to {row.recipient}) failed: {error}")
+                failed += 1
+            else:
+                row.status, row.last_error = 'queued', str(error)[:200]
+                row.next_attempt_at = now + timedelta(seconds=self._backoff(row.attempts))
+                retried += 1
+        db.session.commit()
+        self.metrics[channel].record_results(sent, failed, retried)
+        return len(rows)
+
+    def drain(self, channels=CHANNELS):
+        """Delivers everything currently due on the calling thread. Returns rows handled. Call inside an app context."""
+        handled = 0
+        try:
+            for channel in channels:
+                while True:
+                    count = self.run_once(channel)
+                    if not count:
+                        break
+                    handled += count
+        finally:
+            self.close_senders()
+        return handled
+
+    # --- Workers ---
+    def start(self):
+        """Starts the configured worker threads if they aren't running (threads begin on first use, so forking servers stay safe)."""
+        config = self.app.config
+        with self._lock:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            if self._workers:
+                return
+            self._stopping.clear()
+            for channel in CHANNELS:
+                for i in range(config[f'NOTIFY_{channel.upper()}_WORKERS']):
+                    worker = threading.Thread(target=self._work, args=(channel,), name=f'notify-{channel}-{i}', daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        for event in self._wake.values():
+            event.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join(timeout)
+
+    def _work(self, channel):
+        wake = self._wake[channel]
+        try:
+            while not self._stopping.is_set():
+                wake.clear()
+                try:
+                    with self.app.app_context():
+                        handled = self.run_once(channel)
+                except Exception as e:
+                    print(f"Notification worker error ({channel}): {e}")
+                    handled = 0
+                if not handled:
+                    wake.wait(self.app.config['NOTIFY_POLL_INTERVAL'])
+        finally:
+            self.close_senders()
+
+    # --- Stats ---
+    def queue_depth(self):
+        """{channel: {status: count}} from the queue table. Call inside an app context."""
+        depth = {channel: {} for channel in CHANNELS}
+        rows = db.session.query(Notification.channel, Notification.status, db.func.count(Notification.id)).group_by(
+            Notification.channel, Notification.status)
+        for channel, status, count in rows:
+            depth.setdefault(channel, {})[status] = count
+        return depth
+
+    def stats(self):
+        depth = self.queue_depth()
+        return {channel: {**self.metrics[channel].snapshot(), 'queue': depth.get(channel, {})} for channel in CHANNELS}
+
+
+
+# --- Flask wiring ---
+def init_app(app):
+    """
+    Config:
+      NOTIFY_EMAIL_WORKERS / NOTIFY_SMS_WORKERS  background threads per channel (0: only
+                              `flask send-notifications` or run_once() deliver)
+      NOTIFY_BATCH_SIZE       rows claimed per pass
+      NOTIFY_MAX_ATTEMPTS     attempts before a notification is marked failed
+      NOTIFY_BACKOFF_SECONDS  first retry delay; doubles per attempt up to NOTIFY_BACKOFF_MAX
+      NOTIFY_POLL_INTERVAL    how often idle workers look for due retries
+      NOTIFY_CLAIM_SECONDS    after this, a row claimed by a worker that died is retried
+      NOTIFY_MAIL_SENDER, SMTP_HOST, SMTP_PORT, SMTP_SECURITY, SMTP_USERNAME, SMTP_PASSWORD
+      FAST2SMS_URL, FAST2SMS_API_KEY
+      NOTIFY_STATS_PUBLIC     serve /_stats/notifications to non-local clients
+    """
+    sender_email, sender_password = smtp_credentials()
+    app.config.setdefault('NOTIFY_EMAIL_WORKERS', 1)
+    app.config.setdefault('NOTIFY_SMS_WORKERS', 1)
+    app.config.setdefault('NOTIFY_BATCH_SIZE', 50)
+    app.config.setdefault('NOTIFY_MAX_ATTEMPTS', 5)
+    app.config.setdefault('NOTIFY_BACKOFF_SECONDS', 5)
+    app.config.setdefault('NOTIFY_BACKOFF_MAX', 600)
+    app.config.setdefault('NOTIFY_POLL_INTERVAL', 2.0)
+    app.config.setdefault('NOTIFY_CLAIM_SECONDS', 120)
+    app.config.setdefault('NOTIFY_MAIL_SENDER', sender_email)
+    app.config.setdefault('SMTP_HOST', SMTP_HOST)
+    app.config.setdefault('SMTP_PORT', SMTP_PORT)
+    app.config.setdefault('SMTP_SECURITY', SMTP_SECURITY)
+    app.config.setdefault('SMTP_USERNAME', sender_email)
+    app.config.setdefault('SMTP_PASSWORD', sender_password)
+    app.config.setdefault('FAST2SMS_URL', None)
+    app.config.setdefault('FAST2SMS_API_KEY', None)
+    app.config.setdefault('NOTIFY_STATS_PUBLIC', False)
+    dispatcher = app.extensions['notifications'] = NotificationDispatcher(app)
+
+    @app.route('/_stats/notifications')
+    def notification_stats():
+        if not app.config['NOTIFY_STATS_PUBLIC'] and request.remote_addr not in LOCAL_ADDRS:
+            return jsonify({'error': 'Not found'}), 404
+        return jsonify(dispatcher.stats())
+
+
+def get_dispatcher():
+    return current_app.extensions['notifications']
@@ -0,0 +1,287 @@
+# outbound.py
+# Latency, errors and circuit breaking for calls to other services: Gemini
+# (disease diagnosis), data.gov.in (mandi prices), Fast2SMS and SMTP (OTPs).
+#
+# Each upstream is a Dependency with a deadline, a latency histogram, call /
+# error / timeout counters and a circuit breaker. Call sites wrap the network
+# call itself:
+#
+#     with dependency('data_gov').guard() as call:
+#         response = session.get(url, timeout=call.timeout)
+#
+# and pass call.timeout to their client, so no call waits longer than the
+# deadline. A call that raises, or that returns after its deadline, counts
+# against the upstream. After CIRCUIT_FAILURE_THRESHOLD consecutive failures
+# the breaker opens and guard() raises CircuitOpenError straight away for
+# CIRCUIT_RESET_SECONDS. The caller's existing error handling turns that into
+# its usual fallback: the "Prediction Error" diagnosis, the last good price
+# list, or a notification retried later. Then one trial call is let through;
+# if it succeeds the breaker closes again.
+#
+# Metrics are per process. /_stats/outbound serves them to local clients.
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import jsonify, request
+
+from instrumentation import LOCAL_ADDRS
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', 30))
+# Upper bounds of the latency buckets, in seconds; the last bucket is open-ended.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class CircuitOpenError(Exception):
+    """The upstream has been failing; the call was not attempted."""
+
+
+# requests and google-api-core timeouts, matched by name so neither package has to be imported here.
+TIMEOUT_ERROR_NAMES = {'Timeout', 'ReadTimeout', 'ConnectTimeout', 'DeadlineExceeded'}
+
+
+def is_timeout(error):
+    """True for socket/SMTP timeouts (TimeoutError), client library timeouts, and errors raised from either."""
+    while error is not None:
+        if isinstance(error, TimeoutError) or type(error).__name__ in TIMEOUT_ERROR_NAMES:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# --- Metrics ---
+class LatencyHistogram:
+    """Call durations in fixed buckets, with percentiles read off the bucket bounds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.total = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, seconds)] += 1
+            self.total += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, pct):
+        """Upper bound (ms) of the bucket holding the pct-th percentile; the observed max for the open bucket."""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = self.total * pct / 100
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    bound = self.buckets[i] if i < len(self.buckets) else self.max
+                    return round(min(bound, self.max) * 1000, 1)
+
+    def snapshot(self):
+        p50, p95, p99 = (self.percentile(p) for p in (50, 95, 99))
+        with self._lock:
+            labels = [f"le_{int(b * 1000)}ms" for b in self.buckets] + ['inf']
+            return {
+                'count': self.total,
+                'avg_ms': round(self.sum / self.total * 1000, 1) if self.total else None,
+                'max_ms': round(self.max * 1000, 1),
+                'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                'buckets': dict(zip(labels, self.counts)),
+            }
+
+
+# --- Circuit breaker ---
+class CircuitBreaker:
+    """closed -> open after failure_threshold consecutive failures -> half_open after reset_timeout -> closed."""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_SECONDS,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self.opens = 0
+            self._trial = False
+
+    def allow(self):
+        """True if a call may go ahead. In half_open exactly one trial call is allowed at a time."""
+        with self._lock:
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.warning("%s: circuit closed, upstream is answering again", self.name)
+            self.state, self.failures, self._trial = 'closed', 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                if self.state == 'closed':
+                    logger.warning("%s: circuit opened after %d consecutive failures", self.name, self.failures)
+                self.state, self.opened_at = 'open', self.clock()
+                self.opens += 1
+
+    def retry_in(self):
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+
+# --- Dependencies ---
+class Call:
+    __slots__ = ('timeout', 'started')
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.started = time.perf_counter()
+
+
+class Dependency:
+    """One upstream service: its deadline, metrics and breaker."""
+
+    def __init__(self, name, timeout, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_SECONDS, clock=time.monotonic):
+        self.name = name
+        self.timeout = timeout
+        self.latency = LatencyHistogram()
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout, clock)
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.calls = self.errors = self.timeouts = self.short_circuits = 0
+        self.last_error = None
+
+    def reset(self):
+        """Clears metrics and closes the breaker."""
+        with self._lock:
+            self._clear()
+        self.latency.reset()
+        self.breaker.reset()
+
+    @contextmanager
+    def guard(self, client_errors=()):
+        """
+        Wraps one call. Raises CircuitOpenError without running the body while
+        the breaker is open. Exceptions in `client_errors` (a rejected
+        recipient, say) are counted as errors but do not trip the breaker: the
+        upstream answered, the request was wrong.
+        """
+        if not self.breaker.allow():
+            with self._lock:
+                self.short_circuits += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, retrying in {self.breaker.retry_in():.0f}s.")
+        call = Call(self.timeout)
+        try:
+            yield call
+        except Exception as e:
+            elapsed = time.perf_counter() - call.started
+            self.latency.observe(elapsed)
+            timed_out = is_timeout(e)
+            with self._lock:
+                self.calls += 1
+                self.errors += 1
+                self.timeouts += timed_out
+                self.last_error = f"{type(e).__name__}: {e}"[:200]
+            if isinstance(e, client_errors) and not timed_out:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            raise
+        elapsed = time.perf_counter() - call.started
+        self.latency.observe(elapsed)
+        late = elapsed > self.timeout
+        with self._lock:
+            self.calls += 1
+            self.timeouts += late
+        if late:
+            # Answered, but too slowly to keep request workers free; counts towards opening the breaker.
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def snapshot(self):
+        with self._lock:
+            counters = {'calls': self.calls, 'errors': self.errors, 'timeouts': self.timeouts,
+                        'short_circuits': self.short_circuits, 'last_error': self.last_error}
+        return {
+            'timeout_s': self.timeout,
+            'circuit': self.breaker.state,
+            'circuit_opens': self.breaker.opens,
+            'retry_in_s': round(self.breaker.retry_in(), 1),
+            **counters,
+            'latency': self.latency.snapshot(),
+        }
+
+
+_dependencies = {}
+_registry_lock = threading.Lock()
+
+
+def dependency(name, timeout=10.0, **options):
+    """The process-wide Dependency called name, created with timeout/options on first use."""
+    with _registry_lock:
+        dep = _dependencies.get(name)
+        if dep is None:
+            dep = _dependencies[name] = Dependency(name, timeout, **options)
+        return dep
+
+
+def stats():
+    with _registry_lock:
+        deps = dict(_dependencies)
+    return {name: dep.snapshot() for name, dep in sorted(deps.items())}
+
+
+# --- Flask wiring ---
+def init_app(app):
+    """
+    Config:
+      OUTBOUND_STATS_PUBLIC  serve /_stats/outbound to non-local clients
+    """
+    app.config.setdefault('OUTBOUND_STATS_PUBLIC', False)
+
+    @app.route('/_stats/outbound')
+    def outbound_stats():
+        if not app.config['OUTBOUND_STATS_PUBLIC'] and request.remote_addr not in LOCAL_ADDRS:
+            return jsonify({'error': 'Not found'}), 404
+        if request.args.get('reset'):
+            with _registry_lock:
+                deps = list(_dependencies.values())
+            for dep in deps:
+                dep.reset()
+        return jsonify(stats())
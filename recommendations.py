@@ -0,0 +1,194 @@
+# recommendations.py
+# Remedy keyword -> store product recommendations for the disease detection page.
+#
+# Diagnoses only ever ask for a handful of product keywords (fungicide,
+# bactericide, neem oil, ...), so instead of searching the product table after
+# every diagnosis we keep, per process, a map from each normalized keyword to
+# its ranked product ids. Suggesting products is then a dict lookup plus one
+# primary-key fetch. The map is built lazily, patched in place when this worker
+# adds or deletes a product, and rebuilt every RECOMMENDATION_TTL seconds so
+# products listed through other workers show up too. One request rebuilds at a
+# time; the others keep answering from the previous map meanwhile.
+
+import os
+import threading
+import time
+
+from flask import current_app
+
+from ml_model.remedies import REMEDIES_PATH, load_remedies
+from models import db, Product
+from search import apply_search, query_tokens
+
+RECOMMENDATION_LIMIT = int(os.getenv('RECOMMENDATION_LIMIT', 12))
+RECOMMENDATION_TTL = int(os.getenv('RECOMMENDATION_TTL', 300))
+
+# Canonical keyword -> other phrasings and active ingredients sold under it.
+SYNONYMS = {
+    'fungicide': ['fungicidal', 'antifungal', 'mancozeb', 'chlorothalonil', 'copper oxychloride', 'carbendazim', 'sulphur'],
+    'bactericide': ['bactericidal', 'antibacterial', 'streptocycline', 'copper hydroxide'],
+    'neem oil': ['neem', 'azadirachtin'],
+    'insecticide': ['pesticide', 'imidacloprid', 'chlorpyrifos'],
+    'fertilizer': ['fertiliser', 'urea', 'npk', 'manure', 'compost'],
+}
+
+NAME_WEIGHT = 10  # a term in the product name counts this many description hits
+
+
+def normalize_keyword(value):
+    """'Fungicides', ' fungicide ' and 'FUNGICIDE' all normalize to 'fungicide'."""
+    words = []
+    for token in query_tokens(value):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        words.append(token)
+    return ' '.join(words)
+
+
+def _load_keywords():
+    """Canonical keyword -> search terms, from SYNONYMS plus every product_keyword in remedies.json."""
+    keywords = {normalize_keyword(k): [normalize_keyword(t) for t in [k] + terms] for k, terms in SYNONYMS.items()}
+    try:
+        remedies = load_remedies()
+    except (OSError, ValueError) as e:
+        print(f"Could not read {REMEDIES_PATH}: {e}")
+        remedies = {}
+    for remedy in remedies.values():
+        keyword = normalize_keyword(remedy.get('product_keyword'))
+        if keyword:
+            keywords.setdefault(keyword, [keyword])
+    return keywords
+
+
+def _score(terms, name, description):
+    """How well a product matches a keyword: every term whose words all prefix-match counts, names weigh more."""
+    name_tokens, description_tokens = query_tokens(name), query_tokens(description)
+    score = 0
+    for term in terms:
+        words = term.split()
+        if all(any(t.startswith(w) for t in name_tokens) for w in words):
+            score += NAME_WEIGHT
+        elif all(any(t.startswith(w) for t in description_tokens) for w in words):
+            score += 1
+    return score
+
+
+class RecommendationIndex:
+    """Per-process map of normalized remedy keyword -> ranked product ids."""
+
+    def __init__(self, ttl=RECOMMENDATION_TTL, limit=RECOMMENDATION_LIMIT):
+        self.ttl = ttl
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # held by the one thread rebuilding
+        self._keywords = {}  # canonical keyword -> search terms
+        self._aliases = {}   # any normalized term -> canonical keyword
+        self._ranked = {}    # canonical keyword -> [(score, product_id)], best first
+        self._built_at = None
+
+    # --- Building ---
+    def _candidates(self, terms):
+        """Products matching any of the terms, found through the search index."""
+        rows = {}
+        for term in terms:
+            query = db.session.query(Product.id, Product.name, Product.description)
+            for row in apply_search(query, term, ordered=False):
+                rows[row.id] = row
+        return rows.values()
+
+    def _rank(self, terms):
+        scored = [(_score(terms, row.name, row.description), row.id) for row in self._candidates(terms)]
+        return sorted((s for s in scored if s[0] > 0), key=lambda s: (-s[0], -s[1]))[:self.limit]
+
+    def build(self):
+        """Rebuilds the whole index. Call inside an app context."""
+        keywords = _load_keywords()
+        ranked = {keyword: self._rank(terms) for keyword, terms in keywords.items()}
+        aliases = {term: keyword for keyword, terms in keywords.items() for term in terms}
+        with self._lock:
+            self._keywords, self._aliases, self._ranked = keywords, aliases, ranked
+            self._built_at = time.monotonic()
+
+    def _is_fresh(self):
+        with self._lock:
+            return self._built_at is not None and time.monotonic() - self._built_at <= self.ttl
+
+    def _ensure_built(self):
+        if self._is_fresh():
+            return
+        # With an old index to answer from, don't wait for a rebuild already running.
+        if not self._build_lock.acquire(blocking=not self._keywords):
+            return
+        try:
+            if not self._is_fresh():  # unless one finished while we waited
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def invalidate(self):
+        """Marks the index stale; the next lookup rebuilds it."""
+        with self._lock:
+            self._built_at = None
+
+    # --- Incremental maintenance ---
+    def product_added(self, product):
+        """Ranks a newly listed product under every keyword it matches. Call after the commit."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            for keyword, terms in self._keywords.items():
+                score = _score(terms, product.name, product.description)
+                if score:
+                    ranked = [s for s in self._ranked.get(keyword, []) if s[1] != product.id]
+                    ranked.append((score, product.id))
+                    ranked.sort(key=lambda s: (-s[0], -s[1]))
+                    self._ranked[keyword] = ranked[:self.limit]
+
+    def product_removed(self, product_id):
+        with self._lock:
+            for keyword, ranked in self._ranked.items():
+                if any(pid == product_id for _, pid in ranked):
+                    self._ranked[keyword] = [s for s in ranked if s[1] != product_id]
+
+    # --- Lookup ---
+    def product_ids(self, keyword):
+        """Ranked product ids for a remedy keyword. Unknown keywords are ranked once and remembered."""
+        self._ensure_built()
+        normalized = normalize_keyword(keyword)
+        if not normalized:
+            return []
+        with self._lock:
+            canonical = self._aliases.get(normalized)
+            if canonical is not None:
+                return [pid for _, pid in self._ranked.get(canonical, [])]
+        ranked = self._rank([normalized])
+        with self._lock:
+            self._keywords[normalized] = [normalized]
+            self._aliases[normalized] = normalized
+            self._ranked[normalized] = ranked
+        return [pid for _, pid in ranked]
+
+    def suggest(self, keyword):
+        """Store products for a remedy keyword, best match first, in a single primary-key query."""
+        ids = self.product_ids(keyword)
+        if not ids:
+            return []
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))}
+        return [products[pid] for pid in ids if pid in products]
+
+
+def init_app(app):
+    """
+    Config:
+      RECOMMENDATION_TTL    seconds before the index is rebuilt from the database
+      RECOMMENDATION_LIMIT  products kept per keyword
+    One index per app, since each app may have its own database.
+    """
+    app.config.setdefault('RECOMMENDATION_TTL', RECOMMENDATION_TTL)
+    app.config.setdefault('RECOMMENDATION_LIMIT', RECOMMENDATION_LIMIT)
+    app.extensions['recommendations'] = RecommendationIndex(ttl=app.config['RECOMMENDATION_TTL'],
+                                                            limit=app.config['RECOMMENDATION_LIMIT'])
+
+
+def get_recommendations():
+    return current_app.extensions['recommendations']
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generator for benchmarks and load tests.
+Seeds configurable volumes of users, products, conversations and messages
+into a fresh SQLite database with bulk inserts, so a
+100k-message dataset takes seconds rather than minutes. The output is
+deterministic for a given --seed.
+
+    python scripts/bench_data.py --db /tmp/load.sqlite --size medium
+    python scripts/bench_data.py --db /tmp/load.sqlite --users 5000 --products 40000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from models import db, User, Product, Conversation, Message, parse_price
+
+# users, products, conversations, messages per conversation
+SIZES = {
+    'small': (200, 1000, 200, 10),
+    'medium': (2000, 10000, 2000, 20),
+    'large': (10000, 50000, 10000, 30),
+}
+SELLER_SHARE = 0.1  # one user in ten sells; the rest are buyers
+BATCH_SIZE = 5000
+# Not a real hash: seeded users never log in through the form, benchmarks set the session directly.
+PASSWORD_PLACEHOLDER = 'bench:not-a-password-hash'
+
+CATEGORIES = ('Products', 'Tools', 'Seeds')
+ITEMS = {
+    'Products': ['Copper fungicide', 'Neem oil', 'Mancozeb 75 WP', 'Organic compost', 'Urea', 'DAP fertilizer',
+                 'Bio pesticide', 'Sulphur dust', 'Vermicompost', 'Potash'],
+    'Tools': ['Rotavator', 'Knapsack sprayer', 'Drip kit', 'Power weeder', 'Sickle', 'Hand hoe', 'Seed drill',
+              'Battery sprayer', 'Tarpaulin', 'Water pump'],
+    'Seeds': ['Tomato hybrid seeds', 'Onion seeds', 'Soybean seeds', 'Cotton seeds', 'Chilli seeds', 'Wheat seeds',
+              'Okra seeds', 'Brinjal seeds', 'Maize seeds', 'Groundnut seeds'],
+}
+DESCRIPTIONS = ['for late blight and leaf spot', 'suitable for grapes and pomegranate', 'high germination rate',
+                'heavy duty, two year warranty', 'certified organic input', 'for kharif and rabi season',
+                'controls aphids and whitefly', 'saves water on sugarcane', 'for small and marginal farms']
+UNITS = ('', '/kg', '/litre', ' per 500 ml', '/packet', ' per piece')
+PHRASES = ['Is this still available?', 'What is the lowest price?', 'Can you deliver to Nashik?',
+           'Yes, available.', 'Price is fixed, sorry.', 'How many days for delivery?', 'I will take two.',
+           'Please share more photos.', 'Payment on delivery is fine.', 'Which crop is this best for?']
+
+
+def generate(users, products, conversations, messages_per_conversation, seed=0):
+    """
+    Bulk-inserts the dataset into the current app's database (call inside an
+    app context, on an empty schema). Returns a summary with the ids
+    benchmarks need: 'seller_id' (the busiest seller) and 'conversation_id'
+    (one of that seller's conversations).
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    sellers = max(1, int(users * SELLER_SHARE))
+    buyers = max(1, users - sellers)
+    # Ids are assigned here rather than by the database so the rows can be
+    # built without reading anything back.
+    user_rows = [{'id': i + 1, 'email': f'{"seller" if i < sellers else "buyer"}{i + 1}@bench.local',
+                  'mobile': f'7{i + 1:09d}', 'password': PASSWORD_PLACEHOLDER,
+                  'role': 'seller' if i < sellers else 'customer'} for i in range(sellers + buyers)]
+    _insert(User, user_rows)
+
+    product_rows = []
+    for i in range(products):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        price = f"{rng.randrange(50, 25000)}{rng.choice(UNITS)}"
+        amount, unit = parse_price(price)
+        product_rows.append({
+            'id': i + 1, 'name': f"{rng.choice(ITEMS[category])} {i + 1}", 'category': category,
+            'description': f"{rng.choice(ITEMS[category])} {rng.choice(DESCRIPTIONS)}.",
+            'price': price, 'price_amount': amount, 'price_unit': unit, 'image': 'bench.jpg',
+            # The first seller lists a double share, so its inbox is the busiest.
+            'seller_id': 1 if i % (sellers + 1) == sellers else i % (sellers + 1) + 1,
+        })
+    _insert(Product, product_rows)
+
+    now = datetime.utcnow()
+    convo_rows, message_rows, message_id, busiest = [], [], 0, None
+    for c in range(conversations):
+        product = product_rows[c % len(product_rows)]
+        buyer_id = sellers + 1 + rng.randrange(buyers)
+        row = {'id': c + 1, 'product_id': product['id'], 'buyer_id': buyer_id, 'seller_id': product['seller_id'],
+               'last_message_text': None, 'last_message_at': None, 'last_sender_id': None,
+               'buyer_unread': 0, 'seller_unread': 0}
+        if busiest is None and row['seller_id'] == 1:
+            busiest = row['id']
+        at = now - timedelta(minutes=rng.randrange(60 * 24 * 90))
+        for m in range(messages_per_conversation):
+            message_id += 1
+            sender = (buyer_id, product['seller_id'])[m % 2]
+            at += timedelta(minutes=rng.randrange(1, 240))
+            text = rng.choice(PHRASES)
+            message_rows.append({'id': message_id, 'conversation_id': row['id'], 'sender_id': sender,
+                                 'text': text, 'timestamp': at})
+            row.update(last_message_text=text, last_message_at=at, last_sender_id=sender)
+            row['seller_unread' if sender == buyer_id else 'buyer_unread'] += 1
+        convo_rows.append(row)
+        # Conversations go in before their messages; both are flushed in batches to bound memory.
+        if len(message_rows) >= BATCH_SIZE or c == conversations - 1:
+            _insert(Conversation, convo_rows, commit=False)
+            _insert(Message, message_rows, commit=False)
+            convo_rows, message_rows = [], []
+    db.session.commit()
+
+    from search import rebuild_search_index
+    rebuild_search_index()
+    return {
+        'users': len(user_rows), 'products': len(product_rows), 'conversations': conversations,
+        'messages': message_id, 'seller_id': 1, 'conversation_id': busiest,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def _insert(model, rows, commit=True):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+    if commit:
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite file to create (must not exist yet)')
+    parser.add_argument('--size', choices=SIZES, default='small', help='preset volumes (overridden by the options below)')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--products', type=int)
+    parser.add_argument('--conversations', type=int)
+    parser.add_argument('--messages', type=int, help='messages per conversation')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+
+    from app import create_app, init_db
+
+    users, products, conversations, messages = SIZES[args.size]
+    app = create_app({'DATABASE_URL': f'sqlite:///{os.path.abspath(args.db)}'})
+    with app.app_context():
+        init_db()
+        summary = generate(args.users or users, args.products or products, args.conversations or conversations,
+                           args.messages if args.messages is not None else messages, seed=args.seed)
+    print(f"{summary['users']} users, {summary['products']} products, {summary['conversations']} conversations, "
+          f"{summary['messages']} messages in {summary['seconds']}s -> {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for chat message writes on SQLite.
+Starts N writer processes (standing in for gunicorn workers) that each send
+messages through Conversation.add_message, once with SQLAlchemy's default
+engine settings and once with the engine_profile tuning (WAL, busy_timeout,
+synchronous=NORMAL), and reports messages/sec and "database is locked" errors.
+
+    python scripts/bench_db_writes.py --writers 8 --messages 200
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROFILES = ('default', 'tuned')
+
+
+def _make_app(url, profile):
+    from flask import Flask
+    import engine_profile
+    from models import db
+
+    app = Flask(__name__)
+    if profile == 'tuned':
+        engine_profile.configure(app, url)
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    return app
+
+
+def _setup(url, writers):
+    from models import db, User, Product, Conversation
+
+    app = _make_app(url, 'default')
+    with app.app_context():
+        db.create_all()
+        seller = User(email='seller@bench.local', mobile='9000000000', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        product = Product(name='Bench product', description='', category='Tools', price='1', image='x.jpg', seller_id=seller.id)
+        db.session.add(product)
+        db.session.flush()
+        for i in range(writers):
+            buyer = User(email=f'buyer{i}@bench.local', mobile=f'8{i:09d}', password='x', role='buyer')
+            db.session.add(buyer)
+            db.session.flush()
+            db.session.add(Conversation(product_id=product.id, buyer_id=buyer.id, seller_id=seller.id))
+        db.session.commit()
+
+
+def _writer(url, profile, index, messages, start_event, results):
+    # Set before any engine is created so the connect listener sees it.
+    os.environ['SQLITE_TUNING'] = '1' if profile == 'tuned' else '0'
+    from sqlalchemy.exc import OperationalError
+    from models import db, Conversation
+
+    app = _make_app(url, profile)
+    sent = locked = 0
+    with app.app_context():
+        convo_id = index + 1
+        start_event.wait()
+        for n in range(messages):
+            try:
+                convo = db.session.get(Conversation, convo_id)
+                convo.add_message(convo.buyer_id, f'message {n} from writer {index}')
+                db.session.commit()
+                sent += 1
+            except OperationalError as e:
+                db.session.rollback()
+                if 'locked' not in str(e):
+                    raise
+                locked += 1
+    results.put((sent, locked))
+
+
+def run(profile, writers, messages):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+        # Schema is created untuned so the default profile really runs in rollback-journal mode.
+        os.environ['SQLITE_TUNING'] = '0'
+        setup = ctx.Process(target=_setup, args=(url, writers))
+        setup.start()
+        setup.join()
+
+        start_event, results = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=_writer, args=(url, profile, i, messages, start_event, results)) for i in range(writers)]
+        for p in procs:
+            p.start()
+        time.sleep(1.0)  # let every writer import and connect
+        started = time.perf_counter()
+        start_event.set()
+        totals = [results.get() for _ in procs]
+        elapsed = time.perf_counter() - started
+        for p in procs:
+            p.join()
+    sent = sum(t[0] for t in totals)
+    locked = sum(t[1] for t in totals)
+    return sent, locked, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8, help='parallel writer processes')
+    parser.add_argument('--messages', type=int, default=200, help='messages per writer')
+    parser.add_argument('--profile', choices=PROFILES, action='append', help='profile(s) to run (default: both)')
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers x {args.messages} messages")
+    for profile in args.profile or PROFILES:
+        sent, locked, elapsed = run(profile, args.writers, args.messages)
+        print(f"{profile:8} {sent:>7} sent  {locked:>5} locked  {elapsed:>7.2f}s  {sent / elapsed:>8.0f} msgs/sec")
+
+
+if __name__ == '__main__':
+    main()
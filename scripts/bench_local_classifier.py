@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the local-first disease classifier tier.
+Trains the NumPy k-NN tier on a labelled fixture set and reports, per
+confidence threshold, how many diagnoses it answers locally (hit rate), how
+often those answers agree with the remote model's label, and local latency.
+
+By default the fixture set is synthetic: leaves drawn procedurally for every
+class in data/remedies.json, with a share of mild, ambiguous cases, and the
+class drawn is the "remote" label. To measure a real recorded set instead:
+
+    python scripts/bench_local_classifier.py --images DIR --labels labels.json
+
+where labels.json maps each filename in DIR to the remote model's
+disease_name; the set is split into train/test halves.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from ml_model.local_classifier import REMEDIES, LocalClassifier, image_features
+
+THRESHOLDS = (0.6, 0.7, 0.8, 0.85, 0.9, 0.95)
+CANVAS = 256
+
+
+# --- Synthetic fixtures ---
+def _hsv(h, s, v):
+    return Image.new('HSV', (1, 1), (int(h), int(s), int(v))).convert('RGB').getpixel((0, 0))
+
+
+def draw_leaf(label, rng, severity):
+    """A leaf photo: a rotated green ellipse with veins on a muted background, plus the class's symptoms."""
+    bg = _hsv(rng.uniform(0, 255), rng.uniform(0, 35), rng.uniform(120, 235))
+    img = Image.new('RGB', (CANVAS, CANVAS), bg)
+    leaf = Image.new('L', (CANVAS, CANVAS), 0)
+    w, h = rng.uniform(150, 230), rng.uniform(90, 150)
+    ImageDraw.Draw(leaf).ellipse([(CANVAS - w) / 2, (CANVAS - h) / 2, (CANVAS + w) / 2, (CANVAS + h) / 2], fill=255)
+    leaf = leaf.rotate(rng.uniform(0, 180))
+    hue, sat, val = rng.uniform(62, 92), rng.uniform(120, 220), rng.uniform(110, 200)
+    img.paste(_hsv(hue, sat, val), mask=leaf)
+
+    draw = ImageDraw.Draw(img)
+    vein = _hsv(hue, sat * 0.8, val * 0.75)
+    cx, cy = CANVAS / 2, CANVAS / 2
+    for i in range(rng.randint(5, 9)):
+        angle = rng.uniform(0, 2 * math.pi)
+        draw.line([cx, cy, cx + math.cos(angle) * w / 2.5, cy + math.sin(angle) * h / 2.5], fill=vein, width=1)
+
+    def on_leaf():
+        for _ in range(50):
+            x, y = rng.uniform(0, CANVAS), rng.uniform(0, CANVAS)
+            if leaf.getpixel((int(x), int(y))):
+                return x, y
+        return cx, cy
+
+    if label == 'Tomato Late Blight':
+        for _ in range(max(1, round(3 * severity))):
+            x, y = on_leaf()
+            r = rng.uniform(18, 45) * max(severity, 0.3)
+            points = [(x + math.cos(a) * r * rng.uniform(0.6, 1.3), y + math.sin(a) * r * rng.uniform(0.6, 1.3))
+                      for a in [k * 2 * math.pi / 9 for k in range(9)]]
+            draw.polygon(points, fill=_hsv(rng.uniform(20, 45), rng.uniform(60, 120), rng.uniform(50, 90)))
+    elif label == 'Potato Early Blight':
+        for _ in range(max(1, round(10 * severity))):
+            x, y = on_leaf()
+            r = rng.uniform(4, 9)
+            draw.ellipse([x - r * 1.8, y - r * 1.8, x + r * 1.8, y + r * 1.8], fill=_hsv(40, 170, 200))
+            draw.ellipse([x - r, y - r, x + r, y + r], fill=_hsv(18, 160, 110))
+            draw.ellipse([x - r / 2, y - r / 2, x + r / 2, y + r / 2], outline=_hsv(15, 150, 60))
+    elif label == 'Tomato Bacterial Spot':
+        for _ in range(max(3, round(70 * severity))):
+            x, y = on_leaf()
+            r = rng.uniform(1.2, 3)
+            draw.ellipse([x - r, y - r, x + r, y + r], fill=_hsv(rng.uniform(10, 30), 120, rng.uniform(30, 60)))
+
+    img = img.filter(ImageFilter.GaussianBlur(rng.uniform(0, 1.0)))
+    # Lighting: a random overall exposure change.
+    return img.point(lambda p: max(0, min(255, int(p * rng.uniform(0.85, 1.15)))))
+
+
+def synthetic_set(folder, per_class, rng, prefix):
+    labels = {}
+    for label in sorted(REMEDIES):
+        for i in range(per_class):
+            # ~15% mild cases that a cheap classifier should not be sure about.
+            severity = rng.uniform(0.03, 0.15) if rng.random() < 0.15 else rng.uniform(0.4, 1.0)
+            name = f"{prefix}_{label.replace(' ', '_')}_{i}.jpg"
+            draw_leaf(label, rng, severity).save(os.path.join(folder, name), 'JPEG', quality=88)
+            labels[name] = label
+    return labels
+
+
+# --- Evaluation ---
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def evaluate(classifier, folder, labels):
+    """(remote_label, local_label, confidence, seconds) per test photo."""
+    rows = []
+    for name, remote_label in sorted(labels.items()):
+        started = time.perf_counter()
+        label, confidence = classifier.classify(image_features(os.path.join(folder, name)))
+        rows.append((remote_label, label, confidence, time.perf_counter() - started))
+    return rows
+
+
+def report(rows):
+    latencies = [r[3] * 1000 for r in rows]
+    print(f"local latency     p50 {percentile(latencies, 50):.2f} ms   p95 {percentile(latencies, 95):.2f} ms   "
+          f"max {max(latencies):.2f} ms")
+    print(f"top-1 agreement   {sum(r[0] == r[1] for r in rows) / len(rows):.1%} (ignoring confidence)")
+    print(f"\n{'threshold':>9}  {'hit rate':>8}  {'agreement':>9}  {'remote calls':>12}")
+    for threshold in THRESHOLDS:
+        hits = [r for r in rows if r[2] >= threshold]
+        agreement = sum(r[0] == r[1] for r in hits) / len(hits) if hits else float('nan')
+        print(f"{threshold:>9.2f}  {len(hits) / len(rows):>8.1%}  {agreement:>9.1%}  {len(rows) - len(hits):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', help='folder of labelled photos (default: synthetic fixtures)')
+    parser.add_argument('--labels', help='JSON {filename: disease_name} for --images')
+    parser.add_argument('--train-per-class', type=int, default=80)
+    parser.add_argument('--test-per-class', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--save', help='write the trained model here (e.g. ml_model/local_classifier.npz)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            with open(args.labels, encoding='utf-8') as f:
+                labels = {k: v for k, v in json.load(f).items() if v in REMEDIES}
+            names = sorted(labels)
+            rng.shuffle(names)
+            half = len(names) // 2
+            folder = args.images
+            train_labels = {n: labels[n] for n in names[:half]}
+            test_labels = {n: labels[n] for n in names[half:]}
+            train_folder = test_folder = folder
+        else:
+            started = time.perf_counter()
+            train_labels = synthetic_set(tmp, args.train_per_class, rng, 'train')
+            test_labels = synthetic_set(tmp, args.test_per_class, rng, 'test')
+            train_folder = test_folder = tmp
+            print(f"generated {len(train_labels)} training / {len(test_labels)} test photos "
+                  f"in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        features = [image_features(os.path.join(train_folder, n)) for n in sorted(train_labels)]
+        classifier = LocalClassifier.fit(features, [train_labels[n] for n in sorted(train_labels)])
+        print(f"trained on {len(features)} photos in {time.perf_counter() - started:.2f}s "
+              f"({len(features[0])} features, k={classifier.k})\n")
+        if args.save:
+            classifier.save(args.save)
+
+        report(evaluate(classifier, test_folder, test_labels))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Login throughput and tail latency under contention.
+Hammers /login from many concurrent clients while one more client browses
+/store, once with password hashing on the request threads (the old
+behaviour) and once through the bounded auth_hashing pool, and reports
+logins/sec, login p50/p95/p99, "try again" answers and /store latency during
+the burst. A final round replays a brute-force run against one account to
+show how many attempts are refused before any hashing.
+
+    python scripts/bench_login.py --clients 32 --seconds 10
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('PREDICTOR_BACKEND', 'stub')
+
+MODES = ('inline', 'pool')
+UNTHROTTLED = {'LOGIN_RATE_PER_IP': 1e9, 'LOGIN_BURST_PER_IP': 10 ** 9,
+               'LOGIN_RATE_PER_ACCOUNT': 1e9, 'LOGIN_BURST_PER_ACCOUNT': 10 ** 9}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def make_app(db_path, mode, users, workers, throttled=False):
+    from app import create_app, init_db
+    from auth_hashing import hash_password
+    from models import db, User, Product
+
+    config = {'DATABASE_URL': f'sqlite:///{db_path}', 'TESTING': True}
+    if not throttled:
+        config.update(UNTHROTTLED)
+    if mode == 'inline':
+        # Before: every request hashes on its own thread, nothing waits or is refused.
+        config.update(AUTH_HASH_WORKERS=0, AUTH_HASH_MAX_PENDING=10 ** 6)
+    elif workers:
+        config['AUTH_HASH_WORKERS'] = workers
+    app = create_app(config)
+    with app.app_context():
+        init_db()
+        if not User.query.first():
+            password = hash_password('bench-password')
+            db.session.add_all([User(email=f'farmer{i}@bench.local', mobile=f'7{i:09d}', password=password,
+                                     role='customer') for i in range(users)])
+            db.session.flush()
+            db.session.add_all([Product(name=f'Bench product {i}', description='Copper fungicide', category='Products',
+                                        price='450', image='x.jpg', seller_id=1) for i in range(48)])
+            db.session.commit()
+    return app
+
+
+def run_round(app, clients, seconds, users):
+    login_ms, store_ms, outcomes = [], [], {'ok': 0, 'retry': 0, 'refused': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def login_client(index):
+        client = app.test_client()
+        n = index
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.post('/login', data={'email': f'farmer{n % users}@bench.local', 'password': 'bench-password'})
+            elapsed = (time.perf_counter() - started) * 1000
+            outcome = ('refused' if response.status_code == 429
+                       else 'ok' if response.headers.get('Location', '').endswith('/store') else 'retry')
+            with lock:
+                login_ms.append(elapsed)
+                outcomes[outcome] += 1
+            n += clients
+
+    def browser():
+        client = app.test_client()
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/store')
+            store_ms.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=login_client, args=(i,)) for i in range(clients)] + [threading.Thread(target=browser)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'logins_per_sec': round(outcomes['ok'] / elapsed, 1),
+        'login_p50_ms': round(percentile(login_ms, 50), 1),
+        'login_p95_ms': round(percentile(login_ms, 95), 1),
+        'login_p99_ms': round(percentile(login_ms, 99), 1),
+        'try_again': outcomes['retry'],
+        'store_p50_ms': round(percentile(store_ms, 50), 1),
+        'store_p99_ms': round(percentile(store_ms, 99), 1),
+    }
+
+
+def brute_force(app, attempts):
+    """Wrong passwords against one account from one client, with the default throttle settings."""
+    hasher = app.extensions['password_hasher']
+    hashed = []
+    original = hasher.verify
+    hasher.verify = lambda *args: hashed.append(1) or original(*args)
+    client = app.test_client()
+    started = time.perf_counter()
+    refused = sum(client.post('/login', data={'email': 'farmer0@bench.local', 'password': f'guess{i}'}).status_code == 429
+                  for i in range(attempts))
+    elapsed = time.perf_counter() - started
+    hasher.verify = original
+    print(f"\nbrute force: {attempts} attempts in {elapsed:.2f}s, {refused} refused before hashing, "
+          f"{len(hashed)} hashed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16, help='concurrent login clients')
+    parser.add_argument('--seconds', type=float, default=8)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None, help='hashing processes (default: AUTH_HASH_WORKERS)')
+    parser.add_argument('--brute-force', type=int, default=200, help='attempts in the brute-force round (0 to skip)')
+    args = parser.parse_args()
+
+    print(f"{args.clients} login clients + 1 /store browser for {args.seconds:.0f}s per mode, {os.cpu_count()} CPUs\n")
+    print(f"{'mode':>6}  {'logins/s':>8}  {'p50 ms':>7}  {'p95 ms':>7}  {'p99 ms':>7}  {'retry':>5}  "
+          f"{'/store p50':>10}  {'/store p99':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'login.sqlite')
+        for mode in MODES:
+            app = make_app(db_path, mode, args.users, args.workers)
+            r = run_round(app, args.clients, args.seconds, args.users)
+            app.extensions['password_hasher'].shutdown()
+            print(f"{mode:>6}  {r['logins_per_sec']:>8}  {r['login_p50_ms']:>7}  {r['login_p95_ms']:>7}  "
+                  f"{r['login_p99_ms']:>7}  {r['try_again']:>5}  {r['store_p50_ms']:>10}  {r['store_p99_ms']:>10}")
+        if args.brute_force:
+            app = make_app(db_path, 'pool', args.users, args.workers, throttled=True)
+            brute_force(app, args.brute_force)
+            app.extensions['password_hasher'].shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the price history ingestion pipeline.
+Replays data/fixtures/price_api_pages.json into a temporary SQLite database
+and reports rows/sec for a fresh load and for an idempotent re-run.
+
+    python scripts/bench_price_ingest.py --repeat 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db, PriceRecord
+from scripts.price_history import FIXTURE_PATH, iter_fixture_pages, ingest_pages, price_trend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixture', default=FIXTURE_PATH)
+    parser.add_argument('--repeat', type=int, default=100, help='times to replay the fixture pages')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            for label in ('fresh load', 're-run (upsert)'):
+                stats = ingest_pages(iter_fixture_pages(args.fixture, repeat=args.repeat), batch_size=args.batch_size)
+                print(f"{label:16} {stats['upserted']:>8} rows  {stats['seconds']:>7}s  {stats['rows_per_sec']:>8} rows/sec")
+            print(f"{'table rows':16} {db.session.query(PriceRecord).count():>8}")
+
+            started = time.perf_counter()
+            trend = price_trend('Onion')
+            print(f"{'trend query':16} {trend['summary']['days']:>8} days  {round(time.perf_counter() - started, 4)}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Offline load test: latency and throughput of every main route.
+For each data size it seeds a temporary SQLite database (scripts/bench_data.py),
+runs the app against the offline predictor (with --gemini-delay standing in for
+Gemini's latency) and a local fake of data.gov.in (scripts/price_api_mock.py),
+then drives each route from N concurrent clients and reports p50/p95/p99 and
+requests/sec. Results are written as JSON and compared to the committed
+baseline (benchmarks/bench_routes_baseline.json, or --baseline); the exit
+status is 1 if any route regressed. The baseline is machine-specific: compare
+runs from the same kind of machine, and refresh it in the commit that changes
+performance on purpose.
+
+    python scripts/bench_routes.py --sizes small,medium --concurrency 1,8
+    python scripts/bench_routes.py --save-baseline             # after a change you are happy with; commit the file
+    python scripts/bench_routes.py --routes store,inbox --baseline ''   # no comparison
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+DEFAULT_OUT = os.path.join(PROJECT_DIR, 'instance', 'bench_routes.json')
+DEFAULT_BASELINE = os.path.join(PROJECT_DIR, 'benchmarks', 'bench_routes_baseline.json')  # committed
+NOISE_FLOOR_MS = 2.0  # p95 changes smaller than this are never reported as regressions
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+# --- Routes under test ---
+# Each takes (client, ctx) and returns True if the response was what a browser expects.
+def _ok(response, status=200):
+    return response.status_code == status
+
+
+def _detect(client, ctx):
+    """Upload, then poll the job like the detection page's script until it finishes."""
+    with ctx['lock']:
+        ctx['uploads'] += 1
+        upload = ctx['uploads']
+    # Trailing bytes after the JPEG end marker make every upload distinct, so none is deduplicated.
+    data = ctx['leaf'] + str(upload).encode()
+    response = client.post('/detect/jobs', data={'leaf_image': (io.BytesIO(data), f'leaf-{upload}.jpg')},
+                           content_type='multipart/form-data')
+    if response.status_code != 202:
+        return False
+    status_url = response.get_json()['status_url']
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        status = client.get(status_url).get_json()['status']
+        if status in ('done', 'failed'):
+            return status == 'done'
+        time.sleep(0.02)
+    return False
+
+
+ROUTES = {
+    'home': lambda c, ctx: _ok(c.get('/')),
+    'store': lambda c, ctx: _ok(c.get('/store')),
+    'store_category': lambda c, ctx: _ok(c.get('/store?category=Seeds&sort=price_asc')),
+    'store_search': lambda c, ctx: _ok(c.get('/store?search=fungicide')),
+    'store_json': lambda c, ctx: _ok(c.get('/store.json?category=Tools')),
+    'inbox': lambda c, ctx: _ok(c.get('/inbox')),
+    'conversation_chat': lambda c, ctx: _ok(c.get(f"/conversation/chat/{ctx['conversation_id']}")),
+    'conversation_messages': lambda c, ctx: _ok(c.get(f"/conversation/{ctx['conversation_id']}/messages")),
+    'conversation_send': lambda c, ctx: _ok(c.post(f"/conversation/{ctx['conversation_id']}/messages",
+                                                   json={'message_text': 'Is this still available?'}), 201),
+    'prices': lambda c, ctx: _ok(c.get('/prices')),
+    'price_trends': lambda c, ctx: _ok(c.get('/prices/trends?commodity=Onion')),
+    'detect': _detect,
+}
+SLOW_ROUTES = ('detect',)  # run --slow-requests times instead of --requests
+
+
+def leaf_image():
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (1024, 768), (70, 120, 40))
+    draw = ImageDraw.Draw(img)
+    for i in range(40):
+        draw.ellipse((i * 23 % 1000, i * 37 % 740, i * 23 % 1000 + 30, i * 37 % 740 + 24), fill=(120, 90, 30))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+# --- Setup ---
+def make_app(tmp, size, seed):
+    from app import create_app, init_db
+    from scripts.bench_data import SIZES, generate
+    from scripts.price_history import ingest_pages, iter_api_pages
+    from scripts.price_scraper import refresh_market_prices
+
+    db_path = os.path.join(tmp, f'{size}.sqlite')
+    app = create_app({'DATABASE_URL': f'sqlite:///{db_path}', 'TESTING': True,
+                      'LEAF_UPLOAD_FOLDER': os.path.join(tmp, 'leaf_uploads')})
+    with app.app_context():
+        init_db()
+        summary = generate(*SIZES[size], seed=seed)
+        # Price history and the live snapshot both come from the fake data.gov.in.
+        ingest_pages(iter_api_pages(page_size=500))
+    refresh_market_prices()
+    return app, summary
+
+
+def logged_in_client(app, summary):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['user_email'], sess['role'] = summary['seller_id'], 'seller1@bench.local', 'seller'
+    return client
+
+
+def run_level(app, summary, route, concurrency, requests, ctx):
+    """One route at one concurrency level: `requests` calls spread over `concurrency` clients."""
+    check = ROUTES[route]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    per_client = max(1, requests // concurrency)
+
+    def client_loop():
+        client = logged_in_client(app, summary)
+        for _ in range(per_client):
+            started = time.perf_counter()
+            try:
+                ok = check(client, ctx)
+            except Exception as e:
+                print(f"  {route}: {e}")
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += not ok
+
+    warm = logged_in_client(app, summary)
+    for _ in range(min(3, requests)):
+        check(warm, ctx)
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'rps': round(len(latencies) / elapsed, 1),
+    }
+
+
+# --- Baseline comparison ---
+def compare(results, baseline, threshold):
+    """Prints the change against baseline per (size, concurrency, route). Returns the regressed keys."""
+    previous = {(r['size'], r['concurrency'], r['route']): r for r in baseline['results']}
+    regressions = []
+    print(f"\nagainst baseline from {baseline['meta'].get('created')} ({baseline['meta'].get('commit') or 'unknown commit'}):")
+    print(f"{'size':>7} {'conc':>4}  {'route':<22} {'p95 ms':>16}  {'req/s':>16}")
+    for r in results:
+        key = (r['size'], r['concurrency'], r['route'])
+        old = previous.get(key)
+        if old is None:
+            continue
+        slower = r['p95_ms'] > old['p95_ms'] * (1 + threshold) and r['p95_ms'] - old['p95_ms'] > NOISE_FLOOR_MS
+        fewer = r['rps'] < old['rps'] * (1 - threshold)
+        more_errors = r['errors'] > old['errors']
+        flag = '  REGRESSED' if slower or fewer or more_errors else ''
+        if flag:
+            regressions.append(key)
+        print(f"{r['size']:>7} {r['concurrency']:>4}  {r['route']:<22} "
+              f"{old['p95_ms']:>7} -> {r['p95_ms']:<7}  {old['rps']:>7} -> {r['rps']:<7}{flag}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    from scripts.bench_data import SIZES
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium', help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument('--concurrency', default='1,8', help='comma-separated client counts')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma-separated subset of routes')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and level')
+    parser.add_argument('--slow-requests', type=int, default=24, help=f"requests per level for {', '.join(SLOW_ROUTES)}")
+    parser.add_argument('--gemini-delay', type=float, default=0.3, help='seconds the stub predictor takes per image')
+    parser.add_argument('--price-api-delay', type=float, default=0.05, help='seconds the fake data.gov.in takes per call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=DEFAULT_OUT, help='results file (JSON)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="earlier results file to compare against ('' to skip)")
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative change counted as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to the --baseline file')
+    args = parser.parse_args()
+    sizes = args.sizes.split(',')
+    levels = [int(c) for c in args.concurrency.split(',')]
+    routes = args.routes.split(',')
+    for name in sizes:
+        if name not in SIZES:
+            parser.error(f"unknown size {name!r}")
+    for name in routes:
+        if name not in ROUTES:
+            parser.error(f"unknown route {name!r}")
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        # Read before the run, since --save-baseline overwrites it.
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    elif args.baseline and not args.save_baseline:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create it.")
+
+    tmp = tempfile.TemporaryDirectory()
+    # Everything below is read at import time, so it is set before the app is imported.
+    from scripts.price_api_mock import FakeDataGovServer
+    price_api = FakeDataGovServer(repeat=4, delay=args.price_api_delay)
+    os.environ.update({
+        'PREDICTOR_BACKEND': 'stub', 'STUB_PREDICTOR_DELAY': str(args.gemini_delay),
+        'DATA_GOV_RESOURCE_URL': price_api.url, 'DATA_GOV_API_KEY': 'bench-key',
+        'PRICE_SNAPSHOT_PATH': os.path.join(tmp.name, 'market_prices.json'),
+    })
+    price_api.start()
+
+    results = []
+    print(f"{os.cpu_count()} CPUs, Gemini stub {args.gemini_delay}s, data.gov.in stub {args.price_api_delay}s")
+    print(f"{'size':>7} {'conc':>4}  {'route':<22} {'reqs':>5} {'errs':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    try:
+        for size in sizes:
+            app, summary = make_app(tmp.name, size, args.seed)
+            ctx = {'conversation_id': summary['conversation_id'], 'leaf': leaf_image(), 'uploads': 0,
+                   'lock': threading.Lock()}
+            for concurrency in levels:
+                for route in routes:
+                    requests = args.slow_requests if route in SLOW_ROUTES else args.requests
+                    r = run_level(app, summary, route, concurrency, max(requests, concurrency), ctx)
+                    r.update(size=size, concurrency=concurrency, route=route)
+                    results.append(r)
+                    print(f"{size:>7} {concurrency:>4}  {route:<22} {r['requests']:>5} {r['errors']:>4} "
+                          f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['rps']:>8}")
+            app.extensions['detection_pool'].shutdown()
+    finally:
+        price_api.stop()
+        tmp.cleanup()
+
+    output = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+            'python': platform.python_version(), 'cpus': os.cpu_count(),
+            'sizes': {name: dict(zip(('users', 'products', 'conversations', 'messages_per_conversation'), SIZES[name]))
+                      for name in sizes},
+            'gemini_delay': args.gemini_delay, 'price_api_delay': args.price_api_delay,
+        },
+        'results': results,
+    }
+    for path in [args.out] + ([args.baseline or DEFAULT_BASELINE] if args.save_baseline else []):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=1)
+        print(f"\nwrote {path}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for a web worker.
+Starts fresh Python processes (like new gunicorn workers) and times importing
+app, building a second app with create_app() and serving the first request,
+with no GEMINI_API_KEY and a throwaway database. Also checks that start-up
+did not import the model SDK or other deferred dependencies.
+
+    python scripts/bench_startup.py --runs 10 --json startup.json
+    python scripts/bench_startup.py --baseline startup.json   # exits 1 on a >25% regression
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when first needed.
+DEFERRED = ('google.generativeai', 'numpy', 'requests')
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+second = app.create_app()
+t2 = time.perf_counter()
+status = app.app.test_client().get('/').status_code
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'first_request_ms': (t3 - t2) * 1000,
+    'status': status,
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def run_once(database_url):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.pop('GEMINI_API_KEY', None)
+    env.pop('PREDICTOR_BACKEND', None)
+    result = subprocess.run([sys.executable, '-c', PROBE % (DEFERRED,)], cwd=PROJECT_DIR, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"worker start-up failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples, key):
+    values = sorted(s[key] for s in samples)
+    return {'p50': round(statistics.median(values), 1), 'min': round(values[0], 1), 'max': round(values[-1], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', help='write the summary to this file')
+    parser.add_argument('--baseline', help='compare against a summary written earlier with --json')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 regression vs the baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'startup.sqlite')}"
+        samples = [run_once(url) for _ in range(args.runs)]
+        touched_db = os.path.exists(os.path.join(tmp, 'startup.sqlite'))
+
+    summary = {key: summarize(samples, key) for key in ('import_ms', 'create_app_ms', 'first_request_ms')}
+    summary['runs'] = args.runs
+    summary['deferred_loaded'] = sorted({m for s in samples for m in s['loaded']})
+
+    print(f"{args.runs} cold starts")
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms'):
+        s = summary[key]
+        print(f"  {key:18} p50 {s['p50']:>8.1f}   min {s['min']:>8.1f}   max {s['max']:>8.1f}")
+    print(f"  deferred modules loaded at start-up: {', '.join(summary['deferred_loaded']) or 'none'}")
+    print(f"  database touched by import/first request: {'yes' if touched_db else 'no'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    failed = bool(summary['deferred_loaded'])
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # create_app and the first request take a few ms and are too noisy to gate on.
+        for key in ('import_ms',):
+            before, now = baseline[key]['p50'], summary[key]['p50']
+            change = (now - before) / before if before else 0.0
+            flag = 'REGRESSION' if change > args.tolerance else 'ok'
+            print(f"  {key:18} baseline {before:>8.1f} -> {now:>8.1f} ({change:+.0%}) {flag}")
+            failed = failed or change > args.tolerance
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
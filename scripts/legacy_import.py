@@ -0,0 +1,349 @@
+# scripts/legacy_import.py
+# Loads the pre-database JSON files (data/users.json, products.json and
+# messages.json, or larger exports in the same shape) into the database.
+#
+# Each file is a top-level JSON array, read one record at a time so a dump of
+# any size imports in constant memory. Emails are resolved to user ids through
+# an in-memory map, and rows go in with bulk inserts, one transaction per batch.
+#
+# Re-running is safe. Users are matched on email, case-insensitively, and
+# products and conversations are recorded in LegacyRecord as they are imported.
+# Legacy quirks:
+#   - The same person may appear under case-variant emails. The first record
+#     wins; a later one only supplies a mobile the first was missing.
+#   - Users without a mobile (or with one another account already uses) get a
+#     unique "legacy-..." placeholder, since User.mobile is required.
+#   - Message timestamps are local "YYYY-MM-DD HH:MM" strings; they are stored
+#     as UTC like every other timestamp.
+
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import pytz
+from sqlalchemy import bindparam, insert, select, update
+
+from models import db, User, Product, Conversation, Message, DataVersion, LegacyRecord, parse_price
+
+IMPORT_BATCH_SIZE = int(os.getenv("LEGACY_IMPORT_BATCH_SIZE", "2000"))
+LEGACY_TIMEZONE = os.getenv("LEGACY_TIMEZONE", "Asia/Kolkata")
+READ_CHUNK_SIZE = 64 * 1024
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+FILES = (('users', 'users.json'), ('products', 'products.json'), ('conversations', 'messages.json'))
+
+MOBILE_PLACEHOLDER_PREFIX = 'legacy-'
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+# --- Streaming reader ---
+def iter_json_array(path, chunk_size=READ_CHUNK_SIZE):
+    """Yields the elements of the top-level JSON array in path, holding at most one element (plus a chunk) in memory."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8-sig') as f:
+        buffer, pos, eof, state = '', 0, False, 'start'
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(f"{path}: unexpected end of file")
+                chunk = f.read(chunk_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            char = buffer[pos]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError(f"{path}: expected a JSON array")
+                pos, state = pos + 1, 'first'
+            elif char == ']' and state in ('first', 'separator'):
+                return
+            elif state == 'separator':
+                if char != ',':
+                    raise ValueError(f"{path}: expected ',' or ']' between array elements")
+                pos, state = pos + 1, 'value'
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    end = len(buffer)
+                # A value that runs to the end of the buffer may be cut off (a number, say); read on and decode again.
+                if end == len(buffer) and not eof:
+                    chunk = f.read(chunk_size)
+                    buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                    continue
+                yield item
+                pos, state = end, 'separator'
+
+
+# --- Helpers ---
+def legacy_key(record):
+    """The record's legacy id, or a digest of its content when it has none."""
+    if record.get('id') is not None:
+        return str(record['id'])[:64]
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+
+def mobile_placeholder(email):
+    return MOBILE_PLACEHOLDER_PREFIX + hashlib.sha256(email.encode()).hexdigest()[:12]
+
+
+def _text(value, limit=None):
+    value = '' if value is None else str(value).strip()
+    return value[:limit] if limit else value
+
+
+def parse_timestamp(value, tz):
+    """Legacy timestamp string -> naive UTC datetime, or None if it can't be read."""
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = tz.localize(parsed)
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _stats():
+    return {'records': 0, 'inserted': 0, 'merged': 0, 'existing': 0, 'skipped': 0, 'seconds': 0.0}
+
+
+def _finish(stats, started, rows):
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_sec'] = round(rows / stats['seconds']) if stats['seconds'] else 0
+    return stats
+
+
+# --- Importer ---
+class LegacyImporter:
+    """
+    Imports users, then products, then conversations with their messages.
+    Must run inside an app context. Each import_* method returns stats; the
+    email and legacy-id maps built along the way are shared between them.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, legacy_timezone=LEGACY_TIMEZONE):
+        self.batch_size = batch_size
+        self.tz = pytz.timezone(legacy_timezone)
+        self.engine = db.engine
+        self.user_ids = {}  # lower-cased email -> user id
+        self.mobiles = set()
+        self.placeholder_ids = set()  # users whose mobile is still a placeholder
+        self.products = {}  # legacy product key -> (product id, seller id)
+        self.conversations = set()  # legacy conversation keys already imported
+        self._load()
+
+    def _load(self):
+        with self.engine.connect() as conn:
+            for user_id, email, mobile in conn.execute(select(User.id, User.email, User.mobile).order_by(User.id)):
+                self.user_ids.setdefault(email.lower(), user_id)
+                self.mobiles.add(mobile)
+                if mobile.startswith(MOBILE_PLACEHOLDER_PREFIX):
+                    self.placeholder_ids.add(user_id)
+            rows = conn.execute(
+                select(LegacyRecord.kind, LegacyRecord.legacy_id, LegacyRecord.record_id, Product.seller_id)
+                .outerjoin(Product, (LegacyRecord.kind == 'product') & (Product.id == LegacyRecord.record_id))
+            )
+            for kind, key, record_id, seller_id in rows:
+                if kind == 'product':
+                    # None for a product deleted since: it stays imported, but its conversations are dropped.
+                    self.products[key] = (record_id, seller_id) if seller_id is not None else None
+                elif kind == 'conversation':
+                    self.conversations.add(key)
+
+    def _user_id(self, email):
+        return self.user_ids.get(_text(email).lower())
+
+    def _usable_mobile(self, value):
+        mobile = _text(value, 20)
+        return mobile if mobile and mobile not in self.mobiles else None
+
+    # --- Users ---
+    def import_users(self, records):
+        stats, started = _stats(), time.perf_counter()
+        pending = {}  # lower-cased email -> row, until the next flush
+        mobile_updates = {}  # existing user id -> mobile replacing its placeholder
+
+        def flush():
+            if not pending:
+                return
+            rows = list(pending.values())
+            stmt = insert(User).returning(User.id, User.email, User.mobile, sort_by_parameter_order=True)
+            with self.engine.begin() as conn:
+                for user_id, email, mobile in conn.execute(stmt, rows):
+                    self.user_ids[email.lower()] = user_id
+                    if mobile.startswith(MOBILE_PLACEHOLDER_PREFIX):
+                        self.placeholder_ids.add(user_id)
+            stats['inserted'] += len(rows)
+            pending.clear()
+
+        for record in records:
+            stats['records'] += 1
+            email, password = _text(record.get('email'), 120), _text(record.get('password'), 200)
+            if not email or not password:
+                stats['skipped'] += 1
+                continue
+            key = email.lower()
+            row = pending.get(key)
+            if row is None and key in self.user_ids:
+                user_id = self.user_ids[key]
+                mobile = self._usable_mobile(record.get('mobile'))
+                if user_id in self.placeholder_ids and user_id not in mobile_updates and mobile:
+                    mobile_updates[user_id] = mobile
+                    self.mobiles.add(mobile)
+                    stats['merged'] += 1
+                else:
+                    stats['existing'] += 1
+                continue
+            if row is not None:
+                # A case-variant duplicate of a user in this batch.
+                mobile = self._usable_mobile(record.get('mobile'))
+                if row['mobile'].startswith(MOBILE_PLACEHOLDER_PREFIX) and mobile:
+                    row['mobile'] = mobile
+                    self.mobiles.add(mobile)
+                stats['merged'] += 1
+                continue
+            mobile = self._usable_mobile(record.get('mobile')) or mobile_placeholder(key)
+            self.mobiles.add(mobile)
+            pending[key] = {'email': email, 'mobile': mobile, 'password': password,
+                            'role': _text(record.get('role'), 20) or 'customer'}
+            if len(pending) >= self.batch_size:
+                flush()
+        flush()
+
+        if mobile_updates:
+            with self.engine.begin() as conn:
+                users = User.__table__
+                conn.execute(update(users).where(users.c.id == bindparam('user_id')).values(mobile=bindparam('new_mobile')),
+                             [{'user_id': user_id, 'new_mobile': mobile} for user_id, mobile in mobile_updates.items()])
+            self.placeholder_ids.difference_update(mobile_updates)
+        return _finish(stats, started, stats['inserted'] + len(mobile_updates))
+
+    # --- Products ---
+    def import_products(self, records):
+        stats, started = _stats(), time.perf_counter()
+        pending = []  # (legacy key, row)
+
+        def flush():
+            if not pending:
+                return
+            stmt = insert(Product).returning(Product.id, Product.seller_id, sort_by_parameter_order=True)
+            with self.engine.begin() as conn:
+                inserted = conn.execute(stmt, [row for _, row in pending]).all()
+                conn.execute(insert(LegacyRecord), [{'kind': 'product', 'legacy_id': key, 'record_id': product_id}
+                                                    for (key, _), (product_id, _) in zip(pending, inserted)])
+                conn.execute(update(DataVersion).where(DataVersion.name == 'catalog')
+                             .values(version=DataVersion.version + 1))
+            for (key, _), (product_id, seller_id) in zip(pending, inserted):
+                self.products[key] = (product_id, seller_id)
+            stats['inserted'] += len(pending)
+            pending.clear()
+
+        keys = set()
+        for record in records:
+            stats['records'] += 1
+            key = legacy_key(record)
+            if key in self.products or key in keys:
+                stats['existing'] += 1
+                continue
+            seller_id = self._user_id(record.get('seller') or record.get('seller_email'))
+            name = _text(record.get('name'), 100)
+            if seller_id is None or not name:
+                stats['skipped'] += 1
+                continue
+            price = _text(record.get('price'), 50)
+            amount, unit = parse_price(price)
+            keys.add(key)
+            pending.append((key, {
+                'name': name, 'category': _text(record.get('category'), 50) or 'Other',
+                'description': _text(record.get('description')), 'price': price,
+                'price_amount': amount, 'price_unit': unit, 'image': _text(record.get('image'), 100),
+                'seller_id': seller_id,
+            }))
+            if len(pending) >= self.batch_size:
+                flush()
+        flush()
+
+        if stats['inserted']:
+            from search import rebuild_search_index
+            rebuild_search_index()
+        return _finish(stats, started, stats['inserted'])
+
+    # --- Conversations and messages ---
+    def import_conversations(self, records):
+        """Each conversation goes in the same transaction as its messages; a batch closes after batch_size rows."""
+        stats, started = _stats(), time.perf_counter()
+        stats.update(messages=0, skipped_messages=0)
+        pending = []  # (legacy key, conversation row, message rows)
+        pending_rows = 0
+        keys = set()
+
+        def flush():
+            if not pending:
+                return
+            stmt = insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True)
+            with self.engine.begin() as conn:
+                ids = conn.execute(stmt, [row for _, row, _ in pending]).scalars().all()
+                messages = [dict(message, conversation_id=convo_id)
+                            for (_, _, rows), convo_id in zip(pending, ids) for message in rows]
+                if messages:
+                    conn.execute(insert(Message), messages)
+                conn.execute(insert(LegacyRecord), [{'kind': 'conversation', 'legacy_id': key, 'record_id': convo_id}
+                                                    for (key, _, _), convo_id in zip(pending, ids)])
+            self.conversations.update(key for key, _, _ in pending)
+            stats['inserted'] += len(pending)
+            stats['messages'] += len(messages)
+            pending.clear()
+
+        for record in records:
+            stats['records'] += 1
+            key = legacy_key(record)
+            if key in self.conversations or key in keys:
+                stats['existing'] += 1
+                continue
+            product = self.products.get(_text(record.get('product_id')))
+            if product is None:
+                stats['skipped'] += 1
+                continue
+            product_id, seller_id = product
+            participants = {self._user_id(email) for email in record.get('participants') or ()}
+            buyers = sorted(p for p in participants if p is not None and p != seller_id)
+            if len(buyers) != 1:
+                stats['skipped'] += 1
+                continue
+            buyer_id = buyers[0]
+            rows = []
+            for message in record.get('messages') or ():
+                sender_id = self._user_id(message.get('sender'))
+                text = _text(message.get('text'))
+                at = parse_timestamp(message.get('timestamp'), self.tz)
+                if sender_id not in (buyer_id, seller_id) or not text or at is None:
+                    stats['skipped_messages'] += 1
+                    continue
+                rows.append({'sender_id': sender_id, 'text': text, 'timestamp': at})
+            keys.add(key)
+            last = rows[-1] if rows else {}
+            # Read state was never recorded, so imported history starts out read.
+            pending.append((key, {
+                'product_id': product_id, 'buyer_id': buyer_id, 'seller_id': seller_id,
+                'last_message_text': last.get('text', '')[:200] or None, 'last_message_at': last.get('timestamp'),
+                'last_sender_id': last.get('sender_id'), 'buyer_unread': 0, 'seller_unread': 0,
+            }, rows))
+            pending_rows += 1 + len(rows)
+            if pending_rows >= self.batch_size:
+                flush()
+                pending_rows = 0
+        flush()
+        return _finish(stats, started, stats['inserted'] + stats['messages'])
+
+    def import_files(self, data_dir=DATA_DIR, chunk_size=READ_CHUNK_SIZE):
+        """Imports every legacy file found in data_dir. Returns {kind: stats}; missing files are left out."""
+        results = {}
+        for kind, filename in FILES:
+            path = os.path.join(data_dir, filename)
+            if os.path.exists(path):
+                results[kind] = getattr(self, f'import_{kind}')(iter_json_array(path, chunk_size))
+        return results
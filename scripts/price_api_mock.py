@@ -0,0 +1,102 @@
+# scripts/price_api_mock.py
+# A local stand-in for the data.gov.in mandi price resource, for benchmarks and
+# for running the price pages without an API key or network access:
+#
+#     python scripts/price_api_mock.py    # then DATA_GOV_RESOURCE_URL=http://127.0.0.1:8026/resource/mandi
+#
+# It serves the recorded pages in data/fixtures/price_api_pages.json with the
+# same offset/limit paging and filters[state] filtering as the real API.
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fixtures", "price_api_pages.json")
+
+
+class FakeDataGovServer:
+    """
+    Answers GET /resource/<id> like data.gov.in. `repeat` replays the fixture
+    with shifted dates (see iter_fixture_pages) for larger histories, `delay`
+    adds seconds of latency per call. Calls are recorded in .calls as the
+    query parameters received. The fixture is loaded by start(), so .url can
+    be put in DATA_GOV_RESOURCE_URL before the price modules are imported.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, fixture=FIXTURE_PATH, repeat=1, delay=0.0):
+        self.fixture = fixture
+        self.repeat = repeat
+        self.records = []
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, body = fake._handle(url.path, params)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/resource/mandi"
+
+    def _handle(self, path, params):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.calls.append(params)
+        if not path.startswith('/resource/'):
+            return 404, {'status': 'error', 'message': 'Resource not found'}
+        if not params.get('api-key'):
+            return 403, {'status': 'error', 'message': 'Invalid API key'}
+        records = self.records
+        if params.get('filters[state]'):
+            records = [r for r in records if r.get('state') == params['filters[state]']]
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 10))
+        page = records[offset:offset + limit]
+        return 200, {'total': len(records), 'count': len(page), 'limit': str(limit), 'offset': str(offset),
+                     'records': page}
+
+    def start(self):
+        from scripts.price_history import iter_fixture_pages
+
+        self.records = [r for page in iter_fixture_pages(self.fixture, repeat=self.repeat) for r in page]
+        threading.Thread(target=self._server.serve_forever, name='fake-data-gov', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    server = FakeDataGovServer(port=8026).start()
+    print(f"Fake data.gov.in listening on {server.url} ({len(server.records)} records, any API key accepted)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
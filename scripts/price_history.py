@@ -0,0 +1,249 @@
+# scripts/price_history.py
+# Local store of historical mandi prices: bulk ingestion from data.gov.in (or a
+# recorded fixture) and the trend queries behind /prices/trends.
+
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, PriceRecord
+from scripts.price_scraper import RESOURCE_URL, PRICE_HTTP_TIMEOUT, data_gov, get_session
+
+INGEST_PAGE_SIZE = int(os.getenv("PRICE_INGEST_PAGE_SIZE", "1000"))
+INGEST_BATCH_SIZE = int(os.getenv("PRICE_INGEST_BATCH_SIZE", "500"))
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fixtures", "price_api_pages.json")
+
+DEDUP_KEY = ('arrival_date', 'market', 'commodity', 'variety')
+UPDATABLE = ('state', 'district', 'grade', 'min_price', 'max_price', 'modal_price', 'ingested_at')
+
+
+# --- Page sources ---
+def iter_api_pages(page_size=INGEST_PAGE_SIZE, state=None, max_pages=None):
+    """Yields raw record lists from the data.gov.in resource, one page at a time."""
+    api_key = os.getenv("DATA_GOV_API_KEY")
+    if not api_key:
+        raise RuntimeError("DATA_GOV_API_KEY not found in .env file.")
+    session = get_session()
+    offset, pages = 0, 0
+    while max_pages is None or pages < max_pages:
+        params = {"api-key": api_key, "format": "json", "offset": offset, "limit": page_size}
+        if state:
+            params["filters[state]"] = state
+        with data_gov.guard() as call:
+            response = session.get(RESOURCE_URL, params=params, timeout=(PRICE_HTTP_TIMEOUT[0], call.timeout))
+            response.raise_for_status()
+        data = response.json()
+        records = data.get('records', [])
+        if not records:
+            break
+        yield records
+        pages += 1
+        offset += len(records)
+        total = int(data.get('total') or 0)
+        if total and offset >= total:
+            break
+
+
+def iter_fixture_pages(path=FIXTURE_PATH, repeat=1):
+    """
+    Replays recorded API pages. Each repeat shifts arrival dates back by the
+    fixture's date span so benchmarks can ingest many distinct rows offline.
+    """
+    with open(path, encoding="utf-8") as f:
+        pages = json.load(f)
+    dates = [d for d in (_try_parse_date(r.get('arrival_date')) for page in pages for r in page['records']) if d]
+    span = (max(dates) - min(dates)).days + 1
+    for k in range(repeat):
+        for page in pages:
+            if k == 0:
+                yield page['records']
+                continue
+            shifted = []
+            for record in page['records']:
+                day = _try_parse_date(record.get('arrival_date'))
+                if day:
+                    record = dict(record, arrival_date=(day - timedelta(days=span * k)).strftime('%d/%m/%Y'))
+                shifted.append(record)
+            yield shifted
+
+
+# --- Ingestion ---
+def _parse_date(value):
+    return datetime.strptime(value.strip(), '%d/%m/%Y').date()
+
+
+def _try_parse_date(value):
+    try:
+        return _parse_date(value)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_record(record, ingested_at):
+    """Maps a raw API record onto PriceRecord columns. Returns None for unusable rows."""
+    arrival_date = _try_parse_date(record.get('arrival_date'))
+    if arrival_date is None:
+        return None
+    market = (record.get('market') or '').strip()
+    commodity = (record.get('commodity') or '').strip()
+    if not market or not commodity:
+        return None
+    return {
+        'arrival_date': arrival_date,
+        'state': (record.get('state') or '').strip(),
+        'district': (record.get('district') or '').strip(),
+        'market': market,
+        'commodity': commodity,
+        'variety': (record.get('variety') or '').strip(),
+        'grade': (record.get('grade') or '').strip(),
+        'min_price': _parse_price(record.get('min_price')),
+        'max_price': _parse_price(record.get('max_price')),
+        'modal_price': _parse_price(record.get('modal_price')),
+        'ingested_at': ingested_at,
+    }
+
+
+def _upsert_statement(dialect_name):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Price ingestion does not support the {dialect_name} dialect.")
+    table = PriceRecord.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[name] for name in DEDUP_KEY],
+        set_={name: stmt.excluded[name] for name in UPDATABLE},
+    )
+
+
+def ingest_pages(pages, batch_size=INGEST_BATCH_SIZE):
+    """
+    Streams pages of raw records into the price table with batched upserts, one
+    transaction per batch. Must run inside an app context. Returns stats.
+    """
+    engine = db.engine
+    stmt = _upsert_statement(engine.dialect.name)
+    stats = {'pages': 0, 'records': 0, 'skipped': 0, 'upserted': 0, 'seconds': 0.0}
+    started = time.perf_counter()
+    batch = {}
+
+    def flush():
+        if batch:
+            with engine.begin() as conn:
+                conn.execute(stmt, list(batch.values()))
+            stats['upserted'] += len(batch)
+            batch.clear()
+
+    for records in pages:
+        stats['pages'] += 1
+        ingested_at = datetime.utcnow()
+        for record in records:
+            stats['records'] += 1
+            row = normalize_record(record, ingested_at)
+            if row is None:
+                stats['skipped'] += 1
+                continue
+            # Duplicates inside one statement would make Postgres reject the whole batch.
+            batch[tuple(row[name] for name in DEDUP_KEY)] = row
+            if len(batch) >= batch_size:
+                flush()
+    flush()
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_sec'] = round(stats['upserted'] / stats['seconds']) if stats['seconds'] else 0
+    return stats
+
+
+# --- Trend queries (served entirely from the local store) ---
+def _date_window(query_filters, start, end, default_days=30):
+    if end is None:
+        end = db.session.query(func.max(PriceRecord.arrival_date)).filter(*query_filters).scalar()
+        if end is None:
+            return None, None
+    if start is None:
+        start = end - timedelta(days=default_days)
+    return start, end
+
+
+def price_trend(commodity, market=None, start=None, end=None):
+    """Daily min/max/modal prices for a commodity (optionally one market) over a date range."""
+    filters = [PriceRecord.commodity == commodity]
+    if market:
+        filters.append(PriceRecord.market == market)
+    start, end = _date_window(filters, start, end)
+    result = {'commodity': commodity, 'market': market, 'start': None, 'end': None, 'summary': None, 'series': []}
+    if start is None:
+        return result
+    filters.append(PriceRecord.arrival_date.between(start, end))
+
+    rows = (
+        db.session.query(
+            PriceRecord.arrival_date,
+            func.min(PriceRecord.min_price),
+            func.max(PriceRecord.max_price),
+            func.avg(PriceRecord.modal_price),
+            func.count(PriceRecord.id),
+        )
+        .filter(*filters)
+        .group_by(PriceRecord.arrival_date)
+        .order_by(PriceRecord.arrival_date)
+        .all()
+    )
+    series = [
+        {'date': day.isoformat(), 'min_price': low, 'max_price': high,
+         'modal_price': round(modal, 2) if modal is not None else None, 'records': count}
+        for day, low, high, modal, count in rows
+    ]
+    lows = [s['min_price'] for s in series if s['min_price'] is not None]
+    highs = [s['max_price'] for s in series if s['max_price'] is not None]
+    modals = [s['modal_price'] for s in series if s['modal_price'] is not None]
+    result.update({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'series': series,
+        'summary': {
+            'days': len(series),
+            'min_price': min(lows) if lows else None,
+            'max_price': max(highs) if highs else None,
+            'avg_modal_price': round(sum(modals) / len(modals), 2) if modals else None,
+        },
+    })
+    return result
+
+
+def market_breakdown(commodity, start=None, end=None):
+    """Per-market min/max/average modal price of a commodity over a date range."""
+    filters = [PriceRecord.commodity == commodity]
+    start, end = _date_window(filters, start, end)
+    if start is None:
+        return []
+    rows = (
+        db.session.query(
+            PriceRecord.market,
+            func.min(PriceRecord.min_price),
+            func.max(PriceRecord.max_price),
+            func.avg(PriceRecord.modal_price),
+            func.max(PriceRecord.arrival_date),
+        )
+        .filter(*filters, PriceRecord.arrival_date.between(start, end))
+        .group_by(PriceRecord.market)
+        .order_by(PriceRecord.market)
+        .all()
+    )
+    return [
+        {'market': market, 'min_price': low, 'max_price': high,
+         'avg_modal_price': round(modal, 2) if modal is not None else None, 'last_date': last.isoformat()}
+        for market, low, high, modal, last in rows
+    ]
@@ -1,46 +1,198 @@
 # scripts/price_scraper.py
 
-import requests
+import json
 import os
+import threading
+import time
+
 from dotenv import load_dotenv
 
+from outbound import dependency
+
 # Load environment variables from .env file
 load_dotenv()
 
-def get_market_prices():
+# --- Configuration ---
+# DATA_GOV_RESOURCE_URL points the scraper at a stand-in such as scripts/price_api_mock.py.
+RESOURCE_URL = os.getenv("DATA_GOV_RESOURCE_URL", "https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070")
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", "900"))               # serve without revalidating for 15 min
+PRICE_REFRESH_INTERVAL = int(os.getenv("PRICE_REFRESH_INTERVAL", "600"))  # background refresher period
+PRICE_HTTP_TIMEOUT = (3.05, float(os.getenv("PRICE_HTTP_TIMEOUT", "10")))  # (connect, read) seconds
+# Latency/error metrics and a circuit breaker for data.gov.in; while it is open
+# the page keeps serving the last good snapshot.
+data_gov = dependency("data_gov", timeout=PRICE_HTTP_TIMEOUT[1])
+SNAPSHOT_PATH = os.getenv(
+    "PRICE_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "market_prices.json"),
+)
+
+# One pooled session per process so repeat fetches reuse the TLS connection.
+_session = None
+_session_lock = threading.Lock()
+
+# In-process copy of the feed, shared by every request in this worker.
+_cache = {"records": None, "fetched_at": 0.0}
+_cache_lock = threading.Lock()
+_refreshing = threading.Lock()  # held while a revalidation runs
+_refresher = None
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Imported here so processes that never fetch prices don't pay for requests at start-up.
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=1)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def fetch_market_prices():
     """
     This function fetches live agricultural market price data for Maharashtra
-    from the official data.gov.in API.
+    from the official data.gov.in API. Raises on any failure.
     """
     api_key = os.getenv("DATA_GOV_API_KEY")
     if not api_key:
-        print("ERROR: DATA_GOV_API_KEY not found in .env file.")
-        return []
+        raise RuntimeError("DATA_GOV_API_KEY not found in .env file.")
 
-    # API endpoint for daily agricultural commodity prices, filtered for Maharashtra
-    API_URL = f"https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070?api-key={api_key}&format=json&limit=15&filters[state]=Maharashtra"
+    params = {"api-key": api_key, "format": "json", "limit": 15, "filters[state]": "Maharashtra"}
+    print("--- Fetching live data from data.gov.in API... ---")
+    with data_gov.guard() as call:
+        response = get_session().get(RESOURCE_URL, params=params, timeout=(PRICE_HTTP_TIMEOUT[0], call.timeout))
+        response.raise_for_status()  # Raise an error for bad responses
 
+    records = response.json().get('records', [])
+    formatted_data = []
+    for record in records:
+        # Format the data to match what our webpage expects
+        item = {
+            'commodity': record.get('commodity', '').strip(),
+            'market': record.get('market', '').strip(),
+            'price': f"₹{record.get('modal_price', 'N/A')} / Quintal"
+        }
+        formatted_data.append(item)
+
+    print(f"--- Successfully fetched {len(formatted_data)} records from the API. ---")
+    return formatted_data
+
+
+# --- Last-good snapshot on disk (shared by all workers, survives restarts) ---
+def load_snapshot():
     try:
-        print("--- Fetching live data from data.gov.in API... ---")
-        response = requests.get(API_URL)
-        response.raise_for_status()  # Raise an error for bad responses
+        with open(SNAPSHOT_PATH, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        return snapshot["records"], snapshot["fetched_at"]
+    except (OSError, ValueError, KeyError):
+        return None, 0.0
 
-        data = response.json()
-        records = data.get('records', [])
 
-        formatted_data = []
-        for record in records:
-            # Format the data to match what our webpage expects
-            item = {
-                'commodity': record.get('commodity', '').strip(),
-                'market': record.get('market', '').strip(),
-                'price': f"₹{record.get('modal_price', 'N/A')} / Quintal"
-            }
-            formatted_data.append(item)
+def save_snapshot(records, fetched_at):
+    os.makedirs(os.path.dirname(SNAPSHOT_PATH), exist_ok=True)
+    tmp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"records": records, "fetched_at": fetched_at}, f, ensure_ascii=False)
+    os.replace(tmp_path, SNAPSHOT_PATH)  # atomic, readers never see a partial file
 
-        print(f"--- Successfully fetched {len(formatted_data)} records from the API. ---")
-        return formatted_data
 
+def refresh_market_prices():
+    """Fetches fresh prices into the cache and snapshot. Keeps the last good data on failure."""
+    try:
+        records = fetch_market_prices()
     except Exception as e:
         print(f"An error occurred while calling the API: {e}")
-        return []
\ No newline at end of file
+        return False
+    if not records:
+        # An empty answer is treated like an outage rather than blanking the page.
+        return False
+    fetched_at = time.time()
+    with _cache_lock:
+        _cache["records"], _cache["fetched_at"] = records, fetched_at
+    try:
+        save_snapshot(records, fetched_at)
+    except OSError as e:
+        print(f"Could not persist market price snapshot: {e}")
+    return True
+
+
+def _refresh_in_background():
+    # Single-flight: at most one revalidation per process at a time. The
+    # non-blocking acquire is the check and the claim in one step.
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_market_prices()
+        finally:
+            _refreshing.release()
+
+    try:
+        threading.Thread(target=run, name="price-revalidate", daemon=True).start()
+    except Exception:
+        _refreshing.release()
+        raise
+
+
+def start_background_refresher(interval=PRICE_REFRESH_INTERVAL, should_refresh=None):
+    """
+    Keeps the cache warm with a daemon thread. `should_refresh` is an optional
+    callable (e.g. "is the market open?") checked before each fetch.
+    """
+    global _refresher
+    if _refresher is not None and _refresher.is_alive():
+        return _refresher
+
+    def loop():
+        while True:
+            if should_refresh is None or should_refresh():
+                refresh_market_prices()
+            time.sleep(interval)
+
+    _refresher = threading.Thread(target=loop, name="price-refresher", daemon=True)
+    _refresher.start()
+    return _refresher
+
+
+def get_price_snapshot(allow_fetch=True):
+    """
+    Returns (records, fetched_at) with stale-while-revalidate semantics:
+    fresh cache -> served as is; stale cache -> served immediately while one
+    background refresh runs; empty cache -> last-good snapshot from disk,
+    and only if there is none (and allow_fetch) a blocking fetch.
+    """
+    with _cache_lock:
+        records, fetched_at = _cache["records"], _cache["fetched_at"]
+
+    if records is None:
+        records, fetched_at = load_snapshot()
+        if records is not None:
+            with _cache_lock:
+                if _cache["fetched_at"] < fetched_at:
+                    _cache["records"], _cache["fetched_at"] = records, fetched_at
+
+    if not allow_fetch:
+        return records or [], fetched_at
+
+    if records is None:
+        refresh_market_prices()
+        with _cache_lock:
+            return _cache["records"] or [], _cache["fetched_at"]
+
+    if time.time() - fetched_at > PRICE_CACHE_TTL:
+        # Another worker may have refreshed the snapshot already.
+        disk_records, disk_fetched_at = load_snapshot()
+        if disk_records is not None and time.time() - disk_fetched_at <= PRICE_CACHE_TTL:
+            with _cache_lock:
+                _cache["records"], _cache["fetched_at"] = disk_records, disk_fetched_at
+            return disk_records, disk_fetched_at
+        _refresh_in_background()
+    return records, fetched_at
+
+
+def get_market_prices():
+    """Cached list of price rows for the market prices page."""
+    return get_price_snapshot()[0]
@@ -0,0 +1,166 @@
+# search.py
+# Product search for the Agro Store.
+# SQLite (local instance/krishimitra.sqlite): an FTS5 index kept in sync by
+# index_product()/remove_product(). Postgres (DATABASE_URL): a GIN index over a
+# weighted tsvector expression, maintained by Postgres itself.
+
+import re
+import unicodedata
+
+from sqlalchemy import text, literal, literal_column, select, table, func, or_, and_, false
+
+from models import db, Product
+
+# unicode61 treats combining marks as separators by default, which splits
+# Devanagari words at every matra (कीटकनाशक -> क ट कन शक); M* keeps them whole.
+# porter stems English words and passes everything else through unchanged.
+FTS_TOKENIZER = "porter unicode61 remove_diacritics 2 categories 'L* N* Co M*'"
+FTS_WEIGHTS = "10.0, 1.0"  # bm25 column weights: name, description
+
+PG_CONFIG = 'english'
+PG_INDEX = 'ix_product_search'
+
+TOKEN_RE = re.compile(r"[\w\u0900-\u097F]+")
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def normalize_text(value):
+    """NFC-normalize so composed and decomposed Devanagari (e.g. nukta forms) index alike."""
+    return unicodedata.normalize('NFC', value or '').lower()
+
+
+def query_tokens(term):
+    return TOKEN_RE.findall(normalize_text(term))
+
+
+def _pg_vector():
+    # Must match the indexed expression exactly for Postgres to use the GIN index.
+    return func.setweight(func.to_tsvector(PG_CONFIG, func.coalesce(Product.name, '')), 'A').op('||')(
+        func.setweight(func.to_tsvector(PG_CONFIG, func.coalesce(Product.description, '')), 'B')
+    )
+
+
+# --- Index maintenance ---
+def ensure_search_index():
+    """Creates the search index if missing (and backfills it on SQLite). Call inside an app context."""
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'")
+        ).first()
+        if not exists:
+            db.session.execute(text(
+                f'CREATE VIRTUAL TABLE product_fts USING fts5(name, description, tokenize="{FTS_TOKENIZER}")'
+            ))
+            db.session.commit()
+            rebuild_search_index()
+    elif dialect == 'postgresql':
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON product USING GIN (("
+            f"setweight(to_tsvector('{PG_CONFIG}', coalesce(name, '')), 'A') || "
+            f"setweight(to_tsvector('{PG_CONFIG}', coalesce(description, '')), 'B')))"
+        ))
+        db.session.commit()
+
+
+def rebuild_search_index():
+    """Re-indexes every product. Only needed on SQLite (e.g. after bulk imports)."""
+    if _dialect() != 'sqlite':
+        return
+    db.session.execute(text("DELETE FROM product_fts"))
+    rows = db.session.query(Product.id, Product.name, Product.description).yield_per(1000)
+    batch = []
+    for row in rows:
+        batch.append({'id': row.id, 'name': normalize_text(row.name), 'description': normalize_text(row.description)})
+        if len(batch) >= 1000:
+            _insert_fts(batch)
+            batch = []
+    if batch:
+        _insert_fts(batch)
+    db.session.commit()
+
+
+def _insert_fts(rows):
+    db.session.execute(
+        text("INSERT INTO product_fts (rowid, name, description) VALUES (:id, :name, :description)"),
+        rows,
+    )
+
+
+def index_product(product):
+    """Adds/refreshes one product in the index. Runs in the caller's transaction."""
+    if _dialect() != 'sqlite':
+        return
+    db.session.execute(text("DELETE FROM product_fts WHERE rowid = :id"), {'id': product.id})
+    _insert_fts([{'id': product.id, 'name': normalize_text(product.name), 'description': normalize_text(product.description)}])
+
+
+def remove_product(product_id):
+    if _dialect() != 'sqlite':
+        return
+    db.session.execute(text("DELETE FROM product_fts WHERE rowid = :id"), {'id': product_id})
+
+
+# --- Querying ---
+def apply_search(query, term, with_rank=False, after=None, ordered=True):
+    """
+    Restricts a Product query to matches for `term`, ordered by relevance.
+    Every word is prefix-matched, so "fungi" finds "Fungicide".
+    with_rank adds a `search_rank` column; after=(rank, id) continues from a
+    previous page (keyset pagination over the same ordering). ordered=False
+    only filters, for callers that sort the matches some other way.
+    """
+    tokens = query_tokens(term)
+    if not tokens:
+        return query.filter(false())
+
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        match = ' '.join('"%s"*' % t.replace('"', '""') for t in tokens)
+
+        def fts_hits():
+            return (
+                select(literal_column('rowid').label('product_id'), literal_column(f'bm25(product_fts, {FTS_WEIGHTS})').label('rank'))
+                .select_from(table('product_fts'))
+                .where(text('product_fts MATCH :fts_query').bindparams(fts_query=match))
+            )
+
+        hits = fts_hits().subquery('fts_hits')
+        query = query.join(hits, Product.id == hits.c.product_id)
+        # bm25 scores are negative; lower is more relevant.
+        rank, order = hits.c.rank, hits.c.rank.asc()
+        if after and ordered:
+            # bm25 depends on corpus statistics, so every insert shifts all the
+            # scores and the cursor's saved rank no longer lines up. Re-score the
+            # cursor product against the index as it is now; the saved rank is
+            # only the fallback for a product deleted since.
+            rescored = fts_hits().where(literal_column('rowid') == after[1]).subquery('fts_cursor')
+            anchor = func.coalesce(select(rescored.c.rank).scalar_subquery(), after[0])
+            query = query.filter(or_(rank > anchor, and_(rank == anchor, Product.id < after[1])))
+    elif dialect == 'postgresql':
+        tsquery = func.to_tsquery(PG_CONFIG, ' & '.join(f"{t}:*" for t in tokens))
+        vector = _pg_vector()
+        rank = func.ts_rank(vector, tsquery)
+        order = rank.desc()
+        query = query.filter(vector.op('@@')(tsquery))
+        if after and ordered:
+            query = query.filter(or_(rank < after[0], and_(rank == after[0], Product.id < after[1])))
+    else:
+        # Any other backend: unranked substring match.
+        for t in tokens:
+            query = query.filter(or_(Product.name.ilike(f'%{t}%'), Product.description.ilike(f'%{t}%')))
+        rank = literal(0.0)
+        order = None
+        if after and ordered:
+            query = query.filter(Product.id < after[1])
+
+    if with_rank:
+        query = query.add_columns(rank.label('search_rank'))
+    if not ordered:
+        return query
+    if order is not None:
+        query = query.order_by(order)
+    return query.order_by(Product.id.desc())
@@ -1,66 +1,147 @@
-import requests
 import os
 import logging
+import threading
+
+from outbound import CircuitOpenError, dependency
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_otp_sms(phone_number, otp):
-    """Sends an OTP to a given phone number using the Fast2SMS API."""
-    api_key = os.getenv("FAST2SMS_API_KEY")
-    if not api_key:
-        logger.error("ERROR: Fast2SMS API Key not found in .env file.")
-        return False
+FAST2SMS_URL = os.getenv("FAST2SMS_URL", "https://www.fast2sms.com/dev/bulkV2")
+SMS_HTTP_TIMEOUT = float(os.getenv("SMS_HTTP_TIMEOUT", 10))
+# Routes that accept a comma-separated list of numbers for one message. Anything
+# else is sent one number per call.
+BULK_ROUTES = {"q", "dlt"}
+SMS_BATCH_SIZE = int(os.getenv("SMS_BATCH_SIZE", 100))  # numbers per bulkV2 call
+fast2sms = dependency("fast2sms", timeout=SMS_HTTP_TIMEOUT)
+
+
+class SMSError(Exception):
+    """A send failed. permanent=True means retrying the same request cannot succeed."""
 
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def clean_number(phone_number):
+    """The 10-digit number Fast2SMS expects, or None if phone_number isn't an Indian mobile number."""
     # Clean the phone number - remove any non-numeric characters and ensure it's 10 digits
-    clean_number = ''.join(filter(str.isdigit, phone_number))
-    if len(clean_number) == 12 and clean_number.startswith('91'):
-        clean_number = clean_number[2:]  # Remove country code if present
-    elif len(clean_number) != 10:
-        logger.error(f"Invalid phone number format: {phone_number} (cleaned: {clean_number})")
-        return False
+    clean = ''.join(filter(str.isdigit, phone_number or ''))
+    if len(clean) == 12 and clean.startswith('91'):
+        clean = clean[2:]  # Remove country code if present
+    return clean if len(clean) == 10 else None
+
+
+def otp_message(otp):
+    return f"Your OTP for password reset is: {otp}. Valid for 10 minutes."
+
+
+class Fast2SMSClient:
+    """bulkV2 calls over one pooled HTTP session (keep-alive), with a timeout on every call."""
 
-    logger.info(f"Sending OTP {otp} to cleaned number: {clean_number}")
+    def __init__(self, api_key=None, url=None, timeout=SMS_HTTP_TIMEOUT, pool_size=4):
+        self.api_key = api_key or os.getenv("FAST2SMS_API_KEY")
+        self.url = url or FAST2SMS_URL
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
 
-    # Fast2SMS API endpoint and parameters
-    url = "https://www.fast2sms.com/dev/bulkV2"
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                # Imported here so processes that never send SMS don't pay for requests at start-up.
+                import requests
+                from requests.adapters import HTTPAdapter
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+                self._session.headers.update({"cache-control": "no-cache"})
+            return self._session
 
-    # Updated parameters based on Fast2SMS API documentation
-    payload = {
-        "authorization": api_key,
-        "message": f"Your OTP for password reset is: {otp}. Valid for 5 minutes.",
-        "language": "english",
-        "route": "q",  # Quick SMS route
-        "numbers": clean_number
-    }
+    def send(self, message, numbers, route="q"):
+        """
+        Sends one message to up to SMS_BATCH_SIZE cleaned numbers in a single
+        bulkV2 call. Returns the API's request_id; raises SMSError on failure.
+        """
+        if not self.api_key:
+            raise SMSError("Fast2SMS API Key not found in .env file.", permanent=True)
+        if len(numbers) > 1 and route not in BULK_ROUTES:
+            raise SMSError(f"Route '{route}' does not accept multiple numbers.", permanent=True)
+        payload = {
+            "message": message,
+            "language": "english",
+            "route": route,
+            "numbers": ",".join(numbers),
+        }
+        import requests
+        try:
+            with fast2sms.guard() as call:
+                response = self._get_session().post(self.url, data=payload, headers={"authorization": self.api_key},
+                                                    timeout=min(self.timeout, call.timeout))
+                if response.status_code >= 500:
+                    # Counts against Fast2SMS; a 4xx means our request was wrong, not that the service is down.
+                    raise self._error(response)
+        except CircuitOpenError as e:
+            raise SMSError(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise SMSError(f"Network error while sending SMS: {e}") from e
+        response_data = self._json(response)
+        if response.status_code == 200 and response_data.get("return") is True:
+            return response_data.get("request_id")
+        raise self._error(response)
 
-    headers = {
-        'cache-control': "no-cache"
-    }
+    @staticmethod
+    def _json(response):
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    def _error(self, response):
+        error = self._json(response).get("message") or response.text[:200]
+        # 4xx (bad key, bad number, DLT template rejected) won't change on retry; 429 and 5xx might.
+        permanent = 400 <= response.status_code < 500 and response.status_code != 429
+        return SMSError(f"HTTP {response.status_code}: {error}", permanent=permanent)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = Fast2SMSClient()
+    return _client
+
+
+def send_otp_sms(phone_number, otp):
+    """Sends an OTP to a given phone number using the Fast2SMS API."""
+    if not os.getenv("FAST2SMS_API_KEY"):
+        logger.error("ERROR: Fast2SMS API Key not found in .env file.")
+        return False
+
+    number = clean_number(phone_number)
+    if number is None:
+        logger.error(f"Invalid phone number format: {phone_number}")
+        return False
 
+    logger.info(f"Sending OTP to cleaned number: {number}")
     try:
-        logger.info(f"Making API request to Fast2SMS with payload: {payload}")
-        response = requests.post(url, data=payload, headers=headers)
-        logger.info(f"Response status code: {response.status_code}")
-
-        if response.status_code == 200:
-            response_data = response.json()
-            logger.info(f"API Response: {response_data}")
-
-            # Check if the message was sent successfully
-            if response_data.get("return") is True:
-                logger.info(f"OTP SMS sent successfully to {clean_number}")
-                return True
-            else:
-                logger.error(f"Failed to send SMS: {response_data.get('message', 'Unknown error')}")
-                return False
-        else:
-            logger.error(f"HTTP Error {response.status_code}: {response.text}")
-            return False
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Network error while sending SMS: {e}")
+        request_id = get_client().send(otp_message(otp), [number], route="q")  # Quick SMS route
+        logger.info(f"OTP SMS sent successfully to {number} (request {request_id})")
+        return True
+    except SMSError as e:
+        logger.error(f"Failed to send SMS: {e}")
         return False
     except Exception as e:
         logger.error(f"Unexpected error while sending SMS: {e}")
@@ -1,4 +1,10 @@
+import json
 import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -24,3 +30,96 @@ def send_otp_sms_mock(phone_number, otp):
 
 # For testing, you can temporarily replace the import in app.py:
 # from sms_utils_mock import send_otp_sms_mock as send_otp_sms
+
+
+# --- Fake Fast2SMS server ---
+# A local stand-in for the bulkV2 endpoint, for tests and for running the
+# notification dispatcher without sending real SMS:
+#
+#     python sms_utils_mock.py            # then FAST2SMS_URL=http://127.0.0.1:8025/dev/bulkV2
+
+
+class FakeFast2SMSServer:
+    """
+    Accepts bulkV2 form posts and records them in .calls as
+    {'route', 'message', 'numbers', 'authorization'}. fail_next(n, status)
+    makes the next n calls fail with that HTTP status.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, api_key='test-key', delay=0.0):
+        self.api_key = api_key
+        self.delay = delay
+        self.calls = []
+        self._failures = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is visible in .connections
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                status, body = fake._handle(form, self.headers.get('authorization'))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+        self.connections = 0
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/dev/bulkV2"
+
+    def fail_next(self, count, status=500):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _handle(self, form, authorization):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            status = self._failures.pop(0) if self._failures else None
+            if status is not None:
+                return status, {'return': False, 'status_code': status, 'message': 'Simulated failure'}
+            if self.api_key is not None and authorization != self.api_key:
+                return 401, {'return': False, 'status_code': 412, 'message': 'Invalid Authentication'}
+            numbers = [n for n in form.get('numbers', '').split(',') if n]
+            self.calls.append({'route': form.get('route'), 'message': form.get('message'),
+                               'numbers': numbers, 'authorization': authorization})
+        logger.info(f"FAKE FAST2SMS: {form.get('route')} to {len(numbers)} number(s): {form.get('message')}")
+        return 200, {'return': True, 'request_id': uuid.uuid4().hex, 'message': ['SMS sent successfully.']}
+
+    def sent_to(self):
+        """Every number that received a message, in call order."""
+        return [n for call in self.calls for n in call['numbers']]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-fast2sms', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    server = FakeFast2SMSServer(port=8025, api_key=None)
+    print(f"Fake Fast2SMS listening on {server.url} (any API key accepted)")
+    server._server.serve_forever()
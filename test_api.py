@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+JSON API checks: /api/v1/store, /prices and /inbox answer 304 to a current
+ETag (or Last-Modified), change their ETag when the data changes, gzip large
+bodies and trim items with ?fields=.
+
+Run with: python -m pytest test_api.py
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import time
+
+# Read when the price scraper is imported: a throwaway price snapshot.
+os.environ.setdefault('PRICE_SNAPSHOT_PATH', os.path.join(tempfile.mkdtemp(), 'market_prices.json'))
+
+from sqlalchemy import func
+
+from app import create_app, init_db
+from instrumentation import assert_max_queries
+from models import db, User, Product, Conversation
+from scripts import price_scraper
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'api.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'ApiTest'
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        seller = User(email='api-seller@example.com', mobile='9400000001', password='x', role='seller')
+        buyer = User(email='api-buyer@example.com', mobile='9400000002', password='x', role='customer')
+        db.session.add_all([seller, buyer])
+        db.session.flush()
+        products = [Product(name=f'Drip kit {i}', category=CATEGORY, description='Drip irrigation kit ' * 5,
+                            price='3200', image='x.jpg', seller_id=seller.id) for i in range(12)]
+        db.session.add_all(products)
+        db.session.flush()
+        convo = Conversation(product_id=products[0].id, buyer_id=buyer.id, seller_id=seller.id)
+        db.session.add(convo)
+        db.session.flush()
+        convo.add_message(buyer.id, 'Is the drip kit available?')
+        db.session.commit()
+        return seller.id, buyer.id, convo.id
+
+
+SELLER_ID, BUYER_ID, CONVO_ID = seed()
+
+
+def client_for(user_id=None, role='customer'):
+    client = app.test_client()
+    if user_id is not None:
+        with client.session_transaction() as sess:
+            sess['user_id'], sess['role'] = user_id, role
+    return client
+
+
+def test_store_revalidates_with_etag():
+    client = client_for()
+    url = f'/api/v1/store?category={CATEGORY}'
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200 and response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'public, no-cache'
+    body = json.loads(gzip.decompress(response.data))
+    assert len(body['products']) == 12 and body['products'][0]['name'] == 'Drip kit 11'
+    etag = response.headers['ETag']
+    assert etag.endswith('-gz"')
+
+    with assert_max_queries(1):  # only the change marker
+        cached = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers and json.loads(plain.data) == body
+    assert len(response.data) < len(plain.data) / 2
+
+    with app.app_context():
+        db.session.add(Product(name='Drip kit new', category=CATEGORY, description='New', price='100',
+                               image='x.jpg', seller_id=SELLER_ID))
+        db.session.commit()
+    changed = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_store_etag_changes_when_newest_product_is_replaced():
+    seller = client_for(SELLER_ID, role='seller')
+    url = f'/api/v1/store?category={CATEGORY}&fields=id,name'
+    with app.app_context():
+        product = Product(name='Drip kit newest', category=CATEGORY, description='Newest', price='1',
+                          image='x.jpg', seller_id=SELLER_ID)
+        db.session.add(product)
+        db.session.commit()
+        newest = product.id
+        assert newest == db.session.query(func.max(Product.id)).scalar()
+    etag = seller.get(url).headers['ETag']
+    assert seller.post(f'/delete_product/{newest}').status_code == 302
+    with app.app_context():
+        # SQLite hands the deleted id straight back, so id and count alone would look unchanged.
+        db.session.add(Product(name='Drip kit replacement', category='ApiOther', description='Other', price='1',
+                               image='x.jpg', seller_id=SELLER_ID))
+        db.session.commit()
+    response = seller.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert newest not in [p['id'] for p in response.get_json()['products']]
+
+
+def test_field_selection():
+    client = client_for()
+    response = client.get(f'/api/v1/store?category={CATEGORY}&fields=id,name,price')
+    products = response.get_json()['products']
+    assert products and all(set(p) == {'id', 'name', 'price'} for p in products)
+    assert response.headers['ETag'] != client.get(f'/api/v1/store?category={CATEGORY}').headers['ETag']
+    response = client.get('/api/v1/store?fields=id,secret')
+    assert response.status_code == 400 and 'secret' in response.get_json()['error']
+
+
+def test_prices_use_snapshot_time():
+    fetched_at = time.time() - 3600
+    records = [{'commodity': 'Onion', 'market': 'Lasalgaon', 'price': '₹1543 / Quintal'}]
+    with price_scraper._cache_lock:
+        saved = dict(price_scraper._cache)
+        price_scraper._cache.update(records=records, fetched_at=fetched_at)
+    try:
+        client = client_for()
+        response = client.get('/api/v1/prices?fields=commodity,price')
+        assert response.get_json()['prices'] == [{'commodity': 'Onion', 'price': '₹1543 / Quintal'}]
+        last_modified = response.headers['Last-Modified']
+        assert client.get('/api/v1/prices?fields=commodity,price',
+                          headers={'If-Modified-Since': last_modified}).status_code == 304
+        assert client.get('/api/v1/prices?fields=commodity,price',
+                          headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+        # If-None-Match wins: a stale ETag gets the full body even with a current date.
+        assert client.get('/api/v1/prices?fields=commodity,price',
+                          headers={'If-None-Match': '"old"', 'If-Modified-Since': last_modified}).status_code == 200
+    finally:
+        with price_scraper._cache_lock:
+            price_scraper._cache.update(saved)
+
+
+def test_inbox_etag_tracks_messages_and_reads():
+    assert client_for().get('/api/v1/inbox').status_code == 401
+    seller = client_for(SELLER_ID, 'seller')
+    response = seller.get('/api/v1/inbox')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    conversation = response.get_json()['conversations'][0]
+    assert conversation['other_party'] == 'api-buyer@example.com' and conversation['unread'] == 1
+    etag = response.headers['ETag']
+    assert seller.get('/api/v1/inbox', headers={'If-None-Match': etag}).status_code == 304
+
+    seller.get(f'/conversation/chat/{CONVO_ID}')  # reading clears the unread count
+    response = seller.get('/api/v1/inbox', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.get_json()['conversations'][0]['unread'] == 0
+    etag = response.headers['ETag']
+
+    buyer = client_for(BUYER_ID)
+    buyer.post(f'/conversation/{CONVO_ID}/messages', json={'message_text': 'Hello again'})
+    response = seller.get('/api/v1/inbox?fields=id,last_message_text', headers={'If-None-Match': etag})
+    assert response.get_json()['conversations'][0] == {'id': CONVO_ID, 'last_message_text': 'Hello again'}
+    # The buyer's ETag for the same data is different: ETags are per user.
+    assert buyer.get('/api/v1/inbox').headers['ETag'] != seller.get('/api/v1/inbox').headers['ETag']
+
+
+if __name__ == "__main__":
+    test_store_revalidates_with_etag()
+    test_store_etag_changes_when_newest_product_is_replaced()
+    test_field_selection()
+    test_prices_use_snapshot_time()
+    test_inbox_etag_tracks_messages_and_reads()
+    print("The JSON API revalidates, compresses and trims fields.")
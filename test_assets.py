@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Asset pipeline checks: build-assets writes content-hashed, resized JPEG/WebP
+variants and a minified stylesheet pointing at them, and /assets serves them
+precompressed with immutable caching.
+
+Run with: python -m pytest test_assets.py
+"""
+
+import gzip
+import os
+import tempfile
+
+from PIL import Image
+
+import assets
+from app import create_app
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'assets.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+CSS = """
+/* hero */
+.hero-section {
+    background: url('../images/hero.jpg') no-repeat center center;
+    background-size: cover;
+}
+.card:hover .card-title { color: #2e7d32; }
+.badge { background-image: url("../images/badge.png"); }
+"""
+
+
+def make_static():
+    static_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(static_dir, 'images'))
+    os.makedirs(os.path.join(static_dir, 'css'))
+    Image.new('RGB', (2000, 1000), (60, 140, 60)).save(os.path.join(static_dir, 'images', 'hero.jpg'), quality=95)
+    Image.new('RGBA', (300, 300), (200, 30, 30, 128)).save(os.path.join(static_dir, 'images', 'badge.png'))
+    with open(os.path.join(static_dir, 'css', 'style.css'), 'w') as f:
+        f.write(CSS)
+    return static_dir
+
+
+STATIC_DIR = make_static()
+OUT_DIR = tempfile.mkdtemp()
+MANIFEST = assets.build(STATIC_DIR, OUT_DIR)
+
+
+def read(path):
+    with open(os.path.join(OUT_DIR, path), 'rb') as f:
+        return f.read()
+
+
+def test_images_resized_and_never_upscaled():
+    hero = MANIFEST['images']['images/hero.jpg']
+    assert [w for w, _ in hero['webp']] == [480, 960, 1600]
+    assert [w for w, _ in hero['jpeg']] == [480, 960, 1600]
+    badge = MANIFEST['images']['images/badge.png']
+    assert [w for w, _ in badge['jpeg']] == [300]  # smaller than every width: original size only
+    for fmt in ('jpeg', 'webp'):
+        for width, path in hero[fmt] + badge[fmt]:
+            with Image.open(os.path.join(OUT_DIR, path)) as img:
+                assert img.width == width and img.mode == 'RGB'
+    assert len(read(hero['webp'][0][1])) < len(read(hero['jpeg'][-1][1]))
+
+
+def test_stylesheet_minified_and_rewritten():
+    path = MANIFEST['files']['css/style.css']
+    css = read(path).decode()
+    hero = MANIFEST['images']['images/hero.jpg']
+    assert '/*' not in css and '\n' not in css
+    assert '.card:hover .card-title{' in css  # descendant selectors survive minification
+    assert f'url("../{hero["jpeg"][-1][1]}")' in css  # JPEG fallback for browsers without image-set()
+    assert 'image-set(' in css and 'type("image/webp")' in css
+    assert f'@media (max-width:960px){{.hero-section{{background-image:image-set(url("../{hero["webp"][1][1]}")' in css
+    assert '.badge{' in css and css.count('@media') == 1  # the 300px badge needs no phone variant
+    assert gzip.decompress(read(path + '.gz')).decode() == css
+
+
+def test_rebuild_keeps_previous_and_prunes_older_files():
+    global MANIFEST
+    css_path = os.path.join(STATIC_DIR, 'css', 'style.css')
+    first = MANIFEST['files']['css/style.css']
+    with open(css_path, 'a') as f:
+        f.write('.v2 { color: red; }')
+    second = assets.build(STATIC_DIR, OUT_DIR)['files']['css/style.css']
+    with open(css_path, 'a') as f:
+        f.write('.v3 { color: blue; }')
+    MANIFEST = assets.build(STATIC_DIR, OUT_DIR)
+    third = MANIFEST['files']['css/style.css']
+    assert len({first, second, third}) == 3
+    assert not os.path.exists(os.path.join(OUT_DIR, first))
+    assert not os.path.exists(os.path.join(OUT_DIR, first + '.gz'))
+    assert os.path.exists(os.path.join(OUT_DIR, second)) and os.path.exists(os.path.join(OUT_DIR, third))
+
+
+def test_assets_served_precompressed_and_immutable():
+    original = app.config['ASSETS_DIR']
+    app.config['ASSETS_DIR'] = OUT_DIR
+    assets.reload(app)
+    try:
+        client = app.test_client()
+        url = '/assets/' + MANIFEST['files']['css/style.css']
+        response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data) == read(MANIFEST['files']['css/style.css'])
+        etag = response.headers['ETag']
+        assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+        plain = client.get(url)
+        assert 'Content-Encoding' not in plain.headers and plain.data == read(MANIFEST['files']['css/style.css'])
+        assert plain.headers['ETag'] != etag
+        assert client.get('/assets/../manifest.json').status_code == 404
+
+        page = client.get('/').data.decode()
+        assert url in page
+    finally:
+        app.config['ASSETS_DIR'] = original
+        assets.reload(app)
+
+
+if __name__ == "__main__":
+    test_images_resized_and_never_upscaled()
+    test_stylesheet_minified_and_rewritten()
+    test_rebuild_keeps_previous_and_prunes_older_files()
+    test_assets_served_precompressed_and_immutable()
+    print("Assets are built, fingerprinted and served with long-lived caching.")
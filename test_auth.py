@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Login hashing checks: outdated hashes are upgraded on login, throttled
+attempts are refused before any hashing, per-IP buckets see the client
+behind a configured proxy, the hashing processes are never
+forked from the threaded server, and a saturated hashing pool answers "try
+again" instead of queueing. Password-reset OTPs live server-side, so a forged
+or replayed session cookie gets no extra guesses, and reset requests are
+throttled per email.
+
+Run with: python -m pytest test_auth.py
+"""
+
+import os
+import tempfile
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import OTP_MAX_ATTEMPTS, create_app, init_db
+from auth_hashing import HashingBusyError, PasswordHasher, TokenBucket
+from models import db, Notification, PasswordReset, User
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'auth.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+app.config.update(NOTIFY_EMAIL_WORKERS=0, NOTIFY_SMS_WORKERS=0)  # OTPs stay queued
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        # An account from before the hash parameters changed.
+        user = User(email='auth-farmer@example.com', mobile='9200000001',
+                    password=generate_password_hash('old-secret', method='pbkdf2:sha256:1000'), role='customer')
+        resetting = User(email='auth-reset@example.com', mobile='9200000002',
+                         password=generate_password_hash('before-reset'), role='customer')
+        db.session.add_all([user, resetting])
+        db.session.commit()
+        return user.id, resetting.id
+
+
+USER_ID, RESET_USER_ID = seed()
+
+
+def reset_throttle():
+    for bucket in app.extensions['login_throttle'].values():
+        bucket.reset()
+
+
+def login(client, identifier, password):
+    return client.post('/login', data={'email': identifier, 'password': password})
+
+
+def stored_hash():
+    with app.app_context():
+        return db.session.get(User, USER_ID).password
+
+
+def test_login_rehashes_outdated_password_hash():
+    reset_throttle()
+    client = app.test_client()
+    response = login(client, 'auth-farmer@example.com', 'old-secret')
+    assert response.headers['Location'].endswith('/store')
+    upgraded = stored_hash()
+    assert upgraded.startswith('scrypt:32768:8:1$')
+
+    response = login(app.test_client(), '9200000001', 'old-secret')
+    assert response.headers['Location'].endswith('/store')
+    assert stored_hash() == upgraded  # already current, left alone
+
+
+def test_throttled_attempts_are_refused_before_hashing():
+    reset_throttle()
+    hasher = app.extensions['password_hasher']
+    calls = []
+    original = hasher.verify
+    hasher.verify = lambda *args: calls.append(args) or original(*args)
+    try:
+        client = app.test_client()
+        burst = app.config['LOGIN_BURST_PER_ACCOUNT']
+        for _ in range(burst - 1):
+            assert login(client, 'auth-farmer@example.com', 'wrong').status_code == 302
+        # Same account, however it is spelled.
+        assert login(client, ' AUTH-Farmer@example.com', 'wrong').status_code == 302
+        response = login(client, 'auth-farmer@example.com', 'wrong')
+        assert response.status_code == 429
+        assert b'Too many login attempts' in response.data
+        assert len(calls) == burst - 1
+    finally:
+        hasher.verify = original
+        reset_throttle()
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = TokenBucket(rate=0.5, burst=2, max_keys=2, clock=lambda: now[0])
+    assert bucket.allow('a') and bucket.allow('a')
+    assert not bucket.allow('a')
+    now[0] = 2.0  # one token back
+    assert bucket.allow('a')
+    assert not bucket.allow('a')
+    bucket.allow('b')
+    bucket.allow('c')  # evicts 'a', the least recently seen key
+    assert bucket.allow('a') and bucket.allow('a')
+
+
+def test_ip_buckets_use_the_client_address_behind_a_proxy():
+    proxied = create_app({'DATABASE_URL': app.config['SQLALCHEMY_DATABASE_URI'], 'PREDICTOR_BACKEND': 'stub',
+                          'TESTING': True, 'PROXY_FIX_HOPS': 1, 'LOGIN_BURST_PER_IP': 2})
+    direct = create_app({'DATABASE_URL': app.config['SQLALCHEMY_DATABASE_URI'], 'PREDICTOR_BACKEND': 'stub',
+                         'TESTING': True, 'LOGIN_BURST_PER_IP': 2})
+
+    def attempt(flask_app, forwarded_for, n):
+        # A different unknown account each time, so only the IP bucket can refuse it.
+        return flask_app.test_client().post('/login', data={'email': f'auth-proxy{n}@example.com', 'password': 'x'},
+                                            headers={'X-Forwarded-For': forwarded_for},
+                                            environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code
+
+    # The proxy appends the real client; whatever the client sent before it is not trusted.
+    spoofed = ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+    assert [attempt(proxied, f'{fake}, 203.0.113.5', n) for n, fake in enumerate(spoofed)] == [302, 302, 429]
+    assert attempt(proxied, '203.0.113.9', 3) == 302  # another farmer behind the same proxy
+
+    # Without PROXY_FIX_HOPS the header is ignored and everyone shares the proxy's bucket.
+    assert [attempt(direct, f'203.0.113.{n}', n) for n in range(3)] == [302, 302, 429]
+
+
+def test_hashing_processes_are_not_forked():
+    hasher = PasswordHasher(workers=1)
+    try:
+        assert hasher._get_executor()._mp_context.get_start_method() in ('forkserver', 'spawn')
+        assert check_password_hash(hasher.hash('secret'), 'secret')
+        assert hasher.verify(hasher.hash('secret'), 'secret') == (True, None)
+    finally:
+        hasher.shutdown()
+
+
+def test_saturated_hashing_pool_asks_to_retry():
+    reset_throttle()
+    busy = PasswordHasher(workers=0, max_pending=1, queue_timeout=0.05)
+    busy._slots.acquire()  # every slot taken
+    try:
+        busy.hash('x')
+    except HashingBusyError:
+        pass
+    else:
+        raise AssertionError("expected HashingBusyError")
+
+    original = app.extensions['password_hasher']
+    app.extensions['password_hasher'] = busy
+    try:
+        client = app.test_client()
+        response = login(client, 'auth-farmer@example.com', 'old-secret')
+        assert response.status_code == 302 and response.headers['Location'].endswith('/login')
+        assert b'Too many sign-ins' in client.get('/login').data
+    finally:
+        app.extensions['password_hasher'] = original
+
+
+def reset_password(client, otp, password='after-reset'):
+    reset_throttle()
+    return client.post('/verify_otp', data={'otp': otp, 'new_password': password, 'confirm_password': password})
+
+
+def test_forged_reset_cookie_cannot_reset_password():
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['reset_user_id'] = RESET_USER_ID  # no OTP was ever requested for this account
+    response = reset_password(client, '123456')
+    assert response.headers['Location'].endswith('/forgot_password')
+    with app.app_context():
+        assert check_password_hash(db.session.get(User, RESET_USER_ID).password, 'before-reset')
+
+
+def test_otp_attempts_are_counted_server_side():
+    reset_throttle()
+    client = app.test_client()
+    client.post('/forgot_password', data={'email': 'auth-reset@example.com'})
+    with app.app_context():
+        reset = db.session.get(PasswordReset, RESET_USER_ID)
+        reset.otp_hash = generate_password_hash('424242')  # the real OTP only went to the notification queue
+        db.session.commit()
+    with client.session_transaction() as sess:
+        cookie = dict(sess)
+    for _ in range(OTP_MAX_ATTEMPTS):
+        # Replaying the cookie from before the wrong guesses must not hand out new attempts.
+        with client.session_transaction() as sess:
+            sess.update(cookie)
+        assert reset_password(client, '000000').headers['Location'].endswith('/verify_otp')
+    with client.session_transaction() as sess:
+        sess.update(cookie)
+    assert reset_password(client, '424242').headers['Location'].endswith('/forgot_password')
+    with app.app_context():
+        assert check_password_hash(db.session.get(User, RESET_USER_ID).password, 'before-reset')
+
+    client.post('/forgot_password', data={'email': 'auth-reset@example.com'})
+    with app.app_context():
+        db.session.get(PasswordReset, RESET_USER_ID).otp_hash = generate_password_hash('535353')
+        db.session.commit()
+    assert reset_password(client, '535353').headers['Location'].endswith('/login')
+    with app.app_context():
+        assert check_password_hash(db.session.get(User, RESET_USER_ID).password, 'after-reset')
+        assert db.session.get(PasswordReset, RESET_USER_ID) is None
+        Notification.query.filter(Notification.recipient.in_(('auth-reset@example.com', '9200000002'))).delete()
+        db.session.commit()
+
+
+def test_reset_requests_are_throttled_per_email():
+    reset_throttle()
+    client = app.test_client()
+    burst = app.config['RESET_BURST_PER_ACCOUNT']
+    # An unknown address is limited the same way, so the limit can't be used to probe for accounts.
+    for email in ('auth-farmer@example.com', 'nobody@example.com'):
+        for _ in range(burst):
+            assert client.post('/forgot_password', data={'email': email}).status_code == 302
+        response = client.post('/forgot_password', data={'email': email.upper() + ' '})
+        assert response.status_code == 429 and b'Too many reset requests' in response.data
+    with app.app_context():
+        assert Notification.query.filter_by(recipient='auth-farmer@example.com').count() == burst
+        Notification.query.filter(Notification.recipient.in_(('auth-farmer@example.com', '9200000001'))).delete()
+        db.session.delete(db.session.get(PasswordReset, USER_ID))
+        db.session.commit()
+    reset_throttle()
+
+
+if __name__ == "__main__":
+    test_login_rehashes_outdated_password_hash()
+    test_throttled_attempts_are_refused_before_hashing()
+    test_token_bucket_refills_over_time()
+    test_ip_buckets_use_the_client_address_behind_a_proxy()
+    test_hashing_processes_are_not_forked()
+    test_saturated_hashing_pool_asks_to_retry()
+    test_forged_reset_cookie_cannot_reset_password()
+    test_otp_attempts_are_counted_server_side()
+    test_reset_requests_are_throttled_per_email()
+    print("Password hashing is bounded and throttled.")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Chat checks: history pages back by id, a long-poll times out empty and wakes
+as soon as a message arrives (also one sent through another worker), the
+event stream frames messages with a resumable id, and a message whose lower
+id commits late is still delivered, once.
+
+Run with: python -m pytest test_chat.py
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from app import create_app, init_db
+from chat import CHAT_PAGE_SIZE
+from models import db, User, Product, Conversation, Message
+
+DATABASE_URL = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'chat.sqlite')
+CONFIG = {'DATABASE_URL': DATABASE_URL, 'PREDICTOR_BACKEND': 'stub', 'TESTING': True,
+          'CHAT_POLL_INTERVAL': 0.05, 'CHAT_RESCAN_IDS': 10}
+app = create_app(CONFIG)
+
+
+def seed(messages=CHAT_PAGE_SIZE + 20):
+    with app.app_context():
+        init_db()
+        seller = User(email='chat-seller@example.com', mobile='9600000501', password='x', role='seller')
+        buyer = User(email='chat-buyer@example.com', mobile='9600000502', password='x', role='customer')
+        db.session.add_all([seller, buyer])
+        db.session.flush()
+        product = Product(name='Chat sprayer', category='ChatTest', description='Battery sprayer',
+                          price='3100', image='x.jpg', seller_id=seller.id)
+        db.session.add(product)
+        db.session.flush()
+        convo = Conversation(product_id=product.id, buyer_id=buyer.id, seller_id=seller.id)
+        db.session.add(convo)
+        db.session.flush()
+        for i in range(messages):
+            convo.add_message(buyer.id if i % 2 else seller.id, f'history {i}')
+        db.session.commit()
+        return seller.id, buyer.id, convo.id
+
+
+SELLER_ID, BUYER_ID, CONVO_ID = seed()
+
+
+def client_for(user_id, flask_app=app):
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['role'] = user_id, 'customer'
+    return client
+
+
+def newest_id():
+    with app.app_context():
+        return db.session.query(db.func.max(Message.id)).filter(Message.conversation_id == CONVO_ID).scalar()
+
+
+def send_later(client, text, delay=0.2):
+    thread = threading.Timer(delay, lambda: client.post(f'/conversation/{CONVO_ID}/messages', json={'message_text': text}))
+    thread.start()
+    return thread
+
+
+def test_history_pages_back_by_id():
+    client = client_for(BUYER_ID)
+    page = client.get(f'/conversation/{CONVO_ID}/messages').get_json()
+    assert len(page['messages']) == CHAT_PAGE_SIZE and page['has_older']
+    ids = [m['id'] for m in page['messages']]
+    assert ids == sorted(ids)
+    older = client.get(f'/conversation/{CONVO_ID}/messages?before={ids[0]}').get_json()
+    older_ids = [m['id'] for m in older['messages']]
+    assert older_ids == sorted(older_ids) and older_ids[-1] < ids[0] and not older['has_older']
+    assert len(older_ids) + len(ids) == CHAT_PAGE_SIZE + 20
+    assert client.get(f'/conversation/{CONVO_ID}/messages?before={ids[0]}&limit=5').get_json()['has_older']
+    assert client_for(10 ** 6).get(f'/conversation/{CONVO_ID}/messages').status_code == 404
+
+
+def test_long_poll_times_out_then_wakes_on_a_message():
+    client = client_for(BUYER_ID)
+    after = newest_id()
+    started = time.monotonic()
+    page = client.get(f'/conversation/{CONVO_ID}/messages?after={after}&wait=0.3').get_json()
+    assert 0.3 <= time.monotonic() - started < 2
+    assert all(m['id'] <= after for m in page['messages'])  # only the re-scanned window
+
+    sender = send_later(client_for(SELLER_ID), 'Shipping today')
+    started = time.monotonic()
+    page = client.get(f'/conversation/{CONVO_ID}/messages?after={after}&wait=10').get_json()
+    sender.join()
+    assert time.monotonic() - started < 5
+    assert [m['text'] for m in page['messages'] if m['id'] > after] == ['Shipping today']
+
+
+def test_messages_from_another_worker_wake_the_poll():
+    other_worker = create_app(CONFIG)  # same database, its own notifier
+    assert other_worker.extensions['chat_notifier'] is not app.extensions['chat_notifier']
+    after = newest_id()
+    sender = send_later(client_for(SELLER_ID, other_worker), 'Sent via worker two')
+    started = time.monotonic()
+    page = client_for(BUYER_ID).get(f'/conversation/{CONVO_ID}/messages?after={after}&wait=10').get_json()
+    sender.join()
+    assert time.monotonic() - started < 5
+    assert [m['text'] for m in page['messages'] if m['id'] > after] == ['Sent via worker two']
+
+
+def read_until(chunks, text):
+    """Server-sent message events, as (event id, message), up to and including the one with `text`."""
+    events = []
+    while not events or events[-1][1]['text'] != text:
+        frame = next(chunks).decode()
+        if 'event: message' in frame:
+            fields = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+            events.append((int(fields['id']), json.loads(fields['data'])))
+    return events
+
+
+def reserve_id():
+    """
+    Leaves a hole below the newest message id, so a message inserted there later
+    looks like one whose transaction committed after a higher id was delivered.
+    The placeholder never commits, so no poller sees the id before then.
+    """
+    with app.app_context():
+        convo = db.session.get(Conversation, CONVO_ID)
+        placeholder = convo.add_message(SELLER_ID, 'placeholder')
+        db.session.flush()
+        convo.add_message(SELLER_ID, 'Filler')
+        db.session.flush()
+        db.session.delete(placeholder)
+        db.session.commit()
+        return placeholder.id
+
+
+def test_stream_frames_messages_and_delivers_late_commits_once():
+    late_id = reserve_id()
+    after = newest_id()
+    response = client_for(BUYER_ID).get(f'/conversation/{CONVO_ID}/stream?after={after}', buffered=False)
+    assert response.mimetype == 'text/event-stream' and response.headers['Cache-Control'] == 'no-cache'
+    chunks = iter(response.response)
+    try:
+        assert next(chunks).decode() == 'retry: 2000\n\n'
+        replayed = read_until(chunks, 'Filler')  # the re-scan window, which the browser de-duplicates
+        assert [message['id'] for _, message in replayed] == sorted(message['id'] for _, message in replayed)
+        assert replayed[-1][1]['id'] == after and len(replayed) <= CONFIG['CHAT_RESCAN_IDS']
+
+        send_later(client_for(SELLER_ID), 'Fresh message', delay=0.1)
+        (cursor, fresh), = read_until(chunks, 'Fresh message')
+        assert cursor == fresh['id'] > after
+
+        with app.app_context():
+            db.session.add(Message(id=late_id, conversation_id=CONVO_ID, sender_id=SELLER_ID, text='Committed late'))
+            db.session.commit()
+        # Delivered, with the resume cursor left where it was rather than moved back.
+        assert [(event_id, message['id']) for event_id, message in read_until(chunks, 'Committed late')] == \
+            [(cursor, late_id)]
+
+        send_later(client_for(SELLER_ID), 'After the late one', delay=0.1)
+        assert [message['text'] for _, message in read_until(chunks, 'After the late one')] == ['After the late one']
+    finally:
+        response.close()
+
+    page = client_for(BUYER_ID).get(f'/conversation/{CONVO_ID}/messages?after={cursor}').get_json()
+    assert late_id in [m['id'] for m in page['messages']]  # the long-poll's re-scan finds it too
+
+
+if __name__ == "__main__":
+    test_history_pages_back_by_id()
+    test_long_poll_times_out_then_wakes_on_a_message()
+    test_messages_from_another_worker_wake_the_poll()
+    test_stream_frames_messages_and_delivers_late_commits_once()
+    print("Chat pages, long-polls, streams and late commits behave.")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Detection job checks: an upload is answered 202 with a job to poll, the job
+finishes on the pool with the diagnosis, a saturated pool answers 503 and
+records the job as failed, stuck jobs time out, and gc-uploads prunes old
+jobs along with their leaf photos.
+
+Run with: python -m pytest test_detection_jobs.py
+"""
+
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+import uploads
+from app import create_app, init_db
+from ml_model.jobs import BoundedJobPool
+from models import db, DetectionJob
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'detection_jobs.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+with app.app_context():
+    init_db()
+
+
+def use_temp_stores():
+    app.extensions['uploads'] = {'product': uploads.UploadStore('product', tempfile.mkdtemp(), thumbnails=True),
+                                 'leaf': uploads.UploadStore('leaf', tempfile.mkdtemp(), inference=True)}
+
+
+def leaf(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (400, 300), color).save(buffer, 'JPEG', quality=90)
+    buffer.seek(0)
+    return buffer
+
+
+def submit(client, color):
+    return client.post('/detect/jobs', data={'leaf_image': (leaf(color), 'leaf.jpg')},
+                       content_type='multipart/form-data')
+
+
+def poll(client, status_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        payload = client.get(status_url).get_json()
+        if payload['status'] in ('done', 'failed'):
+            return payload
+        time.sleep(0.02)
+    raise AssertionError('job did not finish')
+
+
+def test_submit_then_poll_until_done():
+    use_temp_stores()
+    client = app.test_client()
+    response = submit(client, (80, 150, 40))
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == 'queued' and job['status_url'].endswith(job['job_id'])
+    payload = poll(client, job['status_url'])
+    assert payload['status'] == 'done' and payload['prediction']['disease_name']
+    page = client.get(job['result_url']).data.decode()
+    assert payload['prediction']['disease_name'] in page
+    assert client.get('/detect/jobs/missing').status_code == 404
+    assert client.post('/detect/jobs', data={}, content_type='multipart/form-data').status_code == 400
+
+
+def test_full_pool_answers_503_and_fails_the_job():
+    use_temp_stores()
+    original = app.extensions['detection_pool']
+    release = threading.Event()
+    pool = app.extensions['detection_pool'] = BoundedJobPool(max_workers=1, max_queue=0)
+    pool.submit(release.wait, 5)  # the only slot is busy
+    try:
+        response = submit(app.test_client(), (150, 90, 40))
+        assert response.status_code == 503 and response.headers['Retry-After'] == '5'
+        assert 'try again' in response.get_json()['error']
+        with app.app_context():
+            job = DetectionJob.query.order_by(DetectionJob.created_at.desc()).first()
+            assert job.status == 'failed' and job.finished_at is not None
+    finally:
+        release.set()
+        pool.shutdown()
+        app.extensions['detection_pool'] = original
+
+
+def test_stuck_job_times_out():
+    with app.app_context():
+        job = DetectionJob(image='ab/cd/stuck.jpg', status='running',
+                           created_at=datetime.utcnow() - timedelta(seconds=app.config['DETECTION_JOB_TIMEOUT'] + 1))
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+    payload = app.test_client().get(f'/detect/jobs/{job_id}').get_json()
+    assert payload['status'] == 'failed' and payload['error'] == 'Detection timed out.'
+
+
+def test_gc_prunes_old_jobs():
+    use_temp_stores()
+    client = app.test_client()
+    job_id = submit(client, (30, 120, 90)).get_json()['job_id']
+    poll(client, f'/detect/jobs/{job_id}')
+    with app.app_context():
+        db.session.get(DetectionJob, job_id).created_at = datetime.utcnow() - timedelta(days=31)
+        db.session.commit()
+        recent = DetectionJob.query.filter(DetectionJob.created_at >= datetime.utcnow() - timedelta(days=30)).count()
+    result = app.test_cli_runner().invoke(args=['gc-uploads', '--dry-run'])
+    assert 'and 1 detection jobs' in result.output
+    result = app.test_cli_runner().invoke(args=['gc-uploads'])
+    assert 'and 1 detection jobs' in result.output
+    with app.app_context():
+        assert db.session.get(DetectionJob, job_id) is None
+        assert DetectionJob.query.count() == recent
+
+
+if __name__ == "__main__":
+    test_submit_then_poll_until_done()
+    test_full_pool_answers_503_and_fails_the_job()
+    test_stuck_job_times_out()
+    test_gc_prunes_old_jobs()
+    print("Detection jobs are queued, bounded, timed out and pruned.")
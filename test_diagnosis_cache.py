@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Diagnosis cache checks: exact SHA-256 hits from memory and from SQLite,
+near-duplicate photos found through the dHash band index, the LRU size
+bound, TTL expiry, and invalidation when the model version changes. Repeat
+uploads through /detect/jobs reach the remote model once.
+
+Run with: python -m pytest test_diagnosis_cache.py
+"""
+
+import io
+import json
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+from app import create_app, init_db
+from ml_model import predictor
+from ml_model.diagnosis_cache import DiagnosisCache, hamming, image_keys
+
+# Its own app, database and upload folders, with the real predictor (its model is faked below).
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'diagnosis_cache.sqlite'),
+                  'UPLOAD_FOLDER': tempfile.mkdtemp(), 'LEAF_UPLOAD_FOLDER': tempfile.mkdtemp(),
+                  'PREDICTOR_BACKEND': 'gemini', 'TESTING': True})
+
+with app.app_context():
+    init_db()
+
+DIAGNOSIS = {'plant_name': 'Tomato', 'disease_name': 'Tomato Late Blight',
+             'remedy_description': 'Apply a copper-based fungicide.', 'product_keyword': 'fungicide'}
+
+
+def photo(seed, brightness=1.0, quality=90):
+    """JPEG bytes of a leaf-like picture; the same seed at other brightness/quality is a near-duplicate."""
+    img = Image.new('RGB', (240, 180), (110, 90, 60))
+    draw = ImageDraw.Draw(img)
+    for i in range(6):
+        x = (seed * 37 + i * 53) % 200
+        y = (seed * 11 + i * 29) % 140
+        draw.ellipse((x, y, x + 40, y + 40), fill=(40 + i * 20, 150 - i * 10, 40))
+    img = ImageEnhance.Brightness(img).enhance(brightness)
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def keys(image_bytes):
+    c_hash, p_hash, _ = image_keys(image_bytes)
+    return c_hash, p_hash
+
+
+def new_cache(db_path=None, **options):
+    return DiagnosisCache(version=options.pop('version', 'v1'), db_path=db_path or os.path.join(tempfile.mkdtemp(), 'cache.sqlite'),
+                          enabled=True, **options)
+
+
+def test_exact_hits_from_memory_then_sqlite():
+    cache = new_cache()
+    c_hash, p_hash = keys(photo(1))
+    assert cache.get(c_hash, p_hash) is None
+    cache.put(c_hash, p_hash, DIAGNOSIS)
+    assert cache.get(c_hash, p_hash) == DIAGNOSIS
+    assert cache.stats()['memory_hits'] == 1
+
+    other_worker = new_cache(cache.db_path)  # empty LRU, same SQLite file
+    assert other_worker.get(c_hash, p_hash) == DIAGNOSIS
+    assert other_worker.stats()['persistent_hits'] == 1 and other_worker.stats()['perceptual_hits'] == 0
+
+
+def test_near_duplicates_match_through_the_band_index():
+    cache = new_cache()
+    original, retake = keys(photo(2)), keys(photo(2, brightness=1.08, quality=70))
+    assert original[0] != retake[0] and hamming(original[1], retake[1]) <= cache.max_distance
+    cache.put(*original, DIAGNOSIS)
+
+    other_worker = new_cache(cache.db_path)
+    assert other_worker.get(*retake) == DIAGNOSIS
+    assert other_worker.stats()['perceptual_hits'] == 1
+    unrelated = keys(photo(9))
+    assert hamming(original[1], unrelated[1]) > cache.max_distance
+    assert other_worker.get(*unrelated) is None
+
+
+def test_lru_is_bounded_and_sqlite_keeps_the_rest():
+    cache = new_cache(lru_size=3)
+    photos = [keys(photo(20 + i)) for i in range(5)]
+    for c_hash, p_hash in photos:
+        cache.put(c_hash, p_hash, dict(DIAGNOSIS, plant_name=c_hash))
+    assert cache.stats()['lru_entries'] == 3
+    assert list(cache._lru) == [c for c, _ in photos[2:]]
+    assert cache.get(*photos[0])['plant_name'] == photos[0][0]  # evicted from memory, found in SQLite
+    assert cache.stats()['persistent_hits'] == 1 and cache.stats()['lru_entries'] == 3
+
+
+def test_entries_expire_after_the_ttl():
+    cache = new_cache(ttl_seconds=0.2)
+    c_hash, p_hash = keys(photo(3))
+    cache.put(c_hash, p_hash, DIAGNOSIS)
+    assert cache.get(c_hash, p_hash) == DIAGNOSIS
+    time.sleep(0.3)
+    assert cache.get(c_hash, p_hash) is None
+    assert new_cache(cache.db_path).get(c_hash, p_hash) is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_model_version_change_invalidates():
+    cache = new_cache(version='v1')
+    c_hash, p_hash = keys(photo(4))
+    cache.put(c_hash, p_hash, DIAGNOSIS)
+
+    upgraded = new_cache(cache.db_path, version='v2')
+    assert upgraded.get(c_hash, p_hash) is None
+    # Opening the file under v2 dropped the v1 rows.
+    assert upgraded._db().execute("SELECT count(*) FROM diagnosis_cache WHERE version = 'v1'").fetchone()[0] == 0
+    upgraded.put(c_hash, p_hash, DIAGNOSIS)
+    upgraded.invalidate(all_versions=True)
+    assert upgraded.get(c_hash, p_hash) is None
+
+
+class FakeModel:
+    """Stands in for the Gemini client: answers every leaf with DIAGNOSIS and counts calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, parts, request_options=None):
+        self.calls += 1
+        return type('Response', (), {'text': '```json\n%s\n```' % json.dumps(DIAGNOSIS)})()
+
+
+def test_repeat_uploads_reach_the_model_once():
+    model, cache = FakeModel(), new_cache()
+    original = predictor._model, predictor.diagnosis_cache
+    predictor._model, predictor.diagnosis_cache = model, cache
+    try:
+        client = app.test_client()
+        for image in (photo(5), photo(5), photo(5, brightness=1.05, quality=75)):
+            response = client.post('/detect/jobs', data={'leaf_image': (io.BytesIO(image), 'leaf.jpg')},
+                                   content_type='multipart/form-data')
+            status_url = response.get_json()['status_url']
+            deadline = time.monotonic() + 10
+            while client.get(status_url).get_json()['status'] not in ('done', 'failed') and time.monotonic() < deadline:
+                time.sleep(0.02)
+            assert client.get(status_url).get_json()['prediction']['disease_name'] == 'Tomato Late Blight'
+        assert model.calls == 1
+        assert cache.stats()['perceptual_hits'] == 1
+    finally:
+        predictor._model, predictor.diagnosis_cache = original
+
+
+if __name__ == "__main__":
+    test_exact_hits_from_memory_then_sqlite()
+    test_near_duplicates_match_through_the_band_index()
+    test_lru_is_bounded_and_sqlite_keeps_the_rest()
+    test_entries_expire_after_the_ttl()
+    test_model_version_change_invalidates()
+    test_repeat_uploads_reach_the_model_once()
+    print("The diagnosis cache hits, near-matches, evicts, expires and invalidates as designed.")
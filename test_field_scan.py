@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Field scan checks: photos and zips are spooled to disk one image at a time,
+the image count and inflated-size limits stop a zip bomb before it is
+unpacked, duplicates are diagnosed once, published photos are already
+stripped of EXIF/GPS, and the batch deadline reports unfinished images and
+cancels the ones still queued.
+
+Run with: python -m pytest test_field_scan.py
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import zipfile
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import field_scan
+import uploads
+from app import create_app, init_db
+from field_scan import BatchError, collect_images, content_names, run_batch
+from ml_model.jobs import BoundedJobPool
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'field_scan.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+with app.app_context():
+    init_db()
+
+
+def photo(color, exif=None):
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), color).save(buffer, 'JPEG', quality=90, **({'exif': exif} if exif else {}))
+    return buffer.getvalue()
+
+
+def gps_exif():
+    exif = Image.Exif()
+    exif[0x8825] = {1: 'N', 2: (18.0, 31.0, 12.0), 3: 'E', 4: (73.0, 51.0, 3.0)}  # GPSInfo near Pune
+    return exif
+
+
+def use_temp_stores():
+    stores = {'product': uploads.UploadStore('product', tempfile.mkdtemp(), thumbnails=True),
+              'leaf': uploads.UploadStore('leaf', tempfile.mkdtemp(), inference=True)}
+    app.extensions['uploads'] = stores
+    return stores
+
+
+def zip_of(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name, data in members:
+            bundle.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def collect(archive=None, files=()):
+    spool = tempfile.mkdtemp()
+    try:
+        archive = FileStorage(stream=archive, filename='scan.zip') if archive is not None else None
+        return collect_images(list(files), archive, spool), os.listdir(spool)
+    finally:
+        shutil.rmtree(spool)
+
+
+def test_zip_bomb_is_refused_before_it_is_inflated():
+    # 120 zero-filled 1 MB members weigh about 120 KB zipped.
+    archive = zip_of((f'leaf{i}.jpg', bytes(1024 * 1024)) for i in range(120))
+    tracemalloc.start()
+    try:
+        collect(archive)
+        raise AssertionError('expected BatchError')
+    except BatchError as e:
+        assert f'at most {field_scan.BATCH_MAX_IMAGES} images' in str(e)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 8 * 1024 * 1024, peak
+
+
+def test_inflated_size_cap():
+    saved = field_scan.BATCH_MAX_INFLATED_BYTES
+    field_scan.BATCH_MAX_INFLATED_BYTES = 3 * 1024 * 1024
+    try:
+        members = [(f'leaf{i}.jpg', bytes([i]) * (1024 * 1024)) for i in range(5)]
+        try:
+            collect(zip_of(members))
+            raise AssertionError('expected BatchError')
+        except BatchError as e:
+            assert 'at most 3 MB' in str(e)
+        (unique, rejected), spooled = collect(zip_of(members[:3]))
+        assert len(unique) == 3 and not rejected and len(spooled) == 3
+    finally:
+        field_scan.BATCH_MAX_INFLATED_BYTES = saved
+
+
+def test_batch_dedupes_and_streams_results():
+    use_temp_stores()
+    green = photo((50, 150, 50))
+    archive = zip_of([('a.jpg', green), ('b.jpg', photo((150, 90, 30))), ('notes.txt', b'x'), ('empty.jpg', b'')])
+    response = app.test_client().post('/detect/batch', data={
+        'leaf_images': [(io.BytesIO(green), 'IMG_1.jpg'), (io.BytesIO(b'text'), 'readme.txt')],
+        'archive': (archive, 'scan.zip'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    accepted, results, report = lines[0], lines[1:-1], lines[-1]
+    assert accepted['unique_images'] == 3 and accepted['duplicates'] == [['IMG_1.jpg', 'a.jpg']]
+    assert [r['file'] for r in accepted['rejected']] == ['readme.txt']
+    assert len(results) == 3 and report['type'] == 'report' and report['images'] == 4
+    assert os.listdir(app.extensions['uploads']['leaf'].path(uploads.TMP_DIR)) == []
+
+
+def test_published_photos_are_normalized():
+    leaf = use_temp_stores()['leaf']
+    tagged = photo((60, 140, 60), exif=gps_exif())
+    assert Image.open(io.BytesIO(tagged)).getexif().get(0x8825)
+    response = app.test_client().post('/detect/batch', data={'leaf_images': [(io.BytesIO(tagged), 'gps.jpg')]},
+                                      content_type='multipart/form-data')
+    result = json.loads(response.data.decode().splitlines()[1])
+    name = result['image_url'].split('/uploads/leaf/', 1)[1]
+    # Published under the raw bytes' digest, but holding the normalized image.
+    assert name == uploads.content_path(hashlib.sha256(tagged).hexdigest(), 'jpg')
+    with Image.open(leaf.path(name)) as published:
+        assert not published.getexif()
+    assert os.path.exists(leaf.variant(name, 'inference')) and leaf.variant(name, 'inference') != leaf.path(name)
+
+
+class RecordingPool(BoundedJobPool):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+
+def test_deadline_reports_unfinished_and_cancels_queued_work():
+    leaf = use_temp_stores()['leaf']
+    spool = leaf.staging_dir()
+    unique = {}
+    for i in range(4):
+        path = os.path.join(spool, f'{i:04d}')
+        Image.new('RGB', (64, 64), (i * 40, 120, 40)).save(path, 'JPEG')
+        with open(path, 'rb') as f:
+            unique[hashlib.sha256(f.read()).hexdigest()] = {'path': path, 'ext': 'jpg', 'files': [f'leaf{i}.jpg']}
+    saved = content_names(unique)
+    release = threading.Event()
+
+    def slow_predict(path):
+        release.wait(5)
+        return {'disease_name': 'Healthy', 'plant_name': 'Tomato', 'product_keyword': None}
+
+    pool = RecordingPool(max_workers=1, max_queue=4)
+    try:
+        batch = run_batch(unique, saved, leaf, slow_predict, pool, deadline=0.2, concurrency=2)
+        first = next(batch)
+        assert first['status'] == 'timed_out' and 'did not finish' in first['error']
+        batch.close()  # the client went away
+        running, queued = pool.futures
+        assert queued.cancelled() and not running.cancelled()
+        assert len(pool.futures) == 2  # images past the concurrency limit were never submitted
+
+        statuses = [r['status'] for r in run_batch(unique, saved, leaf, slow_predict, pool, deadline=0.2, concurrency=2)]
+        assert statuses == ['timed_out'] * 4
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    test_zip_bomb_is_refused_before_it_is_inflated()
+    test_inflated_size_cap()
+    test_batch_dedupes_and_streams_results()
+    test_published_photos_are_normalized()
+    test_deadline_reports_unfinished_and_cancels_queued_work()
+    print("Field scans are bounded, spooled and cancelled on time.")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Store fragment cache checks: repeat store views run no queries, product writes
+invalidate the cached grid, the seller's Delete buttons stay per request, the
+shared file/SQLite tiers carry fragments and version stamps across workers and
+stay bounded, and the database change marker reaches memory-only workers.
+
+Run with: python -m pytest test_fragment_cache.py
+"""
+
+import os
+import tempfile
+
+from app import create_app, data_version, init_db
+import fragment_cache
+from fragment_cache import FileTier, FragmentCache, SQLiteTier
+from instrumentation import assert_max_queries
+from models import db, User, Product, bump_version
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'fragments.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'CacheTest'
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        sellers = [User(email=f'cache-seller{i}@example.com', mobile=f'930000000{i}', password='x', role='seller')
+                   for i in range(2)]
+        db.session.add_all(sellers)
+        db.session.flush()
+        for i in range(6):
+            db.session.add(Product(name=f'Cached sprayer {i}', category=CATEGORY, description='Battery sprayer',
+                                   price='2500', image='x.jpg', seller_id=sellers[i % 2].id))
+        db.session.commit()
+        return [s.id for s in sellers]
+
+
+SELLER_IDS = seed()
+
+
+def client_for(index=None):
+    client = app.test_client()
+    if index is not None:
+        with client.session_transaction() as sess:
+            sess['user_id'], sess['role'] = SELLER_IDS[index], 'seller'
+            sess['user_email'] = f'cache-seller{index}@example.com'
+    return client
+
+
+def store_page(client):
+    return client.get(f'/store?category={CATEGORY}').data.decode()
+
+
+def test_repeat_store_views_are_served_from_memory():
+    client = client_for()
+    first = store_page(client)
+    assert first.count('card-title">Cached sprayer') == 6
+    with assert_max_queries(0):
+        assert store_page(client) == first
+    # Another filter is another fragment.
+    with assert_max_queries(2):
+        client.get(f'/store?category={CATEGORY}&sort=price_asc')
+
+
+def test_owner_actions_rendered_per_request():
+    pages = [store_page(client_for(i)) for i in range(2)]
+    assert all(page.count('>Delete</button>') == 3 for page in pages)
+    with app.app_context():
+        own = Product.query.filter_by(category=CATEGORY, seller_id=SELLER_IDS[0]).first().id
+    assert f'/delete_product/{own}"' in pages[0] and f'/delete_product/{own}"' not in pages[1]
+    assert '>Delete</button>' not in store_page(client_for()) and 'owner-actions' not in pages[0]
+
+
+def test_product_delete_invalidates_grid():
+    client = client_for(1)
+    assert store_page(client).count('card-title">Cached sprayer') == 6
+    with app.app_context():
+        product_id = Product.query.filter_by(category=CATEGORY, seller_id=SELLER_IDS[1]).first().id
+    assert client.post(f'/delete_product/{product_id}').status_code == 302
+    page = store_page(client)
+    assert page.count('card-title">Cached sprayer') == 5 and f'/delete_product/{product_id}"' not in page
+    assert store_page(client_for()).count('card-title">Cached sprayer') == 5  # every role and key sees the new stamp
+
+
+def test_shared_tiers_cross_workers():
+    for make_tier in (lambda d: FileTier(os.path.join(d, 'fragments')),
+                      lambda d: SQLiteTier(os.path.join(d, 'fragments.sqlite'))):
+        now = [0.0]
+        shared = make_tier(tempfile.mkdtemp())
+        worker_a = FragmentCache(shared=shared, version_check=1.0, clock=lambda: now[0])
+        worker_b = FragmentCache(shared=shared, version_check=1.0, clock=lambda: now[0])
+        worker_a.set('catalog', ['Seeds', 1], {'html': 'v1'})
+        assert worker_b.get('catalog', ['Seeds', 1]) == {'html': 'v1'}  # rendered once for both
+        assert worker_b.shared_hits == 1
+
+        worker_a.bump('catalog')
+        assert worker_a.get('catalog', ['Seeds', 1]) is None
+        assert worker_b.get('catalog', ['Seeds', 1]) == {'html': 'v1'}  # trusts its stamp for version_check
+        now[0] = 1.5
+        assert worker_b.get('catalog', ['Seeds', 1]) is None
+
+
+def test_database_marker_reaches_memory_only_workers():
+    # Two gunicorn workers: separate memory caches, one database.
+    now = [0.0]
+    other_worker = FragmentCache(version_check=1.0, version_source=data_version, clock=lambda: now[0])
+    with app.app_context():
+        other_worker.set('catalog', ['Seeds', 1], {'html': 'v1'})
+        bump_version('catalog')  # a product written through the first worker
+        db.session.commit()
+        assert other_worker.get('catalog', ['Seeds', 1]) == {'html': 'v1'}  # trusts its marker for version_check
+        now[0] = 1.5
+        assert other_worker.get('catalog', ['Seeds', 1]) is None
+
+
+def test_junk_cursors_share_the_first_page():
+    client = client_for()
+    store_page(client)
+    with assert_max_queries(0):
+        for junk in ('x', 'abc:def', '1.5:zz', ''):
+            client.get(f'/store?category={CATEGORY}&after={junk}')
+        client.get(f'/store?category={CATEGORY}&search=')
+
+
+def test_shared_tiers_are_bounded():
+    for make_tier in (lambda d: FileTier(os.path.join(d, 'fragments'), max_entries=10),
+                      lambda d: SQLiteTier(os.path.join(d, 'fragments.sqlite'), max_entries=10)):
+        shared = make_tier(tempfile.mkdtemp())
+        cache = FragmentCache(max_entries=0, shared=shared)
+        for i in range(fragment_cache.PRUNE_EVERY):
+            cache.set('catalog', ['junk', i], {'html': str(i)})
+        last = fragment_cache.PRUNE_EVERY - 1
+        assert cache.get('catalog', ['junk', last]) == {'html': str(last)}
+        assert sum(cache.get('catalog', ['junk', i]) is not None for i in range(last + 1)) == 10
+
+
+def test_lru_tier_is_bounded():
+    cache = FragmentCache(max_entries=2)
+    for i in range(3):
+        cache.set('catalog', [i], {'html': str(i)})
+    assert cache.get('catalog', [0]) is None
+    assert cache.get('catalog', [2]) == {'html': '2'}
+    assert FragmentCache(max_entries=0).get_or_render('catalog', [1], lambda: 'fresh') == 'fresh'
+
+
+if __name__ == "__main__":
+    test_repeat_store_views_are_served_from_memory()
+    test_owner_actions_rendered_per_request()
+    test_product_delete_invalidates_grid()
+    test_shared_tiers_cross_workers()
+    test_database_marker_reaches_memory_only_workers()
+    test_junk_cursors_share_the_first_page()
+    test_shared_tiers_are_bounded()
+    test_lru_tier_is_bounded()
+    print("Store fragments are cached and invalidated on product writes.")
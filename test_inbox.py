@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Inbox summary checks: Conversation.add_message keeps the last-message
+columns and the other participant's unread count current, mark_read clears
+only the reader's count, and the inbox lists conversations newest first from
+those columns alone.
+
+Run with: python -m pytest test_inbox.py
+"""
+
+import os
+import tempfile
+
+from app import create_app, get_inbox_conversations, init_db
+from models import db, User, Product, Conversation
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'inbox.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        seller = User(email='inbox-seller@example.com', mobile='9600000301', password='x', role='seller')
+        buyer = User(email='inbox-buyer@example.com', mobile='9600000302', password='x', role='customer')
+        db.session.add_all([seller, buyer])
+        db.session.flush()
+        products = [Product(name=f'Inbox tiller {i}', category='InboxTest', description='Power tiller',
+                            price='85000', image='x.jpg', seller_id=seller.id) for i in range(2)]
+        db.session.add_all(products)
+        db.session.flush()
+        convos = [Conversation(product_id=p.id, buyer_id=buyer.id, seller_id=seller.id) for p in products]
+        db.session.add_all(convos)
+        db.session.commit()
+        return seller.id, buyer.id, [c.id for c in convos]
+
+
+SELLER_ID, BUYER_ID, (FIRST_ID, SECOND_ID) = seed()
+
+
+def unread(convo_id):
+    with app.app_context():
+        convo = db.session.get(Conversation, convo_id)
+        return convo.buyer_unread, convo.seller_unread
+
+
+def test_add_message_updates_summary_and_unread_counts():
+    with app.app_context():
+        convo = db.session.get(Conversation, FIRST_ID)
+        convo.add_message(BUYER_ID, 'Is the tiller still available?')
+        convo.add_message(BUYER_ID, 'Can you deliver to Nashik?')  # same transaction: both count
+        db.session.commit()
+    assert unread(FIRST_ID) == (0, 2)
+
+    with app.app_context():
+        convo = db.session.get(Conversation, FIRST_ID)
+        message = convo.add_message(SELLER_ID, 'Yes, delivery is free over 50 km. ' * 10)
+        db.session.commit()
+        convo = db.session.get(Conversation, FIRST_ID)
+        assert convo.last_message_text == message.text[:200]
+        assert convo.last_message_at == message.timestamp and convo.last_sender_id == SELLER_ID
+        assert (convo.buyer_unread, convo.seller_unread) == (1, 2)
+
+
+def test_mark_read_clears_only_the_readers_count():
+    with app.app_context():
+        convo = db.session.get(Conversation, SECOND_ID)
+        convo.add_message(BUYER_ID, 'What is the warranty?')
+        db.session.commit()
+        assert not convo.mark_read(BUYER_ID)  # nothing unread for the sender
+        assert convo.mark_read(SELLER_ID)
+        db.session.commit()
+    assert unread(SECOND_ID) == (0, 0)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['role'] = BUYER_ID, 'customer'
+    response = client.post(f'/conversation/{SECOND_ID}/messages', json={'message_text': 'Thanks!'})
+    assert response.status_code == 201
+    with app.app_context():
+        convo = db.session.get(Conversation, SECOND_ID)
+        convo.add_message(SELLER_ID, 'Two years.')
+        db.session.commit()
+    assert unread(SECOND_ID) == (1, 1)
+    assert client.get(f'/conversation/chat/{SECOND_ID}').status_code == 200  # the buyer opens it
+    assert unread(SECOND_ID) == (0, 1)
+
+
+def test_inbox_lists_newest_conversation_first():
+    with app.app_context():
+        convo = db.session.get(Conversation, FIRST_ID)
+        convo.add_message(SELLER_ID, 'Price is negotiable.')
+        db.session.commit()
+        rows = get_inbox_conversations(BUYER_ID)
+        assert [r.id for r in rows] == [FIRST_ID, SECOND_ID]
+        assert rows[0].last_message_text == 'Price is negotiable.'
+        assert rows[0].product_name == 'Inbox tiller 0' and rows[0].seller_email == 'inbox-seller@example.com'
+        assert (rows[0].buyer_unread, rows[1].buyer_unread) == (2, 0)
+
+
+if __name__ == "__main__":
+    test_add_message_updates_summary_and_unread_counts()
+    test_mark_read_clears_only_the_readers_count()
+    test_inbox_lists_newest_conversation_first()
+    print("Conversation summaries and unread counts stay current.")
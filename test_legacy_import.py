@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Legacy import checks: the JSON files are read incrementally, emails resolve
+to users across case variants, missing or taken mobiles get placeholders,
+conversations land with their messages, and a second run inserts nothing.
+
+Run with: python -m pytest test_legacy_import.py
+"""
+
+import json
+import os
+import tempfile
+
+from app import create_app, init_db
+from models import db, User, Product, Conversation, Message
+from scripts.legacy_import import LegacyImporter, iter_json_array, mobile_placeholder
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'legacy.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'LegacyTest'
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        db.session.add(User(email='legacy-existing@example.com', mobile='9100000001', password='x', role='customer'))
+        db.session.commit()
+
+
+seed()
+
+
+def write_json(directory, name, value):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        json.dump(value, f, indent=4, ensure_ascii=False)
+
+
+def user(email):
+    return User.query.filter(db.func.lower(User.email) == email.lower()).one()
+
+
+def test_reader_streams_across_chunk_boundaries():
+    directory = tempfile.mkdtemp()
+    records = [{'id': i, 'text': 'नमस्ते ' * i, 'price': 1234.5 * i, 'tags': [i, None, True]} for i in range(40)]
+    records.append(12345678)
+    write_json(directory, 'records.json', records)
+    path = os.path.join(directory, 'records.json')
+    for chunk_size in (1, 7, 4096):
+        assert list(iter_json_array(path, chunk_size=chunk_size)) == records
+
+    write_json(directory, 'empty.json', [])
+    assert list(iter_json_array(os.path.join(directory, 'empty.json'))) == []
+    for name, content in (('object.json', '{"id": 1}'), ('truncated.json', '[{"id": 1}, {"id"')):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
+        try:
+            list(iter_json_array(os.path.join(directory, name), chunk_size=4))
+            raise AssertionError(f'expected {name} to be rejected')
+        except ValueError:
+            pass
+
+
+def test_imports_shipped_data_once():
+    runner = app.test_cli_runner()
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    result = runner.invoke(args=['import-legacy', '--data-dir', data_dir])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 3 users from 4 records (1 merged' in result.output and 'rows/sec' in result.output
+
+    with app.app_context():
+        deepraj, abhiraj = user('deeprajabhang@gmail.com'), user('abhiraj@gmail.com')
+        assert deepraj.email == 'deeprajabhang@gmail.com' and deepraj.mobile == '9503516340'  # from the case variant
+        assert abhiraj.mobile == mobile_placeholder('abhiraj@gmail.com')
+        product = Product.query.filter_by(seller_id=deepraj.id).one()
+        assert product.price_amount == 15000
+        convo = Conversation.query.filter_by(product_id=product.id, buyer_id=abhiraj.id).one()
+        texts = [m.text for m in convo.messages]
+        assert texts[0] == 'hello, i am intrested in your offer' and len(texts) == 3
+        assert convo.last_sender_id == deepraj.id and convo.last_message_text == texts[-1]
+        # 11:24 IST, stored as UTC.
+        assert convo.last_message_at.strftime('%Y-%m-%d %H:%M') == '2025-08-31 05:54'
+        assert (convo.buyer_unread, convo.seller_unread) == (0, 0)
+
+    again = runner.invoke(args=['import-legacy', '--data-dir', data_dir])
+    assert again.output.count('Imported 0 ') == 3, again.output
+
+
+def test_large_dump_in_small_batches():
+    directory = tempfile.mkdtemp()
+    users = [{'id': 1000 + i, 'email': f'grower{i}@legacy.example', 'password': 'scrypt:legacy',
+              'role': 'seller' if i < 5 else 'customer', **({'mobile': f'92{i:08d}'} if i % 2 else {})}
+             for i in range(150)]
+    users += [
+        {'id': 2000, 'email': 'GROWER0@legacy.example', 'mobile': '9399999999', 'password': 'other', 'role': 'seller'},
+        {'id': 2001, 'email': 'clash@legacy.example', 'mobile': '9100000001', 'password': 'x', 'role': 'customer'},
+        {'id': 2002, 'email': 'Legacy-Existing@example.com', 'password': 'x', 'role': 'customer'},
+        {'id': 2003, 'email': '', 'password': 'x', 'role': 'customer'},
+    ]
+    products = [{'id': f'L{i}', 'name': f'Legacy sprayer {i}', 'category': CATEGORY, 'description': 'Used',
+                 'price': f'{100 + i}/piece', 'image': 'sprayer.jpg', 'seller': f'grower{i % 5}@legacy.example'}
+                for i in range(20)]
+    products.append({'id': 'L-orphan', 'name': 'No seller', 'price': '1', 'seller': 'nobody@legacy.example'})
+    conversations = []
+    for c in range(60):
+        seller, buyer = f'grower{c % 5}@legacy.example', f'GROWER{5 + c}@legacy.example'
+        conversations.append({'id': f'L{c}', 'product_id': f'L{c % 20}', 'participants': [buyer, seller], 'messages': [
+            {'sender': (buyer, seller)[m % 2], 'text': f'message {m}', 'timestamp': f'2025-09-{1 + m:02d} 10:00'}
+            for m in range(6)]})
+    conversations[0]['messages'].append({'sender': 'stranger@legacy.example', 'text': 'spam', 'timestamp': '2025-09-20 10:00'})
+    conversations.append({'id': 'L-lost', 'product_id': 'L-missing', 'participants': [], 'messages': []})
+    write_json(directory, 'users.json', users)
+    write_json(directory, 'products.json', products)
+    write_json(directory, 'messages.json', conversations)
+
+    with app.app_context():
+        results = LegacyImporter(batch_size=16).import_files(directory, chunk_size=256)
+        assert {k: (s['inserted'], s['merged'], s['existing'], s['skipped']) for k, s in results.items()} == {
+            'users': (151, 1, 1, 1), 'products': (20, 0, 0, 1), 'conversations': (60, 0, 0, 1)}
+        assert (results['conversations']['messages'], results['conversations']['skipped_messages']) == (360, 1)
+        # The variant came after grower0's batch was written, so its mobile is filled in afterwards.
+        assert user('grower0@legacy.example').mobile == '9399999999'
+        assert user('clash@legacy.example').mobile == mobile_placeholder('clash@legacy.example')
+        assert user('legacy-existing@example.com').mobile == '9100000001'
+        seller = user('grower3@legacy.example')
+        assert Product.query.filter_by(seller_id=seller.id).count() == 4
+        convo = Conversation.query.filter_by(buyer_id=user('grower8@legacy.example').id).one()
+        assert convo.seller_id == seller.id and convo.last_message_text == 'message 5'
+        assert Message.query.filter_by(conversation_id=convo.id).count() == 6
+
+        again = LegacyImporter(batch_size=16).import_files(directory, chunk_size=256)
+        assert [s['inserted'] for s in again.values()] == [0, 0, 0]
+        assert Conversation.query.filter(Conversation.buyer_id.in_(
+            db.session.query(User.id).filter(User.email.like('%@legacy.example')))).count() == 60
+
+
+if __name__ == "__main__":
+    test_reader_streams_across_chunk_boundaries()
+    test_imports_shipped_data_once()
+    test_large_dump_in_small_batches()
+    print("Legacy JSON imports stream, merge and re-run cleanly.")
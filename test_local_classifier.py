@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Local classifier checks: confident answers are served locally, while
+ambiguous photos, photos unlike the training set and classifier errors all
+fall back to the remote model. Remedy text with anything but Latin or
+Devanagari in it is refused on load.
+
+Run with: python -m pytest test_local_classifier.py
+"""
+
+import json
+import os
+import random
+import tempfile
+
+from PIL import Image, ImageDraw
+
+from ml_model import local_classifier
+from ml_model.local_classifier import LocalClassifier, image_features, local_first
+from ml_model.remedies import load_remedies
+
+
+def leaf(seed, spots=0):
+    """A green leaf on soil, with `spots` brown lesions."""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (160, 160), (120, 95, 70))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((20, 10, 140, 150), fill=(50 + rng.randint(-8, 8), 140 + rng.randint(-10, 10), 45))
+    for _ in range(spots):
+        x, y = rng.randint(45, 110), rng.randint(35, 120)
+        r = rng.randint(4, 8)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(110, 70, 30))
+    return img
+
+
+def save(img):
+    path = os.path.join(tempfile.mkdtemp(), 'leaf.jpg')
+    img.save(path, 'JPEG', quality=95)
+    return path
+
+
+CLASSIFIER = LocalClassifier.fit(
+    [image_features(save(leaf(i))) for i in range(12)] + [image_features(save(leaf(100 + i, spots=12))) for i in range(12)],
+    ['Healthy'] * 12 + ['Tomato Bacterial Spot'] * 12,
+)
+# The same healthy leaves under two labels: every neighbourhood is a split vote.
+AMBIGUOUS = LocalClassifier.fit([image_features(save(leaf(i))) for i in range(12)],
+                                ['Healthy', 'Tomato Late Blight'] * 6)
+
+
+def predictor(threshold=None):
+    calls = []
+
+    def remote(image_path):
+        calls.append(image_path)
+        return {'disease_name': 'Remote answer', 'source': 'remote'}
+    return local_first(remote, threshold=threshold), calls
+
+
+def with_classifier(classifier, test):
+    original = local_classifier._classifier
+    local_classifier._classifier = classifier
+    try:
+        test()
+    finally:
+        local_classifier._classifier = original
+
+
+def test_confident_answers_skip_the_remote_model():
+    def check():
+        predict, calls = predictor(threshold=0.85)
+        result = predict(save(leaf(7, spots=12)))
+        assert result['source'] == 'local' and result['disease_name'] == 'Tomato Bacterial Spot'
+        assert result['confidence'] >= 0.85 and result['remedy_description']
+        assert calls == []
+    with_classifier(CLASSIFIER, check)
+
+
+def test_low_confidence_falls_back_to_remote():
+    path = save(leaf(30))
+
+    def split_vote():
+        label, confidence = AMBIGUOUS.classify(image_features(path))
+        assert 0 < confidence < local_classifier.CONFIDENCE_THRESHOLD
+        predict, calls = predictor()
+        assert predict(path)['source'] == 'remote' and calls == [path]
+        predict, calls = predictor(threshold=confidence)
+        assert predict(path)['source'] == 'local' and calls == []
+    with_classifier(AMBIGUOUS, split_vote)
+
+    def unfamiliar():
+        predict, calls = predictor(threshold=0.5)
+        noise = save(Image.effect_noise((160, 160), 120).convert('RGB'))
+        assert predict(noise)['source'] == 'remote' and calls == [noise]  # nothing like the training photos
+    with_classifier(CLASSIFIER, unfamiliar)
+
+
+def test_classifier_errors_fall_back_to_remote():
+    def check():
+        predict, calls = predictor(threshold=0.0)
+        path = os.path.join(tempfile.mkdtemp(), 'not-an-image.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'not an image')
+        assert predict(path)['source'] == 'remote' and calls == [path]
+    with_classifier(CLASSIFIER, check)
+
+
+def test_remedy_text_is_checked_on_load():
+    remedies = load_remedies()
+    assert set(local_classifier.REMEDIES) == set(remedies)
+    path = os.path.join(tempfile.mkdtemp(), 'remedies.json')
+    for description, valid in (('Spray neem oil – ₹250 per litre, “weekly”.', True),
+                               ('नीम का तेल छिड़कें।', True),
+                               ('Spray fungicide极速飞艇开奖直播 weekly.', False)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'Leaf Spot': {'description': description, 'product_keyword': None}}, f, ensure_ascii=False)
+        try:
+            assert load_remedies(path)['Leaf Spot']['description'] == description and valid
+        except ValueError as e:
+            assert not valid and "'Leaf Spot'" in str(e)
+
+
+if __name__ == "__main__":
+    test_confident_answers_skip_the_remote_model()
+    test_low_confidence_falls_back_to_remote()
+    test_classifier_errors_fall_back_to_remote()
+    test_remedy_text_is_checked_on_load()
+    print("The local classifier answers when confident and defers to the remote model otherwise.")
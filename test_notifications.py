@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Notification dispatcher checks against local stand-ins: a minimal SMTP server
+and the fake Fast2SMS endpoint from sms_utils_mock. Verifies connection reuse,
+bulkV2 coalescing, retry/backoff and the forgot-password flow end to end.
+
+Run with: python -m pytest test_notifications.py
+"""
+
+import os
+import re
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from werkzeug.security import check_password_hash
+
+from app import create_app, init_db
+from models import db, User, Notification
+from notifications import get_dispatcher
+from sms_utils_mock import FakeFast2SMSServer
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'notifications.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+dispatcher = app.extensions['notifications']
+
+
+# --- Local SMTP stand-in ---
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Just enough SMTP for smtplib: records (mail_from, rcpt_to, data) and counts connections."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.reject = set()  # recipients answered with 550
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                fake.connections += 1
+                self.reply('220 fake-smtp ready')
+                mail_from, rcpt_to = None, []
+                while True:
+                    line = self.rfile.readline().decode().rstrip('\r\n')
+                    if not line:
+                        return
+                    verb = line.split(' ', 1)[0].upper()
+                    if verb in ('EHLO', 'HELO'):
+                        self.reply('250 fake-smtp')
+                    elif verb == 'MAIL':
+                        mail_from, rcpt_to = line.split(':', 1)[1].strip(' <>'), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        address = line.split(':', 1)[1].strip(' <>')
+                        if address in fake.reject:
+                            self.reply('550 No such user')
+                        else:
+                            rcpt_to.append(address)
+                            self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = []
+                        while True:
+                            chunk = self.rfile.readline().decode()
+                            if chunk.rstrip('\r\n') == '.':
+                                break
+                            data.append(chunk)
+                        fake.messages.append((mail_from, rcpt_to, ''.join(data)))
+                        self.reply('250 Queued')
+                    elif verb in ('NOOP', 'RSET'):
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Not implemented')
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.serve_forever, name='fake-smtp', daemon=True).start()
+
+
+SMTP = FakeSMTPServer()
+SMS = FakeFast2SMSServer(api_key='test-key').start()
+
+app.config.update(
+    NOTIFY_EMAIL_WORKERS=0, NOTIFY_SMS_WORKERS=0, NOTIFY_POLL_INTERVAL=0.05,
+    NOTIFY_MAIL_SENDER='noreply@krishimitra.test', SMTP_HOST='127.0.0.1', SMTP_PORT=SMTP.server_address[1],
+    SMTP_SECURITY='none', SMTP_USERNAME=None, SMTP_PASSWORD=None,
+    FAST2SMS_URL=SMS.url, FAST2SMS_API_KEY='test-key',
+)
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        user = User(email='notify-farmer@example.com', mobile='+91 91000 00001', password='x', role='customer')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+USER_ID = seed()
+
+
+def reset_fakes():
+    SMTP.messages.clear()
+    SMTP.connections = 0
+    SMS.calls.clear()
+    SMS.connections = 0
+    for metrics in dispatcher.metrics.values():
+        metrics.reset()
+
+
+def test_emails_share_one_smtp_session():
+    reset_fakes()
+    with app.app_context():
+        user = db.session.get(User, USER_ID)
+        for otp in ('111111', '222222', '333333', '444444', '555555'):
+            dispatcher.send_otp(user, otp)
+        assert dispatcher.drain(['email']) == 5
+        assert len(SMTP.messages) == 5
+        assert SMTP.connections == 1
+        assert SMTP.messages[0][1] == ['notify-farmer@example.com']
+        rows = Notification.query.filter_by(channel='email').all()
+        assert {r.status for r in rows} == {'sent'}
+        assert all(r.body == '' for r in rows)  # delivered OTPs are not kept
+        dispatcher.drain(['sms'])
+
+
+def test_identical_sms_coalesce_into_bulk_calls():
+    reset_fakes()
+    with app.app_context():
+        for i in range(130):
+            dispatcher.enqueue_sms(f'98{i:08d}', 'Mandi prices updated: onion up 6%.')
+        dispatcher.enqueue_sms('9811111111', 'Your OTP for password reset is: 123456. Valid for 10 minutes.')
+        assert dispatcher.enqueue_sms('12345', 'too short') is None
+        app.config['NOTIFY_BATCH_SIZE'] = 200
+        try:
+            assert dispatcher.drain(['sms']) == 131
+        finally:
+            app.config['NOTIFY_BATCH_SIZE'] = 50
+        # 130 identical messages -> 2 bulkV2 calls (100 numbers max each), plus the OTP on its own.
+        assert sorted(len(c['numbers']) for c in SMS.calls) == [1, 30, 100]
+        assert len(set(SMS.sent_to())) == 131
+        assert SMS.connections <= 1  # three calls, at most one new connection: the keep-alive session is reused
+        stats = dispatcher.stats()['sms']
+        assert stats['sent'] == 131 and stats['calls'] == 3 and stats['messages_per_call'] > 40
+
+
+def test_failed_sends_retry_with_backoff():
+    reset_fakes()
+    with app.app_context():
+        row = dispatcher.enqueue_sms('9822222222', 'retry me')
+        SMS.fail_next(2, status=503)
+        dispatcher.run_once('sms')
+        db.session.refresh(row)
+        assert (row.status, row.attempts) == ('queued', 1)
+        first_delay = (row.next_attempt_at - datetime.utcnow()).total_seconds()
+        assert 3 < first_delay < 7  # NOTIFY_BACKOFF_SECONDS (5s) with jitter
+        assert dispatcher.run_once('sms') == 0  # not due yet
+
+        row.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        dispatcher.run_once('sms')
+        db.session.refresh(row)
+        assert (row.status, row.attempts) == ('queued', 2)
+        assert (row.next_attempt_at - datetime.utcnow()).total_seconds() > first_delay  # doubled
+
+        row.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        dispatcher.drain(['sms'])
+        db.session.refresh(row)
+        assert (row.status, row.attempts, row.last_error) == ('sent', 3, None)
+        assert dispatcher.stats()['sms']['retried'] == 2
+
+
+def test_permanent_errors_are_not_retried():
+    reset_fakes()
+    with app.app_context():
+        SMTP.reject.add('gone@example.com')
+        try:
+            email = dispatcher.send_otp(User(email='gone@example.com', mobile=None), '999999')[0]
+            dispatcher.drain(['email'])
+        finally:
+            SMTP.reject.clear()
+        sms = dispatcher.enqueue_sms('9833333333', 'bad key')
+        SMS.fail_next(1, status=401)
+        dispatcher.drain(['sms'])
+        for row in (email, sms):
+            db.session.refresh(row)
+            assert (row.status, row.attempts) == ('failed', 1)
+            assert row.last_error
+
+
+def test_forgot_password_otp_delivered_by_background_workers():
+    reset_fakes()
+    app.config.update(NOTIFY_EMAIL_WORKERS=1, NOTIFY_SMS_WORKERS=1)
+    client = app.test_client()
+    try:
+        response = client.post('/forgot_password', data={'email': 'notify-farmer@example.com'})
+        assert response.status_code == 302 and response.headers['Location'].endswith('/verify_otp')
+        deadline = time.monotonic() + 10
+        while (not SMS.calls or not SMTP.messages) and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        dispatcher.stop()
+        app.config.update(NOTIFY_EMAIL_WORKERS=0, NOTIFY_SMS_WORKERS=0)
+    assert SMS.calls[0]['numbers'] == ['9100000001']
+    otp = re.search(r'is: (\d{6})', SMS.calls[0]['message']).group(1)
+    assert SMTP.messages[0][1] == ['notify-farmer@example.com']
+
+    response = client.post('/verify_otp', data={'otp': '000000' if otp != '000000' else '111111',
+                                                'new_password': 'new-pass', 'confirm_password': 'new-pass'})
+    assert response.headers['Location'].endswith('/verify_otp')
+    response = client.post('/verify_otp', data={'otp': otp, 'new_password': 'new-pass', 'confirm_password': 'new-pass'})
+    assert response.headers['Location'].endswith('/login')
+    with app.app_context():
+        assert check_password_hash(db.session.get(User, USER_ID).password, 'new-pass')
+
+    stats = client.get('/_stats/notifications').get_json()
+    assert stats['email']['sent'] == 1 and stats['sms']['sent'] == 1
+
+
+def test_each_app_has_its_own_dispatcher():
+    other = create_app({'TESTING': True, 'NOTIFY_EMAIL_WORKERS': 0, 'NOTIFY_SMS_WORKERS': 0, 'NOTIFY_BATCH_SIZE': 7})
+    theirs = other.extensions['notifications']
+    # Building another app doesn't re-point this app's workers at it.
+    assert theirs is not dispatcher and dispatcher.app is app and theirs.app is other
+    with other.app_context():
+        assert get_dispatcher() is theirs and get_dispatcher().app.config['NOTIFY_BATCH_SIZE'] == 7
+    with app.app_context():
+        assert get_dispatcher() is dispatcher and dispatcher.app.config['NOTIFY_BATCH_SIZE'] == 50
+
+
+if __name__ == "__main__":
+    test_emails_share_one_smtp_session()
+    test_identical_sms_coalesce_into_bulk_calls()
+    test_failed_sends_retry_with_backoff()
+    test_permanent_errors_are_not_retried()
+    test_forgot_password_otp_delivered_by_background_workers()
+    test_each_app_has_its_own_dispatcher()
+    print("Notifications are queued, batched and retried.")
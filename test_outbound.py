@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Outbound call checks against local stand-ins for Gemini, data.gov.in,
+Fast2SMS and SMTP: deadlines are enforced, latency/error/timeout counters
+move, and a tripped circuit breaker answers with the existing fallback
+without calling the upstream, until a trial call succeeds.
+
+Run with: python -m pytest test_outbound.py
+"""
+
+import json
+import os
+import smtplib
+import socketserver
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Read when the price scraper is imported: a throwaway price snapshot.
+os.environ.setdefault('PRICE_SNAPSHOT_PATH', os.path.join(tempfile.mkdtemp(), 'market_prices.json'))
+
+from PIL import Image
+
+import outbound
+from app import create_app
+from email_utils import SMTPConnection, smtp
+from ml_model import predictor
+from scripts import price_scraper
+from scripts.price_api_mock import FakeDataGovServer
+from sms_utils import Fast2SMSClient, SMSError, fast2sms
+from sms_utils_mock import FakeFast2SMSServer
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'outbound.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+
+# --- Local stand-ins ---
+class FakeGeminiServer:
+    """Answers generateContent with a fixed diagnosis after `delay` seconds; counts calls."""
+
+    DIAGNOSIS = {'plant_name': 'Tomato', 'disease_name': 'Early Blight',
+                 'remedy_description': 'Remove affected leaves.', 'product_keyword': 'fungicide'}
+
+    def __init__(self):
+        self.delay = 0.0
+        self.calls = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                fake.calls += 1
+                time.sleep(fake.delay)
+                text = json.dumps(fake.DIAGNOSIS)
+                data = json.dumps({'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]},
+                                                   'finishReason': 'STOP', 'index': 0}]}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # the client gave up waiting
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-gemini', daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+
+class SilentSMTPServer(socketserver.ThreadingTCPServer):
+    """Accepts connections and never sends the greeting, like a hung mail server."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.connections = 0
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                fake.connections += 1
+                self.request.recv(1)  # until the client hangs up
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.serve_forever, name='silent-smtp', daemon=True).start()
+
+
+GEMINI = FakeGeminiServer()
+PRICES = FakeDataGovServer().start()
+SMS = FakeFast2SMSServer(api_key='test-key').start()
+SMTP = SilentSMTPServer()
+
+
+@contextmanager
+def isolated(dep, timeout, failure_threshold=2, reset_timeout=60):
+    """Runs with a clean dependency and test-sized deadline/breaker settings, restoring them afterwards."""
+    saved = dep.timeout, dep.breaker.failure_threshold, dep.breaker.reset_timeout
+    dep.reset()
+    dep.timeout, dep.breaker.failure_threshold, dep.breaker.reset_timeout = timeout, failure_threshold, reset_timeout
+    try:
+        yield dep
+    finally:
+        dep.timeout, dep.breaker.failure_threshold, dep.breaker.reset_timeout = saved
+        dep.reset()
+
+
+def leaf_path():
+    path = os.path.join(tempfile.mkdtemp(), 'leaf.jpg')
+    Image.new('RGB', (64, 64), (60, 130, 40)).save(path)
+    return path
+
+
+def test_breaker_and_histogram():
+    now = [0.0]
+    dep = outbound.Dependency('fake', timeout=1.0, failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    for seconds in (0.004, 0.02, 0.02, 0.3):
+        dep.latency.observe(seconds)
+    snapshot = dep.latency.snapshot()
+    assert (snapshot['count'], snapshot['p50_ms'], snapshot['p99_ms']) == (4, 25.0, 300.0)
+    assert snapshot['buckets']['le_5ms'] == 1 and snapshot['buckets']['le_25ms'] == 2
+
+    for _ in range(2):
+        try:
+            with dep.guard():
+                raise ConnectionError('refused')
+        except ConnectionError:
+            pass
+    assert dep.breaker.state == 'open'
+    try:
+        with dep.guard():
+            raise AssertionError('body must not run while open')
+    except outbound.CircuitOpenError:
+        pass
+    now[0] = 10.0
+    with dep.guard():
+        pass  # the half-open trial
+    stats = dep.snapshot()
+    assert (stats['circuit'], stats['calls'], stats['errors'], stats['short_circuits']) == ('closed', 3, 2, 1)
+
+
+def test_price_timeouts_open_breaker_and_keep_last_good_prices():
+    os.environ['DATA_GOV_API_KEY'] = 'test-key'
+    saved = price_scraper.RESOURCE_URL, price_scraper.SNAPSHOT_PATH, dict(price_scraper._cache)
+    price_scraper.RESOURCE_URL = PRICES.url
+    price_scraper.SNAPSHOT_PATH = os.path.join(tempfile.mkdtemp(), 'market_prices.json')
+    try:
+        with isolated(price_scraper.data_gov, timeout=0.2, reset_timeout=0.3) as dep:
+            PRICES.delay = 0.5
+            for _ in range(2):
+                assert price_scraper.refresh_market_prices() is False
+            assert (dep.timeouts, dep.breaker.state) == (2, 'open')
+
+            calls = len(PRICES.calls)
+            started = time.perf_counter()
+            assert price_scraper.refresh_market_prices() is False
+            assert time.perf_counter() - started < 0.05 and len(PRICES.calls) == calls
+            assert dep.short_circuits == 1
+
+            PRICES.delay = 0.0
+            time.sleep(0.35)
+            assert price_scraper.refresh_market_prices() is True
+            assert dep.breaker.state == 'closed' and price_scraper._cache['records']
+    finally:
+        PRICES.delay = 0.0
+        price_scraper.RESOURCE_URL, price_scraper.SNAPSHOT_PATH = saved[:2]
+        with price_scraper._cache_lock:
+            price_scraper._cache.update(saved[2])
+
+
+def test_price_revalidation_is_single_flight():
+    calls, release = [], threading.Event()
+    original = price_scraper.refresh_market_prices
+
+    def slow_refresh():
+        calls.append(threading.current_thread().name)
+        release.wait(5)
+        return True
+
+    price_scraper.refresh_market_prices = slow_refresh
+    try:
+        barrier = threading.Barrier(8)
+
+        def stale_request():
+            barrier.wait()
+            price_scraper._refresh_in_background()
+
+        requests = [threading.Thread(target=stale_request) for _ in range(8)]
+        for thread in requests:
+            thread.start()
+        for thread in requests:
+            thread.join(5)
+        release.set()
+        assert price_scraper._refreshing.acquire(timeout=5)  # the one revalidation finished
+        price_scraper._refreshing.release()
+        assert calls == ['price-revalidate']
+    finally:
+        price_scraper.refresh_market_prices = original
+
+
+def test_gemini_deadline_falls_back_to_prediction_error():
+    os.environ.update(GEMINI_API_KEY='test-key', GEMINI_API_ENDPOINT=GEMINI.url)
+    predictor._model = None
+    cache_enabled, predictor.diagnosis_cache.enabled = predictor.diagnosis_cache.enabled, False  # every call reaches the stand-in
+    try:
+        with isolated(predictor.gemini, timeout=0.3) as dep:
+            image = leaf_path()
+            assert predictor.predict_disease(image)['disease_name'] == 'Early Blight'
+
+            GEMINI.delay = 1.0
+            for _ in range(2):
+                started = time.perf_counter()
+                assert predictor.predict_disease(image)['disease_name'] == 'Prediction Error'
+                assert time.perf_counter() - started < 0.9
+            calls = GEMINI.calls
+            assert predictor.predict_disease(image)['disease_name'] == 'Prediction Error'
+            assert GEMINI.calls == calls
+            assert (dep.calls, dep.timeouts, dep.short_circuits, dep.breaker.state) == (3, 2, 1, 'open')
+    finally:
+        GEMINI.delay = 0.0
+        predictor._model = None
+        predictor.diagnosis_cache.enabled = cache_enabled
+
+
+def test_sms_server_errors_trip_breaker_but_rejections_do_not():
+    client = Fast2SMSClient(api_key='test-key', url=SMS.url)
+    with isolated(fast2sms, timeout=2.0) as dep:
+        SMS.fail_next(3, status=401)
+        for _ in range(3):
+            try:
+                client.send('OTP 1', ['9876543210'])
+            except SMSError as e:
+                assert e.permanent
+        assert dep.breaker.state == 'closed' and dep.errors == 0
+
+        SMS.fail_next(2, status=503)
+        for _ in range(2):
+            try:
+                client.send('OTP 2', ['9876543210'])
+            except SMSError as e:
+                assert not e.permanent
+        assert dep.breaker.state == 'open' and dep.errors == 2
+        calls = len(SMS.calls)
+        try:
+            client.send('OTP 3', ['9876543210'])
+            raise AssertionError('expected SMSError')
+        except SMSError as e:
+            assert 'unavailable' in str(e) and not e.permanent  # the dispatcher retries it later
+        assert len(SMS.calls) == calls
+    client.close()
+
+
+def test_smtp_hang_times_out_then_fails_fast():
+    connection = SMTPConnection(host='127.0.0.1', port=SMTP.server_address[1], security='none', timeout=10)
+    with isolated(smtp, timeout=0.2, failure_threshold=1) as dep:
+        started = time.perf_counter()
+        try:
+            connection.send('a@example.com', ['b@example.com'], 'Subject: hi\r\n\r\nhi')
+            raise AssertionError('expected a timeout')
+        except smtplib.SMTPServerDisconnected as e:
+            assert outbound.is_timeout(e)
+        assert time.perf_counter() - started < 1 and dep.timeouts == 1
+        connections = SMTP.connections
+        try:
+            connection.send('a@example.com', ['b@example.com'], 'Subject: hi\r\n\r\nhi')
+            raise AssertionError('expected CircuitOpenError')
+        except outbound.CircuitOpenError:
+            pass
+        assert SMTP.connections == connections
+
+
+def test_stats_endpoint_is_local_only():
+    client = app.test_client()
+    stats = client.get('/_stats/outbound').get_json()
+    assert {'data_gov', 'fast2sms', 'gemini', 'smtp'} <= set(stats)
+    assert {'calls', 'errors', 'timeouts', 'circuit', 'latency'} <= set(stats['smtp'])
+    assert client.get('/_stats/outbound', environ_base={'REMOTE_ADDR': '10.0.0.7'}).status_code == 404
+
+
+if __name__ == "__main__":
+    test_breaker_and_histogram()
+    test_price_timeouts_open_breaker_and_keep_last_good_prices()
+    test_price_revalidation_is_single_flight()
+    test_gemini_deadline_falls_back_to_prediction_error()
+    test_sms_server_errors_trip_breaker_but_rejections_do_not()
+    test_smtp_hang_times_out_then_fails_fast()
+    test_stats_endpoint_is_local_only()
+    print("Outbound calls are timed, bounded and circuit-broken.")
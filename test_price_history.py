@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Price history checks: ingest_pages upserts on (date, market, commodity,
+variety) so re-ingesting updates rows instead of duplicating them, unusable
+records are counted and skipped, and the trend queries behind /prices/trends
+default to the 30 days before the latest date and honour explicit windows.
+
+Run with: python -m pytest test_price_history.py
+"""
+
+import os
+import tempfile
+from datetime import date
+
+from app import create_app, init_db
+from models import PriceRecord
+from scripts.price_history import ingest_pages, iter_fixture_pages, market_breakdown, price_trend
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'price_history.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+with app.app_context():
+    init_db()
+
+
+def record(day, market='Lasalgaon', commodity='Garlic', variety='Desi', modal='5000', **fields):
+    return dict({'state': 'Maharashtra', 'district': 'Nashik', 'market': market, 'commodity': commodity,
+                 'variety': variety, 'grade': 'FAQ', 'arrival_date': day,
+                 'min_price': '4000', 'max_price': '6000', 'modal_price': modal}, **fields)
+
+
+def rows(commodity):
+    with app.app_context():
+        return [(r.arrival_date, r.market, r.variety, r.modal_price)
+                for r in PriceRecord.query.filter_by(commodity=commodity).order_by(PriceRecord.arrival_date, PriceRecord.variety)]
+
+
+def test_reingesting_updates_rows_on_the_unique_key():
+    pages = [
+        [record('01/10/2025', commodity='Ginger'), record('01/10/2025', commodity='Ginger', variety='Other')],
+        [record('01/10/2025', commodity='Ginger', modal='5100'),  # same key later in the run: the last one wins
+         record('02/10/2025', commodity='Ginger')],
+    ]
+    with app.app_context():
+        stats = ingest_pages(pages, batch_size=2)
+    assert (stats['pages'], stats['records'], stats['skipped']) == (2, 4, 0)
+    assert rows('Ginger') == [(date(2025, 10, 1), 'Lasalgaon', 'Desi', 5100.0), (date(2025, 10, 1), 'Lasalgaon', 'Other', 5000.0),
+                              (date(2025, 10, 2), 'Lasalgaon', 'Desi', 5000.0)]
+
+    with app.app_context():
+        ingest_pages([[record('02/10/2025', commodity='Ginger', modal='5300', grade='Large')]])
+        updated = PriceRecord.query.filter_by(commodity='Ginger', arrival_date=date(2025, 10, 2)).one()
+        assert (updated.modal_price, updated.grade) == (5300.0, 'Large')
+    assert len(rows('Ginger')) == 3
+
+    # The recorded fixture twice over lands the same rows.
+    with app.app_context():
+        ingest_pages(iter_fixture_pages())
+        count = PriceRecord.query.count()
+        ingest_pages(iter_fixture_pages())
+        assert PriceRecord.query.count() == count
+
+
+def test_unusable_records_are_skipped():
+    pages = [[
+        record('2025-10-01', commodity='Turmeric'),        # not DD/MM/YYYY
+        record(None, commodity='Turmeric'),
+        record('03/10/2025', commodity='Turmeric', market='  '),
+        record('03/10/2025', commodity=''),
+        record('03/10/2025', commodity='Turmeric', modal='NR'),  # kept, without a modal price
+    ]]
+    with app.app_context():
+        stats = ingest_pages(pages)
+    assert (stats['records'], stats['skipped'], stats['upserted']) == (5, 4, 1)
+    assert rows('Turmeric') == [(date(2025, 10, 3), 'Lasalgaon', 'Desi', None)]
+
+
+def seed_garlic():
+    pages = [[record(f'{day:02d}/{month:02d}/2025', market=market, modal=str(4000 + day * 10))
+              for month, day in [(8, 15), (9, 1), (9, 20), (10, 1)] for market in ('Lasalgaon', 'Pune')]]
+    pages[0].append(record('05/10/2025', market='Pune', modal='4600'))
+    with app.app_context():
+        ingest_pages(pages)
+
+
+seed_garlic()
+
+
+def test_trend_windows_default_to_the_last_30_days():
+    with app.app_context():
+        trend = price_trend('Garlic')
+        assert (trend['start'], trend['end']) == ('2025-09-05', '2025-10-05')  # the latest date overall
+        assert [s['date'] for s in trend['series']] == ['2025-09-20', '2025-10-01', '2025-10-05']
+        assert trend['series'][1] == {'date': '2025-10-01', 'min_price': 4000.0, 'max_price': 6000.0,
+                                      'modal_price': 4010.0, 'records': 2}
+        assert trend['summary']['days'] == 3
+
+        lasalgaon = price_trend('Garlic', market='Lasalgaon')
+        assert (lasalgaon['start'], lasalgaon['end']) == ('2025-09-01', '2025-10-01')  # that market's latest date
+        assert [s['date'] for s in lasalgaon['series']] == ['2025-09-01', '2025-09-20', '2025-10-01']
+
+        window = price_trend('Garlic', start=date(2025, 8, 1), end=date(2025, 9, 1))
+        assert [s['date'] for s in window['series']] == ['2025-08-15', '2025-09-01']
+        assert price_trend('Saffron') == {'commodity': 'Saffron', 'market': None, 'start': None, 'end': None,
+                                          'summary': None, 'series': []}
+
+        markets = market_breakdown('Garlic')
+        assert [(m['market'], m['last_date'], m['avg_modal_price']) for m in markets] == \
+            [('Lasalgaon', '2025-10-01', 4105.0), ('Pune', '2025-10-05', 4270.0)]
+        assert [m['last_date'] for m in market_breakdown('Garlic', end=date(2025, 9, 1))] == ['2025-09-01', '2025-09-01']
+        assert market_breakdown('Saffron') == []
+
+
+def test_trends_route_uses_one_window_for_both():
+    client = app.test_client()
+    trend = client.get('/prices/trends?commodity=Garlic&start=2025-09-01&end=2025-09-30').get_json()
+    assert (trend['start'], trend['end']) == ('2025-09-01', '2025-09-30')
+    assert [m['last_date'] for m in trend['markets']] == ['2025-09-20', '2025-09-20']
+    assert 'markets' not in client.get('/prices/trends?commodity=Garlic&market=Pune').get_json()
+    assert client.get('/prices/trends?commodity=Saffron').get_json()['markets'] == []
+    assert client.get('/prices/trends').status_code == 400
+    assert client.get('/prices/trends?commodity=Garlic&start=01/09/2025').status_code == 400
+
+
+if __name__ == "__main__":
+    test_reingesting_updates_rows_on_the_unique_key()
+    test_unusable_records_are_skipped()
+    test_trend_windows_default_to_the_last_30_days()
+    test_trends_route_uses_one_window_for_both()
+    print("Price ingestion upserts, skips bad rows and trend windows line up.")
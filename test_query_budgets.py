@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Query-budget checks for the main pages.
+Seeds a throwaway SQLite database and fails if a route runs more queries than
+its @query_budget allows (e.g. an N+1 lazy load crept into a template).
+
+Run with: python -m pytest test_query_budgets.py
+"""
+
+import os
+import tempfile
+
+from app import create_app, init_db
+from datetime import date
+
+from models import db, User, Product, Conversation, PriceRecord
+from instrumentation import assert_max_queries, QueryBudgetExceeded
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'budget.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+
+def seed(conversations=10, messages_per_conversation=5):
+    with app.app_context():
+        init_db()
+        seller = User(email='seller@example.com', mobile='9000000001', password='x', role='seller')
+        buyer = User(email='buyer@example.com', mobile='9000000002', password='x', role='customer')
+        db.session.add_all([seller, buyer])
+        db.session.flush()
+        for i in range(conversations):
+            product = Product(name=f'Fungicide {i}', category='Products', description='Copper fungicide ' * 20,
+                              price='450', image='rotavator.jpg', seller_id=seller.id)
+            db.session.add(product)
+            db.session.flush()
+            convo = Conversation(product_id=product.id, buyer_id=buyer.id, seller_id=seller.id)
+            db.session.add(convo)
+            db.session.flush()
+            for j in range(messages_per_conversation):
+                convo.add_message(buyer.id if j % 2 else seller.id, f'message {j}')
+        for market in ('Pune', 'Lasalgaon'):
+            db.session.add(PriceRecord(arrival_date=date(2025, 9, 1), state='Maharashtra', market=market,
+                                       commodity='Onion', min_price=1200, max_price=1700, modal_price=1500))
+        db.session.commit()
+        return seller.id, convo.id
+
+
+SELLER_ID, CONVO_ID = seed()
+
+
+def logged_in_client():
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['user_email'], sess['role'] = SELLER_ID, 'seller@example.com', 'seller'
+    return client
+
+
+def test_routes_stay_within_declared_budgets():
+    client = logged_in_client()
+    for url in ['/store', '/store.json', '/store?search=fungicide', '/inbox',
+                f'/conversation/chat/{CONVO_ID}', f'/conversation/{CONVO_ID}/messages?after=0',
+                '/prices/trends?commodity=Onion']:
+        assert client.get(url).status_code == 200, url
+    response = client.post(f'/conversation/{CONVO_ID}/messages', json={'message_text': 'Still available?'})
+    assert response.status_code == 201
+
+
+def test_inbox_query_count_does_not_grow_with_conversations():
+    client = logged_in_client()
+    with assert_max_queries(2):
+        client.get('/inbox')
+
+
+def test_assert_max_queries_reports_statements():
+    client = logged_in_client()
+    try:
+        with assert_max_queries(0):
+            client.get('/store.json')  # /store itself may be answered from the fragment cache
+    except QueryBudgetExceeded as e:
+        assert 'FROM product' in str(e)
+    else:
+        raise AssertionError('expected QueryBudgetExceeded')
+
+
+if __name__ == "__main__":
+    test_routes_stay_within_declared_budgets()
+    test_inbox_query_count_does_not_grow_with_conversations()
+    test_assert_max_queries_reports_statements()
+    print("All routes are within their query budgets.")
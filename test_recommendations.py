@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Recommendation index checks: remedy keywords find matching store products
+through their synonyms, and an expired index is rebuilt by one request at a
+time while the others keep answering from the old one.
+
+Run with: python -m pytest test_recommendations.py
+"""
+
+import os
+import tempfile
+import threading
+
+from app import create_app, init_db
+from models import db, User, Product
+from recommendations import RecommendationIndex
+from search import index_product
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'recommendations.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'RecommendTest'
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        seller = User(email='recommend-seller@example.com', mobile='9600000001', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        product = Product(name='Recommend mancozeb 75 WP', category=CATEGORY, description='Contact fungicide',
+                          price='450', image='x.jpg', seller_id=seller.id)
+        db.session.add(product)
+        db.session.flush()
+        index_product(product)
+        db.session.commit()
+        return product.id
+
+
+PRODUCT_ID = seed()
+
+
+def test_keywords_match_through_synonyms():
+    index = RecommendationIndex()
+    with app.app_context():
+        assert PRODUCT_ID in index.product_ids('Fungicides')
+        assert PRODUCT_ID in [p.id for p in index.suggest('mancozeb')]  # a synonym of fungicide
+        index.product_removed(PRODUCT_ID)
+        assert PRODUCT_ID not in index.product_ids('fungicide')
+
+
+def test_stale_index_is_rebuilt_once_while_others_read_it():
+    index = RecommendationIndex(ttl=300)
+    with app.app_context():
+        index.build()
+    index.invalidate()
+    builds, started, release = [], threading.Event(), threading.Event()
+    original = index.build
+
+    def slow_build():
+        builds.append(threading.current_thread().name)
+        started.set()
+        release.wait(5)
+        original()
+
+    index.build = slow_build
+
+    def lookup():
+        with app.app_context():
+            index.product_ids('fungicide')
+
+    rebuilding = threading.Thread(target=lookup, name='rebuilder')
+    rebuilding.start()
+    assert started.wait(5)
+    try:
+        readers = [threading.Thread(target=lookup) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join(2)
+        assert not any(reader.is_alive() for reader in readers)  # answered from the old index
+    finally:
+        release.set()
+        rebuilding.join(5)
+    assert builds == ['rebuilder']
+    lookup()
+    assert builds == ['rebuilder']  # fresh again
+
+
+if __name__ == "__main__":
+    test_keywords_match_through_synonyms()
+    test_stale_index_is_rebuilt_once_while_others_read_it()
+    print("Recommendations are single-flight and served stale while rebuilding.")
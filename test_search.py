@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Store search checks against the SQLite FTS5 index: English words match
+their stems, Devanagari words match by prefix without being split at their
+matras, and deleting a product takes it out of the index.
+
+Run with: python -m pytest test_search.py
+"""
+
+import os
+import tempfile
+
+from app import create_app, init_db
+from models import db, User, Product
+from search import apply_search, index_product
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'search.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'SearchTest'
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        seller = User(email='search-seller@example.com', mobile='9600000101', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        products = [
+            Product(name='Searchtest knapsack sprayer', category=CATEGORY, description='For spraying pesticides on crops',
+                    price='2500', image='x.jpg', seller_id=seller.id),
+            Product(name='Searchtest कीटनाशक', category=CATEGORY, description='धान और गेहूं के लिए',
+                    price='300', image='x.jpg', seller_id=seller.id),
+        ]
+        db.session.add_all(products)
+        db.session.flush()
+        for product in products:
+            index_product(product)
+        db.session.commit()
+        return seller.id, [p.id for p in products]
+
+
+SELLER_ID, (SPRAYER_ID, PESTICIDE_ID) = seed()
+
+
+def search(term):
+    with app.app_context():
+        return [p.id for p in apply_search(Product.query.filter_by(category=CATEGORY), term)]
+
+
+def test_english_words_match_their_stems():
+    assert search('sprays') == [SPRAYER_ID]  # "sprayer", "spraying" and "sprays" share a stem
+    assert search('pesticide crop') == [SPRAYER_ID]
+    assert search('fungicide') == []
+
+
+def test_devanagari_prefix_match():
+    assert search('कीटना') == [PESTICIDE_ID]
+    assert search('कीटनाशक') == [PESTICIDE_ID]
+    assert search('गेहूं') == [PESTICIDE_ID]
+    assert search('नाशक') == []  # whole words only, not fragments split at a matra
+
+
+def test_deleted_products_leave_the_index():
+    with app.app_context():
+        seller = db.session.get(User, SELLER_ID)
+        product = Product(name='Searchtest drip kit', category=CATEGORY, description='Drip irrigation',
+                          price='900', image='x.jpg', seller_id=seller.id)
+        db.session.add(product)
+        db.session.flush()
+        index_product(product)
+        db.session.commit()
+        product_id = product.id
+    assert search('drip') == [product_id]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['role'] = SELLER_ID, 'seller'
+    assert client.post(f'/delete_product/{product_id}').status_code == 302
+    assert search('drip') == []
+    with app.app_context():
+        hits = db.session.execute(db.text("SELECT count(*) FROM product_fts WHERE rowid = :id"), {'id': product_id})
+        assert hits.scalar() == 0
+
+
+if __name__ == "__main__":
+    test_english_words_match_their_stems()
+    test_devanagari_prefix_match()
+    test_deleted_products_leave_the_index()
+    print("Search stems, prefix-matches Devanagari and drops deleted products.")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Start-up checks: importing app and calling create_app() in a fresh process
+(like a new gunicorn worker, with no GEMINI_API_KEY) creates no database file
+or upload folders, starts no threads and imports none of the deferred
+dependencies. Each app built gets its own extensions and its own database.
+
+Run with: python -m pytest test_startup.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from scripts.bench_startup import DEFERRED, PROJECT_DIR
+
+PROBE = r"""
+import json, sys, threading
+import app
+second = app.create_app({'TESTING': True})
+print(json.dumps({
+    'loaded': [m for m in %r if m in sys.modules],
+    'threads': [t.name for t in threading.enumerate()],
+    'separate': all(app.app.extensions[k] is not second.extensions[k] for k in ('notifications', 'detection_pool', 'uploads', 'recommendations', 'chat_notifier')),
+    'rules': sorted(r.endpoint for r in second.url_map.iter_rules()) == sorted(r.endpoint for r in app.app.url_map.iter_rules()),
+}))
+"""
+
+
+def start_worker(folder):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(folder, 'startup.sqlite'),
+               UPLOAD_FOLDER=os.path.join(folder, 'product_uploads'), LEAF_UPLOAD_FOLDER=os.path.join(folder, 'leaf_uploads'))
+    env.pop('GEMINI_API_KEY', None)
+    env.pop('PREDICTOR_BACKEND', None)
+    result = subprocess.run([sys.executable, '-c', PROBE % (DEFERRED,)], cwd=PROJECT_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_create_app_has_no_side_effects():
+    folder = tempfile.mkdtemp()
+    report = start_worker(folder)
+    assert os.listdir(folder) == []  # no database file, no upload folders
+    assert report['loaded'] == []
+    assert report['threads'] == ['MainThread']
+    assert report['separate'] and report['rules']
+
+
+def test_apps_keep_their_own_databases():
+    from app import create_app, init_db
+    from models import db, User
+
+    apps = [create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'own.sqlite'), 'TESTING': True})
+            for _ in range(2)]
+    for app in apps:
+        with app.app_context():
+            init_db()
+    with apps[0].app_context():
+        db.session.add(User(email='startup-own@example.com', mobile='9600000401', password='x', role='customer'))
+        db.session.commit()
+    counts = []
+    for app in apps:
+        with app.app_context():
+            counts.append(User.query.filter_by(email='startup-own@example.com').count())
+    assert counts == [1, 0]
+    assert apps[0].extensions['recommendations'] is not apps[1].extensions['recommendations']
+
+
+if __name__ == "__main__":
+    test_create_app_has_no_side_effects()
+    test_apps_keep_their_own_databases()
+    print("Importing the app and creating it touch nothing.")
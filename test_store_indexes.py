@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Index checks for the store queries.
+Seeds a throwaway SQLite database, runs EXPLAIN QUERY PLAN on each store
+listing (category browsing, price range filters, price sorts) and fails if
+SQLite would scan the product table or sort rows in a temp b-tree instead of
+walking an index.
+
+Run with: python -m pytest test_store_indexes.py
+"""
+
+import os
+import tempfile
+
+from sqlalchemy import text
+
+from app import build_store_query, create_app, init_db
+from models import db, User, Product, parse_price
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'store_indexes.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+
+CATEGORIES = ('Products', 'Tools', 'Seeds', 'Others')
+
+
+def seed(products=200):
+    with app.app_context():
+        init_db()
+        seller = User(email='index-seller@example.com', mobile='9000000101', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        for i in range(products):
+            price = f'₹{(i * 37) % 2000 + 50:,}/kg' if i % 10 else 'Call for price'
+            amount, unit = parse_price(price)
+            db.session.add(Product(name=f'Item {i}', category=CATEGORIES[i % 4], description='Seeded item',
+                                   price=price, price_amount=amount, price_unit=unit, image='x.jpg', seller_id=seller.id))
+        db.session.commit()
+
+
+seed()
+
+
+def query_plan(**filters):
+    with app.app_context():
+        statement = build_store_query(**filters).limit(25).statement
+        sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        return [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+def assert_uses_index(index_name, **filters):
+    plan = query_plan(**filters)
+    listing = '\n'.join(plan)
+    assert any(index_name in step for step in plan if 'product' in step), f"{filters} does not use {index_name}:\n{listing}"
+    assert not any('TEMP B-TREE' in step for step in plan), f"{filters} sorts in a temp b-tree:\n{listing}"
+    assert not any(step.startswith('SCAN product') and 'INDEX' not in step for step in plan), f"{filters} scans product:\n{listing}"
+
+
+def test_category_browsing_uses_category_id_index():
+    assert_uses_index('ix_product_category_id', category='Tools')
+    assert_uses_index('ix_product_category_id', category='Tools', after=(None, 150))
+
+
+def test_price_sorts_use_price_indexes():
+    assert_uses_index('ix_product_category_price', category='Seeds', sort='price_asc')
+    assert_uses_index('ix_product_category_price', category='Seeds', sort='price_desc', after=(900.0, 42))
+    assert_uses_index('ix_product_price_amount', sort='price_asc')
+
+
+def test_price_range_uses_price_index():
+    assert_uses_index('ix_product_category_price', category='Products', sort='price_asc', min_price=100, max_price=500)
+    assert_uses_index('ix_product_price_amount', sort='price_desc', min_price=1000)
+
+
+def test_price_sort_and_range_results():
+    client = app.test_client()
+    first = client.get('/store.json?category=Tools&sort=price_asc&min_price=100&max_price=1500&per_page=10').get_json()
+    second = client.get(first['next_url']).get_json()
+    amounts = [p['price_amount'] for p in first['products'] + second['products']]
+    assert amounts == sorted(amounts)
+    assert all(100 <= a <= 1500 for a in amounts)
+    assert all(p['category'] == 'Tools' and p['price_unit'] == 'kg' for p in first['products'])
+
+
+if __name__ == "__main__":
+    test_category_browsing_uses_category_id_index()
+    test_price_sorts_use_price_indexes()
+    test_price_range_uses_price_index()
+    test_price_sort_and_range_results()
+    print("Store queries use their indexes.")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Store paging checks: following next_url through /store.json visits every
+product exactly once, for each sort and for search results, even when
+sellers add products while a buyer is part way through the pages.
+
+Run with: python -m pytest test_store_paging.py
+"""
+
+import os
+import tempfile
+
+from app import create_app, init_db
+from models import db, User, Product, parse_price
+from search import index_product
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'store_paging.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'PagingTest'
+
+
+def seller_id():
+    with app.app_context():
+        init_db()
+        seller = User(email='paging-seller@example.com', mobile='9600000201', password='x', role='seller')
+        db.session.add(seller)
+        db.session.commit()
+        return seller.id
+
+
+SELLER_ID = seller_id()
+
+
+def add_products(label, count):
+    with app.app_context():
+        products = []
+        for i in range(count):
+            price = f'₹{(i % 4) * 100 + 100}'  # repeated prices, so pages split runs of equal amounts
+            amount, unit = parse_price(price)
+            products.append(Product(name=f'Pagingtest {label} {i}', category=CATEGORY, description='Paging seed',
+                                    price=price, price_amount=amount, price_unit=unit, image='x.jpg', seller_id=SELLER_ID))
+        db.session.add_all(products)
+        db.session.flush()
+        for product in products:
+            index_product(product)
+        db.session.commit()
+        return {p.id: p.price_amount for p in products}
+
+
+def walk(query, label):
+    """
+    Seeds products, then pages through /store.json, adding more after the
+    first page. Returns the ids seen in order, and the ids seeded before and after.
+    """
+    existing = add_products(label, 17)
+    client = app.test_client()
+    page = client.get(f'/store.json?category={CATEGORY}&per_page=5&{query}').get_json()
+    seen = [p['id'] for p in page['products']]
+    added = add_products(f'{label} late', 6)
+    while page['next_url']:
+        page = client.get(page['next_url']).get_json()
+        seen += [p['id'] for p in page['products']]
+    return seen, existing, added
+
+
+def test_newest_first_paging_is_stable_across_inserts():
+    seen, existing, added = walk('', 'newest')
+    assert len(seen) == len(set(seen))
+    assert set(existing) <= set(seen)
+    assert not set(added) & set(seen)  # newer than the first page, so they belong above it
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_price_paging_is_stable_across_inserts():
+    seen, existing, added = walk('sort=price_asc', 'price')
+    amounts = {**existing, **added}
+    assert len(seen) == len(set(seen))
+    assert set(existing) <= set(seen)
+    ours = [amounts[i] for i in seen if i in amounts]
+    assert ours == sorted(ours)
+
+
+def test_search_paging_is_stable_across_inserts():
+    seen, existing, added = walk('search=pagingtest+search', 'search')
+    assert len(seen) == len(set(seen))
+    assert set(existing) <= set(seen)
+
+
+if __name__ == "__main__":
+    test_newest_first_paging_is_stable_across_inserts()
+    test_price_paging_is_stable_across_inserts()
+    test_search_paging_is_stable_across_inserts()
+    print("Store pages neither repeat nor skip products when new ones are added.")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Upload storage checks: uploads land at sharded content-hash paths, identical
+photos are stored once with a reference count, metadata is stripped whatever
+the real format, they are served immutable, and gc-uploads reclaims unreferenced product images and old leaf photos.
+
+Run with: python -m pytest test_uploads.py
+"""
+
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import uploads
+from app import create_app, init_db
+from models import db, User, Product, DetectionJob, StoredUpload
+
+# Each test module gets its own app on a throwaway database, with the offline predictor.
+app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'uploads.sqlite'),
+                  'PREDICTOR_BACKEND': 'stub', 'TESTING': True})
+CATEGORY = 'UploadTest'
+
+
+def use_temp_stores():
+    """Keeps test uploads out of static/: every store gets a fresh temp folder."""
+    stores = {
+        'product': uploads.UploadStore('product', tempfile.mkdtemp(), thumbnails=True),
+        'leaf': uploads.UploadStore('leaf', tempfile.mkdtemp(), inference=True),
+    }
+    app.extensions['uploads'] = stores
+    return stores
+
+
+def seed():
+    with app.app_context():
+        init_db()
+        sellers = [User(email=f'upload-seller{i}@example.com', mobile=f'950000000{i}', password='x', role='seller')
+                   for i in range(2)]
+        db.session.add_all(sellers)
+        db.session.commit()
+        return [s.id for s in sellers]
+
+
+SELLER_IDS = seed()
+
+
+def photo(color, size=(800, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def seller_client(index):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['role'] = SELLER_IDS[index], 'seller'
+    return client
+
+
+def add_product(index, name, data, filename='IMG_0001.jpg'):
+    response = seller_client(index).post('/add_product', data={
+        'name': name, 'category': CATEGORY, 'description': 'Test listing', 'price': '100',
+        'image': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+    assert response.status_code == 302
+    with app.app_context():
+        return db.session.query(Product.id, Product.image).filter_by(name=name).one()
+
+
+def refcount(kind, name):
+    with app.app_context():
+        row = StoredUpload.query.filter_by(kind=kind, path=name).one_or_none()
+        return row.refcount if row else None
+
+
+def age(kind, name, days):
+    with app.app_context():
+        StoredUpload.query.filter_by(kind=kind, path=name).update(
+            {'last_used_at': datetime.utcnow() - timedelta(days=days)})
+        db.session.commit()
+
+
+def gc(**kwargs):
+    with app.app_context():
+        return uploads.collect_garbage(app.extensions['uploads'], **kwargs)
+
+
+def test_identical_uploads_are_stored_once():
+    stores = use_temp_stores()
+    green = photo((40, 160, 40))
+    first = add_product(0, 'Upload sprayer A', green)
+    second = add_product(1, 'Upload sprayer B', green)
+    other = add_product(1, 'Upload sprayer C', photo((160, 40, 40)))  # same filename, different photo
+
+    assert uploads.is_content_addressed(first.image) and first.image.count('/') == 2
+    assert first.image == second.image and other.image != first.image
+    assert refcount('product', first.image) == 2 and refcount('product', other.image) == 1
+    store = stores['product']
+    for name in (first.image, other.image):
+        for variant in ('', '.thumb.webp', '.thumb.jpg'):
+            path = store.path(name.rsplit('.', 1)[0] + variant) if variant else store.path(name)
+            assert os.path.exists(path), path
+    assert os.listdir(store.path(uploads.TMP_DIR)) == []
+
+
+def gps_exif():
+    exif = Image.Exif()
+    exif[0x8825] = {1: 'N', 2: (18.0, 31.0, 12.0), 3: 'E', 4: (73.0, 51.0, 3.0)}  # GPSInfo near Pune
+    return exif
+
+
+def test_metadata_stripped_from_every_format():
+    store = use_temp_stores()['product']
+    # Phone cameras save MPO (a JPEG plus a depth/preview frame) under .jpg.
+    mpo = io.BytesIO()
+    Image.new('RGB', (640, 480), (30, 120, 30)).save(mpo, 'MPO', save_all=True, exif=gps_exif(),
+                                                      append_images=[Image.new('RGB', (640, 480))])
+    webp = io.BytesIO()
+    Image.new('RGB', (640, 480), (120, 30, 30)).save(webp, 'WEBP', exif=gps_exif())
+    for name, data in (('Upload MPO sprayer', mpo.getvalue()), ('Upload WebP sprayer', webp.getvalue())):
+        with Image.open(io.BytesIO(data)) as raw:
+            assert raw.format in ('MPO', 'WEBP') and raw.getexif().get(0x8825)
+        product = add_product(0, name, data, filename='IMG_0002.jpg')
+        with Image.open(store.path(product.image)) as stored:
+            assert stored.format == 'JPEG' and not stored.getexif()
+
+
+def test_uploads_served_immutable():
+    stores = use_temp_stores()
+    product = add_product(0, 'Upload tiller', photo((20, 20, 200)))
+    client = app.test_client()
+    with app.test_request_context():
+        thumb = uploads.upload_thumbnail('product', product.image)
+    assert thumb['webp'].endswith('.thumb.webp')
+    response = client.get(thumb['webp'])
+    assert response.status_code == 200 and response.mimetype == 'image/webp'
+    assert response.headers['Cache-Control'] == f'public, max-age={uploads.UPLOAD_MAX_AGE}, immutable'
+    assert client.get(thumb['webp'], headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # Files from before content addressing are still served, but revalidated.
+    Image.new('RGB', (10, 10)).save(stores['product'].path('legacy.jpg'))
+    legacy = client.get('/uploads/product/legacy.jpg')
+    assert legacy.status_code == 200 and 'immutable' not in legacy.headers.get('Cache-Control', '')
+    assert client.get('/uploads/product/../../app.py').status_code == 404
+    assert client.get('/uploads/product/.tmp/anything').status_code == 404
+
+
+def test_gc_reclaims_unreferenced_product_images():
+    stores = use_temp_stores()
+    shared = photo((200, 200, 20))
+    first = add_product(0, 'Upload seeder A', shared)
+    second = add_product(1, 'Upload seeder B', shared)
+    store = stores['product']
+
+    assert seller_client(0).post(f'/delete_product/{first.id}').status_code == 302
+    assert refcount('product', first.image) == 1
+    assert gc(grace=0)['product']['files'] == 0
+    assert os.path.exists(store.path(first.image))
+
+    assert seller_client(1).post(f'/delete_product/{second.id}').status_code == 302
+    assert refcount('product', first.image) == 0
+    assert gc(grace=3600)['product']['files'] == 0  # still inside the grace window
+    age('product', first.image, 1)
+    assert gc(grace=3600, dry_run=True)['product']['files'] == 1
+    assert os.path.exists(store.path(first.image))
+    assert gc(grace=3600)['product']['files'] == 1
+    assert not os.listdir(os.path.dirname(store.path(first.image)))
+    assert refcount('product', first.image) is None
+
+    # Untracked files: an orphan goes, a legacy image a product still uses stays.
+    old = time.time() - 7200
+    for name in ('orphan.jpg', 'kept.jpg'):
+        Image.new('RGB', (10, 10)).save(store.path(name))
+        os.utime(store.path(name), (old, old))
+    with app.app_context():
+        db.session.add(Product(name='Upload legacy', category=CATEGORY, description='Old', price='1',
+                               image='kept.jpg', seller_id=SELLER_IDS[0]))
+        db.session.commit()
+    assert gc(grace=3600)['product']['files'] == 1
+    assert not os.path.exists(store.path('orphan.jpg')) and os.path.exists(store.path('kept.jpg'))
+
+
+def test_gc_never_deletes_a_file_an_upload_just_matched():
+    stores = use_temp_stores()
+    store, data = stores['product'], photo((10, 90, 90))
+    product = add_product(0, 'Upload harrow', data)
+    assert seller_client(0).post(f'/delete_product/{product.id}').status_code == 302
+    age('product', product.image, 1)
+
+    # The same photo is uploaded again while gc-uploads is removing the files.
+    def upload_again():
+        with app.app_context():
+            assert store.save(FileStorage(io.BytesIO(data), 'IMG_0003.jpg')) == product.image
+            db.session.commit()
+
+    remove = store.remove
+    def remove_during_upload(name):
+        uploader = threading.Thread(target=upload_again)
+        uploader.start()
+        uploader.join(0.5)  # blocks on the row gc-uploads is deleting
+        freed = remove(name)
+        threads.append(uploader)
+        return freed
+
+    threads = []
+    store.remove = remove_during_upload
+    try:
+        assert gc(grace=3600)['product']['files'] == 1
+    finally:
+        store.remove = remove
+    threads[0].join()
+    assert refcount('product', product.image) == 1
+    assert os.path.exists(store.path(product.image))
+    assert os.path.exists(store.path(product.image.rsplit('.', 1)[0] + '.thumb.webp'))
+
+
+def test_leaf_uploads_age_out():
+    stores = use_temp_stores()
+    client = app.test_client()
+    response = client.post('/detect/jobs', data={'leaf_image': (io.BytesIO(photo((90, 140, 30))), 'leaf.jpg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    deadline = time.monotonic() + 30
+    while client.get(status_url).get_json()['status'] not in ('done', 'failed') and time.monotonic() < deadline:
+        time.sleep(0.02)
+    with app.app_context():
+        name = db.session.get(DetectionJob, response.get_json()['job_id']).image
+    store = stores['leaf']
+    assert uploads.is_content_addressed(name)
+    assert os.path.exists(store.path(name.rsplit('.', 1)[0] + '.infer.jpg'))
+
+    assert gc(leaf_retention_days=30)['leaf']['files'] == 0
+    age('leaf', name, 31)
+    with app.app_context():
+        DetectionJob.query.filter_by(image=name).update({'created_at': datetime.utcnow() - timedelta(days=31)})
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['gc-uploads'])
+    assert 'Deleted 1 leaf files' in result.output
+    assert not os.path.exists(store.path(name))
+
+
+if __name__ == "__main__":
+    test_identical_uploads_are_stored_once()
+    test_metadata_stripped_from_every_format()
+    test_uploads_served_immutable()
+    test_gc_reclaims_unreferenced_product_images()
+    test_gc_never_deletes_a_file_an_upload_just_matched()
+    test_leaf_uploads_age_out()
+    print("Uploads are content-addressed, deduplicated, served immutable and garbage-collected.")
@@ -0,0 +1,342 @@
+# uploads.py
+# Content-addressed storage for user uploads: product photos and leaf photos.
+#
+# An upload is hashed (sha256) while it streams to a private temp directory,
+# normalized there (image_utils), and moved to <folder>/ab/cd/<sha256>.<ext>
+# with its variants beside it, the original last, so a visible original
+# always has its variants. Identical photos share one set of files and two
+# sellers' IMG_0001.jpg never overwrite each other. A content path never
+# points at different bytes, so /uploads/<kind>/... serves it with a one-year
+# immutable Cache-Control.
+#
+# Every stored file has a StoredUpload row counting the rows that point at it
+# (Product.image, DetectionJob.image), updated in the same transaction as
+# those rows. `flask --app app gc-uploads` (from cron, like send-notifications)
+# then deletes:
+#   - product images nothing references, once UPLOAD_GC_GRACE has passed
+#     since their last release,
+#   - leaf photos not uploaded again for LEAF_RETENTION_DAYS, and the
+#     DetectionJob rows created before that window,
+#   - untracked files past the same windows: uploads saved before this layout
+#     that no product uses, and files left by requests that failed before
+#     their commit.
+# Files saved under the old flat names keep working and are served without
+# the immutable header.
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import abort, current_app, send_from_directory, url_for
+from flask.cli import with_appcontext
+from sqlalchemy import update
+from werkzeug.security import safe_join
+
+from image_utils import MAX_UPLOAD_BYTES, existing_variant, normalize_image, save_stream, variant_filename
+from models import db, DetectionJob, Product, StoredUpload
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+TMP_DIR = '.tmp'  # per-upload staging directories, on the same filesystem as the store so moves are atomic
+CONTENT_PATH_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(?:\.[a-z0-9]+)+$')  # originals and variants
+VARIANT_SUFFIX_RE = re.compile(r'\.(?:thumb\.webp|thumb\.jpg|infer\.jpg)$')
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+
+def content_path(digest, ext):
+    """ab/cd/abcd...(64 hex).jpg: two directory levels keep any one directory small."""
+    ext = ext.lower()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{EXTENSION_ALIASES.get(ext, ext)}"
+
+
+def is_content_addressed(name):
+    return CONTENT_PATH_RE.match(name) is not None
+
+
+def _stem(name):
+    """ab/cd/<digest>.jpg and ab/cd/<digest>.thumb.webp -> ab/cd/<digest>: what an original shares with its variants."""
+    return VARIANT_SUFFIX_RE.sub('', name).rsplit('.', 1)[0]
+
+
+# --- Storage ---
+class UploadStore:
+    """The files of one upload kind under `folder`, with the variants that kind needs."""
+
+    def __init__(self, kind, folder, thumbnails=False, inference=False, max_bytes=MAX_UPLOAD_BYTES):
+        self.kind = kind
+        self.folder = os.path.join(PROJECT_DIR, folder)
+        self.thumbnails = thumbnails
+        self.inference = inference
+        self.max_bytes = max_bytes
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def variant(self, name, kind):
+        """Path of a variant of `name`, or of the original for uploads saved before variants existed."""
+        return self.path(existing_variant(self.folder, name, kind))
+
+    def staging_dir(self):
+        """A new private directory under the store's .tmp; files in it can be moved into the store atomically."""
+        parent = self.path(TMP_DIR)
+        os.makedirs(parent, exist_ok=True)
+        return tempfile.mkdtemp(dir=parent)
+
+    def save(self, file):
+        """
+        Streams a werkzeug FileStorage into the store and records one more
+        reference to it in the current transaction. Returns its content path.
+        Raises UploadError.
+        """
+        ext = file.filename.rsplit('.', 1)[1] if '.' in file.filename else 'jpg'
+        staging = self.staging_dir()
+        try:
+            raw = os.path.join(staging, 'upload')
+            hasher = hashlib.sha256()
+            save_stream(file.stream, raw, self.max_bytes, hasher)
+            name = content_path(hasher.hexdigest(), ext)
+            # Retained before looking for the file: the upsert waits on a gc-uploads
+            # deleting this row, which removes the files before it commits, so a
+            # file seen here is never one about to go.
+            retain(self.kind, name, os.path.getsize(raw))
+            if not os.path.exists(self.path(name)):
+                self._publish(raw, name, staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return name
+
+    def _publish(self, raw, name, staging):
+        staged = os.path.join(staging, os.path.basename(name))
+        os.replace(raw, staged)
+        variants = normalize_image(staged, thumbnails=self.thumbnails, inference=self.inference)
+        target = os.path.dirname(self.path(name))
+        os.makedirs(target, exist_ok=True)
+        for key, filename in variants.items():
+            if key != 'original':
+                os.replace(os.path.join(staging, filename), os.path.join(target, filename))
+        os.replace(staged, self.path(name))
+
+    def save_file(self, digest, ext, path):
+        """
+        Publishes an already-hashed file from a staging_dir(), normalized there
+        first like save(). Does not retain it: like save(), callers retain the
+        name before publishing (see /detect/batch). Returns its content path.
+        Raises UploadError.
+        """
+        name = content_path(digest, ext)
+        if os.path.exists(self.path(name)):
+            os.remove(path)
+        else:
+            self._publish(path, name, os.path.dirname(path))
+        return name
+
+    def remove(self, name):
+        """Deletes a stored file and its variants. Returns the bytes freed."""
+        freed = 0
+        for path in [self.path(name)] + [self.path(variant_filename(name, kind))
+                                         for kind in ('thumb_webp', 'thumb_jpg', 'inference')]:
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+        return freed
+
+
+# --- Reference counts ---
+def _upsert_statement():
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Upload storage does not support the {dialect_name} dialect.")
+    table = StoredUpload.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.kind, table.c.path],
+        set_={'refcount': table.c.refcount + 1, 'last_used_at': stmt.excluded.last_used_at,
+              'size': stmt.excluded.size},
+    )
+
+
+def retain(kind, name, size=0):
+    """One more row points at kind/name. Runs in the caller's transaction."""
+    now = datetime.utcnow()
+    db.session.execute(_upsert_statement(), {'kind': kind, 'path': name, 'size': size, 'refcount': 1,
+                                             'created_at': now, 'last_used_at': now})
+
+
+def release(kind, name):
+    """One row fewer points at kind/name (no-op for uploads saved before content addressing)."""
+    if not is_content_addressed(name):
+        return
+    db.session.execute(
+        update(StoredUpload)
+        .where(StoredUpload.kind == kind, StoredUpload.path == name, StoredUpload.refcount > 0)
+        .values(refcount=StoredUpload.refcount - 1, last_used_at=datetime.utcnow()))
+
+
+# --- Garbage collection ---
+def _reclaim_rows(store, criteria, stats, dry_run):
+    rows = db.session.query(StoredUpload.id, StoredUpload.path, StoredUpload.last_used_at).filter(
+        StoredUpload.kind == store.kind, *criteria).all()
+    for row_id, name, last_used_at in rows:
+        if dry_run:
+            stats['files'] += 1
+            continue
+        # Only if nobody retained it since we looked; a concurrent upload of the same bytes keeps it.
+        deleted = db.session.execute(
+            StoredUpload.__table__.delete().where(
+                StoredUpload.id == row_id, StoredUpload.last_used_at == last_used_at, *criteria)).rowcount
+        if deleted:
+            # Removed while the delete still holds the row, so an upload retaining it
+            # now waits, then finds the file gone and publishes it again.
+            stats['files'] += 1
+            stats['bytes'] += store.remove(name)
+        db.session.commit()
+
+
+def _sweep_untracked(store, keep, cutoff, stats, dry_run):
+    """Files under the store that no row tracks or references, older than cutoff (a Unix time)."""
+    if not os.path.isdir(store.folder):
+        return
+    for directory, subdirs, files in os.walk(store.folder):
+        if os.path.basename(directory) == TMP_DIR:
+            # Staging directories of requests that died mid-upload.
+            for subdir in subdirs:
+                path = os.path.join(directory, subdir)
+                if os.path.getmtime(path) < cutoff and not dry_run:
+                    shutil.rmtree(path, ignore_errors=True)
+            subdirs[:] = []
+            continue
+        for filename in files:
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, store.folder).replace(os.sep, '/')
+            if _stem(name) in keep or os.path.getmtime(path) >= cutoff:
+                continue
+            stats['files'] += 1
+            if not dry_run:
+                stats['bytes'] += os.path.getsize(path)
+                os.remove(path)
+
+
+def _prune_jobs(cutoff, dry_run):
+    """Deletes DetectionJob rows created before cutoff, whose photos age out with them. Returns how many."""
+    old = DetectionJob.query.filter(DetectionJob.created_at < cutoff)
+    if dry_run:
+        return old.count()
+    deleted = old.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def collect_garbage(stores, grace=3600, leaf_retention_days=30, dry_run=False):
+    """
+    Deletes unreferenced product images older than `grace` seconds and leaf
+    photos older than leaf_retention_days, tracked or not, with the detection
+    jobs of that age. Returns {kind: {'files', 'bytes'}}, plus 'jobs' for
+    leaf. With dry_run only counts what would go.
+    """
+    windows = {'product': timedelta(seconds=grace), 'leaf': timedelta(days=leaf_retention_days)}
+    results = {}
+    for kind, store in stores.items():
+        stats = results[kind] = {'files': 0, 'bytes': 0}
+        cutoff = datetime.utcnow() - windows[kind]
+        # Everything tracked or referenced right now; files written after this are younger than the cutoff.
+        keep = {_stem(path) for path, in db.session.query(StoredUpload.path).filter(StoredUpload.kind == kind)}
+        if kind == 'product':
+            keep.update(_stem(name) for name, in db.session.query(Product.image).distinct())
+        else:
+            keep.update(_stem(name) for name, in db.session.query(DetectionJob.image).filter(
+                DetectionJob.created_at >= cutoff).distinct())
+            stats['jobs'] = _prune_jobs(cutoff, dry_run)
+
+        criteria = [StoredUpload.last_used_at < cutoff]
+        if kind == 'product':
+            criteria.append(StoredUpload.refcount <= 0)
+        _reclaim_rows(store, criteria, stats, dry_run)
+        _sweep_untracked(store, keep, time.time() - windows[kind].total_seconds(), stats, dry_run)
+    return results
+
+
+# --- Serving ---
+def get_store(kind):
+    return current_app.extensions['uploads'][kind]
+
+
+def serve_upload(kind, filename):
+    store = get_store(kind)
+    if safe_join(store.folder, filename) is None or filename.startswith(TMP_DIR):
+        abort(404)
+    if not is_content_addressed(filename):
+        # Flat legacy names can be overwritten by a later upload, so they are always revalidated.
+        return send_from_directory(store.folder, filename, max_age=0)
+    # <digest>.thumb.webp: the digest plus the variant is a strong ETag for this exact file.
+    response = send_from_directory(store.folder, filename, max_age=UPLOAD_MAX_AGE,
+                                   etag=os.path.basename(filename))
+    response.headers['Cache-Control'] = f'public, max-age={UPLOAD_MAX_AGE}, immutable'
+    return response
+
+
+def upload_url(kind, name):
+    return url_for('upload', kind=kind, filename=name)
+
+
+def upload_thumbnail(kind, name):
+    """URLs of a store card thumbnail (WebP + JPEG fallback), falling back to the original upload."""
+    store = get_store(kind)
+    webp = existing_variant(store.folder, name, 'thumb_webp')
+    return {
+        'webp': upload_url(kind, webp) if webp != name else None,
+        'jpg': upload_url(kind, existing_variant(store.folder, name, 'thumb_jpg')),
+    }
+
+
+# --- CLI ---
+@click.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+@with_appcontext
+def gc_uploads_command(dry_run):
+    """Deletes unreferenced product images, and leaf photos and detection jobs past LEAF_RETENTION_DAYS. Run from cron, off-peak."""
+    started = time.perf_counter()
+    results = collect_garbage(current_app.extensions['uploads'], grace=current_app.config['UPLOAD_GC_GRACE'],
+                              leaf_retention_days=current_app.config['LEAF_RETENTION_DAYS'], dry_run=dry_run)
+    verb = 'Would delete' if dry_run else 'Deleted'
+    for kind, stats in results.items():
+        size = f" ({stats['bytes'] / (1024 * 1024):.1f} MB)" if not dry_run else ''
+        jobs = f" and {stats['jobs']} detection jobs" if 'jobs' in stats else ''
+        click.echo(f"{verb} {stats['files']} {kind} files{size}{jobs}.")
+    click.echo(f"Done in {time.perf_counter() - started:.1f}s.")
+
+
+# --- Flask wiring ---
+def init_app(app):
+    """
+    Config:
+      UPLOAD_FOLDER          product photos (default static/product_uploads)
+      LEAF_UPLOAD_FOLDER     leaf photos sent for diagnosis (default static/leaf_uploads)
+      UPLOAD_GC_GRACE        seconds an unreferenced product image is kept before gc-uploads deletes it
+      LEAF_RETENTION_DAYS    days a leaf photo is kept after its last upload
+    """
+    app.config.setdefault('UPLOAD_FOLDER', os.getenv('UPLOAD_FOLDER', 'static/product_uploads'))
+    app.config.setdefault('LEAF_UPLOAD_FOLDER', os.getenv('LEAF_UPLOAD_FOLDER', 'static/leaf_uploads'))
+    app.config.setdefault('UPLOAD_GC_GRACE', int(os.getenv('UPLOAD_GC_GRACE', 3600)))
+    app.config.setdefault('LEAF_RETENTION_DAYS', int(os.getenv('LEAF_RETENTION_DAYS', 30)))
+    app.extensions['uploads'] = {
+        'product': UploadStore('product', app.config['UPLOAD_FOLDER'], thumbnails=True),
+        'leaf': UploadStore('leaf', app.config['LEAF_UPLOAD_FOLDER'], inference=True),
+    }
+    app.add_url_rule('/uploads/<any(product, leaf):kind>/<path:filename>', 'upload', serve_upload)
+    app.add_template_global(upload_url)
+    app.add_template_global(upload_thumbnail)
+    app.cli.add_command(gc_uploads_command)
+    return app